@@ -0,0 +1,65 @@
+"""Cold start benchmark for the Jenkins Lambdas
+
+Measures, each in a fresh interpreter so nothing is cached:
+  - import time of each handler module (the Lambda init phase)
+  - the cost of building every client up front, the old behaviour
+  - the cost of the lazy client registry when an invocation only uses s3
+
+Runs offline: boto3 clients are built but never called.
+
+    python modules/jenkins/benchmarks/cold_start.py [runs]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+SCENARIOS = {
+    "import jenkins_trigger": """
+import jenkins_trigger
+""",
+    "import cost_optimizer": """
+import cost_optimizer
+""",
+    "eager clients (ec2, autoscaling, s3)": """
+import boto3
+for service in ("ec2", "autoscaling", "s3"):
+    boto3.client(service)
+""",
+    "lazy registry, s3 used": """
+from aws_clients import get_client
+ec2, autoscaling, s3 = get_client("ec2"), get_client("autoscaling"), get_client("s3")
+s3.meta
+""",
+}
+
+TIMER = """
+import json, sys, time
+sys.path.insert(0, {lambda_dir!r})
+started = time.perf_counter()
+{body}
+print(json.dumps(time.perf_counter() - started))
+"""
+
+def run_scenario(body):
+    """Run one scenario in a fresh interpreter and return its duration in ms"""
+
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "eu-west-1"))
+    output = subprocess.check_output(
+        [sys.executable, "-c", TIMER.format(lambda_dir=LAMBDA_DIR, body=body)],
+        env=env
+    )
+    return json.loads(output.decode().strip().splitlines()[-1]) * 1000.0
+
+def main(runs=5):
+    print(f"{'scenario':40} {'p50 ms':>10} {'max ms':>10}")
+    for name, body in SCENARIOS.items():
+        durations = [run_scenario(body) for _ in range(runs)]
+        print(f"{name:40} {statistics.median(durations):10.1f} {max(durations):10.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,460 @@
+"""End-to-end benchmark for the Jenkins Lambdas against local stand-ins
+
+Runs parse_event, trigger_jenkins_build, both handlers, generate_cost_report
+and the agent scaling paths in-process against FakeAWS and a local
+JenkinsStub (see fakes.py), so nothing reaches AWS or a real Jenkins.
+
+For every scenario it reports p50/p99 latency, AWS calls and Jenkins
+requests per invocation, and the peak memory allocated during one
+invocation (the in-process fakes included). Cold scenarios reset the
+container state - clients, resource caches, the Jenkins connection pool and
+crumb, price cache - before every invocation; warm scenarios keep it, as a
+warm Lambda container would. Module import time is measured by
+cold_start.py.
+
+    python modules/jenkins/benchmarks/end_to_end.py [--runs N] [--only NAME]
+        [--jenkins-boot-delay SECONDS] [--jenkins-latency-ms MS] [--aws-latency-ms MS]
+        [--json PATH] [--baseline PATH] [--tolerance FRACTION]
+
+--json writes the results; --baseline compares them with an earlier --json
+file from the same machine and exits 1 when AWS calls or Jenkins requests
+per invocation went up, or a p50 grew by more than the tolerance.
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+from fakes import FakeAWS, JenkinsStub, install_fake_aws  # noqa: E402
+
+BUCKET = "bench-jenkins-artifacts"
+FUNCTION_NAME = "bench-jenkins-trigger"
+JENKINS_USER = "admin"
+JENKINS_PASSWORD = "bench"
+
+BASE_AGENTS = 2
+SCALE_IN_AGENTS = 6
+REPORT_AGENTS = 20
+FANOUT_JOBS = 8
+BATCH_RECORDS = 100
+
+# Scenarios that wait for Jenkins to boot run at most this many times
+BOOT_RUNS = 5
+
+# p50 changes below this are noise, whatever the tolerance; call counts may
+# drift this much per invocation (readiness probes back off with jitter)
+MIN_LATENCY_REGRESSION_MS = 1.0
+CALL_COUNT_SLACK = 0.5
+
+GITHUB_PUSH = {
+    "ref": "refs/heads/main",
+    "repository": {"name": "bench-app", "full_name": "example/bench-app"},
+    "pusher": {"name": "bench"},
+    "head_commit": {"id": "0" * 40, "message": "Benchmark commit"}
+}
+
+BUILD_PARAMS = {
+    "job_name": "bench-app",
+    "trigger_type": "api_gateway",
+    "branch": "main",
+    "repository": "bench-app",
+    "build_parameters": {"ENVIRONMENT": "dev"}
+}
+
+class BenchContext:
+    """Lambda context stand-in"""
+
+    function_name = FUNCTION_NAME
+
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+class Bench:
+    """Fakes, fleet and Lambda modules shared by every scenario"""
+
+    def __init__(self, jenkins_boot_delay=1.0, jenkins_latency=0.002, aws_latency=0.0):
+        self.jenkins_boot_delay = jenkins_boot_delay
+        self.jenkins = JenkinsStub(boot_delay=0.0, latency=jenkins_latency,
+                                   username=JENKINS_USER, password=JENKINS_PASSWORD).start()
+        self.aws = FakeAWS(latency=aws_latency)
+        self.master_id, self.asg_name = self.aws.seed_fleet(agents=BASE_AGENTS)
+        self.sequence = 0
+
+        # Module-level settings are read at import, so the environment comes first
+        os.environ.update({
+            "JENKINS_URL": self.jenkins.url,
+            "JENKINS_USER": JENKINS_USER,
+            "JENKINS_PASSWORD": JENKINS_PASSWORD,
+            "JENKINS_INSTANCE_ID": self.master_id,
+            "ASG_NAME": self.asg_name,
+            "S3_BUCKET": BUCKET,
+            "IDEMPOTENCY_TABLE": "bench-idempotency",
+            "AWS_LAMBDA_FUNCTION_NAME": FUNCTION_NAME,
+            "MAX_AGENTS": "10",
+            # Busy agents are handed to the follow-up invocation rather than waited on
+            "AGENT_DRAIN_WAIT_SECONDS": "0"
+        })
+        os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+        import aws_clients
+        import cost_optimizer
+        import idempotency
+        import jenkins_api
+        import jenkins_trigger
+        import metrics
+        import pricing
+        import tracing
+
+        self.aws_clients = aws_clients
+        self.cost_optimizer = cost_optimizer
+        self.idempotency = idempotency
+        self.jenkins_api = jenkins_api
+        self.jenkins_trigger = jenkins_trigger
+        self.metrics = metrics
+        self.pricing = pricing
+        self.tracing = tracing
+        install_fake_aws(self.aws)
+
+    def next_id(self):
+        self.sequence += 1
+        return f"bench-{self.sequence:06d}"
+
+    def client(self, service):
+        return self.aws_clients.get_client(service)
+
+    def reset_container(self):
+        """Forget everything a warm container keeps between invocations"""
+
+        self.aws_clients._clients.clear()
+        if self.jenkins_api._http is not None:
+            self.jenkins_api._http.clear()
+        self.jenkins_api._http = None
+        self.jenkins_api._auth_headers.clear()
+        self.jenkins_api._crumbs.clear()
+        self.jenkins_api._last_ok.clear()
+        self.jenkins_trigger._resource_cache.clear()
+        self.idempotency._store = None
+        self.pricing._price_cache.clear()
+        self.pricing._snapshot = None
+        self.tracing._cold_start = True
+
+    def reset_fleet(self, agents=BASE_AGENTS, master_state="running"):
+        """Put the master, agents and Jenkins back in a known state"""
+
+        with self.aws.lock:
+            self.aws.set_instance_state(self.master_id, master_state)
+            self.aws.resize_group(self.asg_name, agents)
+        self.jenkins.restart(0.0)
+
+    def clear_metric_buffers(self):
+        """Drop datapoints buffered by functions called outside a handler"""
+
+        for buffer in self.metrics._buffers.values():
+            buffer.datapoints = []
+
+    def invoke_trigger(self, event, expected_status):
+        response = self.jenkins_trigger.handler(event, BenchContext(self.next_id()))
+        check_status(response, expected_status)
+        return response
+
+    def invoke_optimizer(self, event, expected_status=200):
+        response = self.cost_optimizer.handler(event, BenchContext(self.next_id()))
+        check_status(response, expected_status)
+        return response
+
+    def api_event(self, body):
+        return {
+            "httpMethod": "POST",
+            "path": "/trigger",
+            "body": json.dumps(body),
+            "requestContext": {"requestId": self.next_id()}
+        }
+
+    def kafka_batch_event(self, bodies):
+        partition = "bench-builds-0"
+        records = []
+        for body in bodies:
+            records.append({
+                "topic": "bench-builds",
+                "partition": 0,
+                "offset": int(self.next_id().rsplit("-", 1)[-1]),
+                "timestamp": int(time.time() * 1000),
+                "timestampType": "CREATE_TIME",
+                "value": base64.b64encode(json.dumps(body).encode("utf-8")).decode("ascii")
+            })
+        return {"eventSource": "SelfManagedKafka", "records": {partition: records}}
+
+def check_status(response, expected_status):
+    """Fail the benchmark if a scenario stopped doing what it measures"""
+
+    if response.get("statusCode") != expected_status:
+        raise Exception(f"Expected status {expected_status}, got {response.get('statusCode')}: "
+                        f"{response.get('body')}")
+
+# Scenarios
+
+def run_parse_event(bench):
+    bench.jenkins_trigger.parse_event(GITHUB_PUSH)
+
+def run_trigger_jenkins_build(bench):
+    bench.jenkins_trigger.trigger_jenkins_build(bench.jenkins.url, JENKINS_USER, JENKINS_PASSWORD, BUILD_PARAMS)
+
+def setup_running(bench):
+    bench.reset_fleet()
+
+def run_api_trigger(bench):
+    bench.invoke_trigger(bench.api_event({"job_name": "bench-app", "branch": "main"}), 200)
+
+def run_api_trigger_follow(bench):
+    bench.invoke_trigger(bench.api_event({"job_name": "bench-app", "follow": "build_number"}), 200)
+
+def run_fanout(bench):
+    jobs = [f"service-{index}" for index in range(FANOUT_JOBS)]
+    bench.invoke_trigger(bench.api_event({"jobs": jobs, "branch": "main"}), 200)
+
+def run_kafka_batch(bench):
+    # Requests for the same job collapse, so the batch fires FANOUT_JOBS builds
+    bodies = [{"job_name": f"service-{index % FANOUT_JOBS}"} for index in range(BATCH_RECORDS)]
+    response = bench.jenkins_trigger.handler(bench.kafka_batch_event(bodies), BenchContext(bench.next_id()))
+    if response.get("batchItemFailures"):
+        raise Exception(f"Expected no failed records, got {response['batchItemFailures']}")
+
+def setup_master_stopped(bench):
+    bench.reset_fleet(master_state="stopped")
+    bench.aws.delete_prefix(bench.jenkins_trigger.PENDING_TRIGGER_PREFIX)
+
+def run_master_stopped(bench):
+    bench.invoke_trigger(bench.api_event({"job_name": "bench-app"}), 202)
+
+def setup_drain(bench):
+    bench.reset_fleet()
+    bench.aws.delete_prefix(bench.jenkins_trigger.PENDING_TRIGGER_PREFIX)
+    key = f"{bench.jenkins_trigger.PENDING_TRIGGER_PREFIX}{bench.next_id()}.json"
+    bench.aws.objects[(BUCKET, key)] = json.dumps({
+        "received_at": "2024-01-01T00:00:00",
+        "trigger_source": "api_gateway",
+        "build_params": BUILD_PARAMS,
+        "lambda_request_id": "bench"
+    }).encode("utf-8")
+    bench.jenkins.restart(bench.jenkins_boot_delay)
+
+def run_drain(bench):
+    bench.invoke_trigger({"action": "drain_pending_triggers", "attempt": 1}, 200)
+
+def run_trigger_scale(bench):
+    bench.jenkins_trigger.scale_jenkins_agents(bench.client("autoscaling"), 4)
+
+def setup_report_fleet(bench):
+    bench.reset_fleet(agents=REPORT_AGENTS)
+
+def run_cost_report(bench):
+    bench.cost_optimizer.generate_cost_report(
+        bench.client("ec2"), bench.client("autoscaling"), bench.client("cloudwatch"),
+        bench.master_id, bench.asg_name
+    )
+
+def run_optimizer_scale(bench):
+    bench.invoke_optimizer({"action": "scale_agents", "desired_capacity": 4})
+
+def setup_scale_in(bench):
+    bench.reset_fleet(agents=SCALE_IN_AGENTS)
+    agents = [i["InstanceId"] for i in bench.aws.groups[bench.asg_name]["Instances"]]
+    bench.jenkins.set_agents(agents, busy=SCALE_IN_AGENTS // 2)
+
+def run_scale_in(bench):
+    bench.invoke_optimizer({"action": "scale_agents", "desired_capacity": 0})
+
+def setup_autoscale(bench):
+    bench.reset_fleet()
+    agents = [i["InstanceId"] for i in bench.aws.groups[bench.asg_name]["Instances"]]
+    bench.jenkins.set_agents(agents, busy=len(agents))
+    bench.jenkins.queue_items = [{"id": index, "buildable": True, "blocked": False, "stuck": False}
+                                 for index in range(5)]
+
+def run_autoscale(bench):
+    bench.invoke_optimizer({"action": "autoscale"})
+
+def scenario(name, run, setup=None, cold=False, runs=None):
+    return {"name": f"{name} [{'cold' if cold else 'warm'}]", "run": run, "setup": setup,
+            "cold": cold, "runs": runs}
+
+SCENARIOS = [
+    scenario("parse_event github push", run_parse_event),
+    scenario("trigger_jenkins_build", run_trigger_jenkins_build, cold=True),
+    scenario("trigger_jenkins_build", run_trigger_jenkins_build),
+    scenario("handler api trigger", run_api_trigger, setup_running, cold=True),
+    scenario("handler api trigger", run_api_trigger, setup_running),
+    scenario("handler api trigger, follow build_number", run_api_trigger_follow, setup_running),
+    scenario(f"handler fan-out {FANOUT_JOBS} jobs", run_fanout, setup_running),
+    scenario(f"handler Kafka batch {BATCH_RECORDS} records", run_kafka_batch, setup_running),
+    scenario("handler master stopped", run_master_stopped, setup_master_stopped, cold=True),
+    scenario("handler drain after Jenkins boot", run_drain, setup_drain, cold=True, runs=BOOT_RUNS),
+    scenario("trigger scale_jenkins_agents", run_trigger_scale, setup_running, cold=True),
+    scenario("trigger scale_jenkins_agents", run_trigger_scale, setup_running),
+    scenario(f"generate_cost_report {REPORT_AGENTS} agents", run_cost_report, setup_report_fleet, cold=True),
+    scenario(f"generate_cost_report {REPORT_AGENTS} agents", run_cost_report, setup_report_fleet),
+    scenario("optimizer scale_agents", run_optimizer_scale, setup_running),
+    scenario(f"optimizer scale-in drain {SCALE_IN_AGENTS} agents", run_scale_in, setup_scale_in),
+    scenario("optimizer autoscale", run_autoscale, setup_autoscale)
+]
+
+# Measurement
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the handlers' logging while measuring"""
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def percentile(values, fraction):
+    """Nearest-rank percentile"""
+
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def measure(bench, spec, runs):
+    """Time runs invocations of one scenario, then trace one for peak memory"""
+
+    def prepare():
+        if spec["cold"]:
+            bench.reset_container()
+        if spec["setup"]:
+            spec["setup"](bench)
+        bench.clear_metric_buffers()
+
+    durations = []
+    aws_calls = Counter()
+    jenkins_requests = 0
+    with quiet():
+        # One untimed invocation first, so warm scenarios start warm
+        prepare()
+        spec["run"](bench)
+
+        for _ in range(runs):
+            prepare()
+            calls_before = bench.aws.snapshot_calls()
+            requests_before = bench.jenkins.total_requests()
+            started = time.perf_counter()
+            spec["run"](bench)
+            durations.append(time.perf_counter() - started)
+            aws_calls.update(bench.aws.snapshot_calls() - calls_before)
+            jenkins_requests += bench.jenkins.total_requests() - requests_before
+
+        prepare()
+        tracemalloc.start()
+        try:
+            spec["run"](bench)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    durations_ms = [d * 1000.0 for d in durations]
+    return {
+        "scenario": spec["name"],
+        "runs": runs,
+        "p50_ms": round(statistics.median(durations_ms), 3),
+        "p99_ms": round(percentile(durations_ms, 0.99), 3),
+        "max_ms": round(max(durations_ms), 3),
+        "aws_calls": round(sum(aws_calls.values()) / float(runs), 2),
+        "aws_calls_by_operation": {op: round(n / float(runs), 2) for op, n in sorted(aws_calls.items())},
+        "jenkins_requests": round(jenkins_requests / float(runs), 2),
+        "peak_kib": round(peak / 1024.0, 1)
+    }
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against an earlier run"""
+
+    previous = {r["scenario"]: r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["scenario"])
+        if not old:
+            continue
+        for key in ("aws_calls", "jenkins_requests"):
+            if result[key] > old[key] + CALL_COUNT_SLACK:
+                regressions.append(f"{result['scenario']}: {key} {old[key]} -> {result[key]}")
+        slower = result["p50_ms"] - old["p50_ms"]
+        if slower > MIN_LATENCY_REGRESSION_MS and result["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p50 {old['p50_ms']} ms -> {result['p50_ms']} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Jenkins Lambdas against local stand-ins")
+    parser.add_argument("--runs", type=int, default=50, help="timed invocations per scenario")
+    parser.add_argument("--only", help="run scenarios whose name contains this text")
+    parser.add_argument("--jenkins-boot-delay", type=float, default=1.0,
+                        help="seconds Jenkins answers 503 after a master start")
+    parser.add_argument("--jenkins-latency-ms", type=float, default=2.0, help="added to every Jenkins response")
+    parser.add_argument("--aws-latency-ms", type=float, default=0.0, help="added to every AWS call")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p50 growth")
+    args = parser.parse_args(argv)
+    random.seed(0)
+
+    bench = Bench(
+        jenkins_boot_delay=args.jenkins_boot_delay,
+        jenkins_latency=args.jenkins_latency_ms / 1000.0,
+        aws_latency=args.aws_latency_ms / 1000.0
+    )
+
+    results = []
+    try:
+        print(f"{'scenario':52} {'p50 ms':>9} {'p99 ms':>9} {'AWS calls':>10} {'Jenkins':>8} {'peak KiB':>9}")
+        for spec in SCENARIOS:
+            if args.only and args.only not in spec["name"]:
+                continue
+            result = measure(bench, spec, min(args.runs, spec["runs"] or args.runs))
+            results.append(result)
+            print(f"{result['scenario']:52} {result['p50_ms']:9.2f} {result['p99_ms']:9.2f} "
+                  f"{result['aws_calls']:10.2f} {result['jenkins_requests']:8.2f} {result['peak_kib']:9.1f}")
+    finally:
+        bench.jenkins.stop()
+
+    print("\nAWS calls per invocation")
+    for result in results:
+        calls = ", ".join(f"{op} {n:g}" for op, n in result["aws_calls_by_operation"].items())
+        print(f"  {result['scenario']}: {calls or 'none'}")
+
+    document = {
+        "settings": {
+            "runs": args.runs,
+            "jenkins_boot_delay": args.jenkins_boot_delay,
+            "jenkins_latency_ms": args.jenkins_latency_ms,
+            "aws_latency_ms": args.aws_latency_ms
+        },
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(document, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,649 @@
+"""In-process stand-ins for AWS and Jenkins used by the benchmarks
+
+FakeAWS keeps EC2 instances, Auto Scaling groups, S3 objects, DynamoDB
+items, CloudWatch and Lambda invocations in memory and answers the boto3
+operations the Lambdas call, counting every call. JenkinsStub is a local
+HTTP server for the Jenkins endpoints the Lambdas use, with a configurable
+boot delay (503 until ready) and per-request latency.
+
+install_fake_aws() swaps the client factory in aws_clients, so get_client()
+hands out fake clients and nothing reaches AWS.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote
+
+ON_DEMAND_PRICES = {"t3.medium": 0.0416, "t3.large": 0.0832, "t3.xlarge": 0.1664}
+SPOT_PRICES = {"t3.medium": 0.0137, "t3.large": 0.0275, "t3.xlarge": 0.0549}
+ZONES = ["eu-west-1a", "eu-west-1b", "eu-west-1c"]
+
+S3_PAGE_SIZE = 1000
+EC2_PAGE_SIZE = 1000
+WAITER_POLL_SECONDS = 0.01
+
+class FakeClientError(Exception):
+    """Error shaped like botocore's ClientError"""
+
+    def __init__(self, code, operation, message=""):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+class FakeBody:
+    """StreamingBody stand-in"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None else self.position + amt
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+def operation_name(name):
+    """describe_instances -> DescribeInstances"""
+
+    return "".join(part.title() for part in name.split("_"))
+
+def public(record):
+    """Copy of a stored record without the fake's own bookkeeping keys"""
+
+    return {k: v for k, v in record.items() if not k.startswith("_")}
+
+class FakePaginator:
+    """Paginator that follows NextToken / NextContinuationToken"""
+
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        while True:
+            page = getattr(self.client, self.operation)(**kwargs)
+            yield page
+            if page.get("NextContinuationToken"):
+                kwargs["ContinuationToken"] = page["NextContinuationToken"]
+            elif page.get("NextToken"):
+                kwargs["NextToken"] = page["NextToken"]
+            else:
+                return
+
+class FakeWaiter:
+    """Waiter that polls DescribeInstances until every instance is in a state"""
+
+    def __init__(self, client, state, timeout=30.0):
+        self.client = client
+        self.state = state
+        self.timeout = timeout
+
+    def wait(self, InstanceIds, WaiterConfig=None):
+        deadline = time.time() + self.timeout
+        while True:
+            response = self.client.describe_instances(InstanceIds=InstanceIds)
+            states = {i["State"]["Name"] for r in response["Reservations"] for i in r["Instances"]}
+            if states == {self.state}:
+                return
+            if time.time() > deadline:
+                raise Exception(f"Waiter instance_{self.state} failed: {sorted(states)}")
+            time.sleep(WAITER_POLL_SECONDS)
+
+class FakeClient:
+    """boto3 client stand-in for one service, backed by a FakeAWS"""
+
+    def __init__(self, aws, service):
+        self.aws = aws
+        self.service = service
+
+    def get_paginator(self, operation):
+        return FakePaginator(self, operation)
+
+    def get_waiter(self, name):
+        return FakeWaiter(self, name[len("instance_"):])
+
+    def __getattr__(self, name):
+        implementation = getattr(self.aws, f"{self.service}_{name}", None)
+        if implementation is None:
+            raise AttributeError(f"FakeAWS has no {self.service}.{name}")
+
+        def call(**kwargs):
+            return self.aws.call(self.service, operation_name(name), implementation, kwargs)
+
+        return call
+
+class FakeAWS:
+    """In-memory EC2, Auto Scaling, S3, CloudWatch, Lambda, DynamoDB and Pricing
+
+    latency is added to every call; master_boot_seconds is how long a started
+    instance stays pending.
+    """
+
+    def __init__(self, latency=0.0, master_boot_seconds=0.0):
+        self.latency = latency
+        self.master_boot_seconds = master_boot_seconds
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.instances = {}
+        self.groups = {}
+        self.objects = {}
+        self.items = {}
+        self.invocations = []
+        self.metric_datums = 0
+        self.next_instance = 1
+
+    # Plumbing
+
+    def client(self, service, region_name=None):
+        return FakeClient(self, service)
+
+    def call(self, service, operation, implementation, kwargs):
+        from tracing import count
+
+        # Same counter name the botocore hook in tracing.instrument_client uses
+        count(f"aws.{service}.{operation}")
+        with self.lock:
+            self.calls[f"{service}.{operation}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return implementation(**kwargs)
+
+    def snapshot_calls(self):
+        with self.lock:
+            return Counter(self.calls)
+
+    # Fleet setup
+
+    def launch(self, instance_type, tags=None, state="running", spot=False):
+        instance_id = f"i-{self.next_instance:017x}"
+        self.next_instance += 1
+        instance = {
+            "InstanceId": instance_id,
+            "InstanceType": instance_type,
+            "State": {"Name": state},
+            "LaunchTime": datetime.utcnow() - timedelta(hours=2),
+            "Placement": {"AvailabilityZone": ZONES[self.next_instance % len(ZONES)]},
+            "Tags": [{"Key": k, "Value": v} for k, v in (tags or {}).items()]
+        }
+        if spot:
+            instance["InstanceLifecycle"] = "spot"
+        self.instances[instance_id] = instance
+        return instance_id
+
+    def seed_fleet(self, name="bench", agents=2, max_agents=50,
+                   master_type="t3.medium", agent_type="t3.large"):
+        """One master and an agent group; returns (master_id, asg_name)"""
+
+        with self.lock:
+            master_id = self.launch(master_type, {"Name": f"{name}-jenkins-master", "Type": "jenkins-master"})
+            asg_name = f"{name}-agents-asg"
+            self.groups[asg_name] = {
+                "AutoScalingGroupName": asg_name,
+                "MinSize": 0,
+                "MaxSize": max_agents,
+                "DesiredCapacity": 0,
+                "Instances": [],
+                "Tags": [
+                    {"Key": "Name", "Value": f"{name}-jenkins-agent"},
+                    {"Key": "Component", "Value": "Jenkins"}
+                ],
+                "MixedInstancesPolicy": {
+                    "InstancesDistribution": {"OnDemandPercentageAboveBaseCapacity": 0}
+                },
+                "_instance_type": agent_type
+            }
+            self.resize_group(asg_name, agents)
+        return master_id, asg_name
+
+    def set_instance_state(self, instance_id, state):
+        with self.lock:
+            instance = self.instances[instance_id]
+            instance["State"] = {"Name": state}
+            instance.pop("_running_at", None)
+
+    def resize_group(self, asg_name, desired):
+        """Launch or remove agents so the group matches its desired capacity"""
+
+        group = self.groups[asg_name]
+        group["DesiredCapacity"] = desired
+        while len(group["Instances"]) < desired:
+            instance_id = self.launch(group["_instance_type"], {"Name": group["Tags"][0]["Value"]}, spot=True)
+            group["Instances"].append({
+                "InstanceId": instance_id,
+                "LifecycleState": "InService",
+                "HealthStatus": "Healthy",
+                "InstanceType": group["_instance_type"],
+                "ProtectedFromScaleIn": False
+            })
+        while len(group["Instances"]) > desired:
+            removed = group["Instances"].pop()
+            self.instances.pop(removed["InstanceId"], None)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [k for k in self.objects if k[1].startswith(prefix)]:
+                del self.objects[key]
+
+    def refresh(self, instance):
+        """Finish a pending boot once its time has come"""
+
+        running_at = instance.get("_running_at")
+        if running_at is not None and time.time() >= running_at:
+            instance["State"] = {"Name": "running"}
+            instance.pop("_running_at")
+        return instance
+
+    # EC2
+
+    def ec2_describe_instances(self, InstanceIds=None, Filters=None, NextToken=None, MaxResults=None):
+        if InstanceIds:
+            missing = [i for i in InstanceIds if i not in self.instances]
+            if missing:
+                raise FakeClientError("InvalidInstanceID.NotFound", "DescribeInstances",
+                                      f"The instance IDs '{', '.join(missing)}' do not exist")
+            selected = [self.instances[i] for i in InstanceIds]
+        else:
+            selected = list(self.instances.values())
+
+        for instance_filter in Filters or []:
+            name, values = instance_filter["Name"], instance_filter["Values"]
+            if name == "instance-state-name":
+                selected = [i for i in selected if self.refresh(i)["State"]["Name"] in values]
+            elif name.startswith("tag:"):
+                key = name[len("tag:"):]
+                selected = [i for i in selected
+                            if any(t["Key"] == key and t["Value"] in values for t in i["Tags"])]
+
+        start = int(NextToken or 0)
+        page = selected[start:start + (MaxResults or EC2_PAGE_SIZE)]
+        response = {"Reservations": [{"Instances": [public(self.refresh(i)) for i in page]}] if page else []}
+        if start + len(page) < len(selected):
+            response["NextToken"] = str(start + len(page))
+        return response
+
+    def ec2_start_instances(self, InstanceIds):
+        changes = []
+        for instance_id in InstanceIds:
+            instance = self.refresh(self.instances[instance_id])
+            previous = instance["State"]["Name"]
+            if previous in ("stopped", "stopping"):
+                instance["State"] = {"Name": "pending"}
+                instance["_running_at"] = time.time() + self.master_boot_seconds
+                instance["LaunchTime"] = datetime.utcnow()
+            changes.append({"InstanceId": instance_id, "PreviousState": {"Name": previous},
+                            "CurrentState": dict(instance["State"])})
+        return {"StartingInstances": changes}
+
+    def ec2_stop_instances(self, InstanceIds):
+        changes = []
+        for instance_id in InstanceIds:
+            instance = self.instances[instance_id]
+            previous = instance["State"]["Name"]
+            instance["State"] = {"Name": "stopped"}
+            instance.pop("_running_at", None)
+            changes.append({"InstanceId": instance_id, "PreviousState": {"Name": previous},
+                            "CurrentState": {"Name": "stopped"}})
+        return {"StoppingInstances": changes}
+
+    def ec2_describe_spot_price_history(self, InstanceTypes, ProductDescriptions=None, StartTime=None):
+        now = datetime.utcnow()
+        return {"SpotPriceHistory": [
+            {"AvailabilityZone": zone, "InstanceType": instance_type, "Timestamp": now,
+             "SpotPrice": str(SPOT_PRICES.get(instance_type, 0.02)), "ProductDescription": "Linux/UNIX"}
+            for instance_type in InstanceTypes for zone in ZONES
+        ]}
+
+    # Auto Scaling
+
+    def autoscaling_describe_auto_scaling_groups(self, AutoScalingGroupNames=None, Filters=None,
+                                                 NextToken=None, MaxRecords=None):
+        groups = list(self.groups.values())
+        if AutoScalingGroupNames:
+            groups = [g for g in groups if g["AutoScalingGroupName"] in AutoScalingGroupNames]
+        for group_filter in Filters or []:
+            if group_filter["Name"].startswith("tag:"):
+                key = group_filter["Name"][len("tag:"):]
+                groups = [g for g in groups
+                          if any(t["Key"] == key and t["Value"] in group_filter["Values"] for t in g["Tags"])]
+        return {"AutoScalingGroups": [
+            dict(public(g), Instances=[dict(i) for i in g["Instances"]]) for g in groups
+        ]}
+
+    def autoscaling_set_desired_capacity(self, AutoScalingGroupName, DesiredCapacity, HonorCooldown=False):
+        group = self.groups.get(AutoScalingGroupName)
+        if group is None:
+            raise FakeClientError("ValidationError", "SetDesiredCapacity", "AutoScalingGroup name not found")
+        if not group["MinSize"] <= DesiredCapacity <= group["MaxSize"]:
+            raise FakeClientError("ValidationError", "SetDesiredCapacity", "New SetDesiredCapacity value is outside bounds")
+        self.resize_group(AutoScalingGroupName, DesiredCapacity)
+        return {}
+
+    def autoscaling_describe_auto_scaling_instances(self, InstanceIds):
+        found = []
+        for group in self.groups.values():
+            for instance in group["Instances"]:
+                if instance["InstanceId"] in InstanceIds:
+                    found.append(dict(instance, AutoScalingGroupName=group["AutoScalingGroupName"]))
+        return {"AutoScalingInstances": found}
+
+    def autoscaling_terminate_instance_in_auto_scaling_group(self, InstanceId, ShouldDecrementDesiredCapacity):
+        for group in self.groups.values():
+            for instance in group["Instances"]:
+                if instance["InstanceId"] == InstanceId:
+                    group["Instances"].remove(instance)
+                    self.instances.pop(InstanceId, None)
+                    if ShouldDecrementDesiredCapacity:
+                        group["DesiredCapacity"] -= 1
+                    else:
+                        self.resize_group(group["AutoScalingGroupName"], group["DesiredCapacity"])
+                    return {"Activity": {"ActivityId": f"terminate-{InstanceId}"}}
+        raise FakeClientError("ValidationError", "TerminateInstanceInAutoScalingGroup", "Instance not found")
+
+    def autoscaling_set_instance_protection(self, InstanceIds, AutoScalingGroupName, ProtectedFromScaleIn):
+        for instance in self.groups[AutoScalingGroupName]["Instances"]:
+            if instance["InstanceId"] in InstanceIds:
+                instance["ProtectedFromScaleIn"] = ProtectedFromScaleIn
+        return {}
+
+    def autoscaling_detach_instances(self, InstanceIds, AutoScalingGroupName, ShouldDecrementDesiredCapacity):
+        group = self.groups[AutoScalingGroupName]
+        group["Instances"] = [i for i in group["Instances"] if i["InstanceId"] not in InstanceIds]
+        if ShouldDecrementDesiredCapacity:
+            group["DesiredCapacity"] -= len(InstanceIds)
+        self.resize_group(AutoScalingGroupName, group["DesiredCapacity"])
+        return {"Activities": []}
+
+    # S3
+
+    def s3_put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": f'"{len(self.objects)}"'}
+
+    def s3_get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("NoSuchKey", "GetObject", "The specified key does not exist.")
+        data = self.objects[(Bucket, Key)]
+        if Range is None:
+            return {"Body": FakeBody(data), "ContentLength": len(data)}
+
+        # "bytes=first-last", as S3 answers it: 416 when first is past the end
+        first, last = (int(n) for n in Range[len("bytes="):].split("-"))
+        if first >= len(data):
+            raise FakeClientError("InvalidRange", "GetObject", "The requested range is not satisfiable")
+        part = data[first:last + 1]
+        return {"Body": FakeBody(part), "ContentLength": len(part),
+                "ContentRange": f"bytes {first}-{first + len(part) - 1}/{len(data)}"}
+
+    def s3_delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def s3_delete_objects(self, Bucket, Delete):
+        for entry in Delete["Objects"]:
+            self.objects.pop((Bucket, entry["Key"]), None)
+        return {"Deleted": [{"Key": entry["Key"]} for entry in Delete["Objects"]]}
+
+    def s3_list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=S3_PAGE_SIZE, Delimiter=None):
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            "KeyCount": len(page),
+            "Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)])} for k in page],
+            "IsTruncated": start + len(page) < len(keys)
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + len(page))
+        if not page:
+            del response["Contents"]
+        return response
+
+    # CloudWatch
+
+    def cloudwatch_put_metric_data(self, Namespace, MetricData):
+        self.metric_datums += len(MetricData)
+        return {}
+
+    def cloudwatch_get_metric_statistics(self, **kwargs):
+        return {"Label": kwargs.get("MetricName"), "Datapoints": []}
+
+    def cloudwatch_get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy=None, NextToken=None):
+        return {"MetricDataResults": [
+            {"Id": query["Id"], "Label": query["Id"], "Timestamps": [], "Values": [], "StatusCode": "Complete"}
+            for query in MetricDataQueries
+        ]}
+
+    # Lambda
+
+    def lambda_invoke(self, FunctionName, InvocationType="RequestResponse", Payload=None):
+        self.invocations.append({"function": FunctionName, "type": InvocationType, "payload": Payload})
+        return {"StatusCode": 202 if InvocationType == "Event" else 200}
+
+    # DynamoDB
+
+    def dynamodb_put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        key = (TableName, Item["fingerprint"]["S"])
+        existing = self.items.get(key)
+        if ConditionExpression and existing:
+            now = int(ExpressionAttributeValues[":now"]["N"])
+            if int(existing["expires_at"]["N"]) > now:
+                raise FakeClientError("ConditionalCheckFailedException", "PutItem",
+                                      "The conditional request failed")
+        self.items[key] = Item
+        return {}
+
+    def dynamodb_delete_item(self, TableName, Key):
+        self.items.pop((TableName, Key["fingerprint"]["S"]), None)
+        return {}
+
+    # Pricing
+
+    def pricing_get_products(self, ServiceCode, Filters, MaxResults=None):
+        instance_type = next(f["Value"] for f in Filters if f["Field"] == "instanceType")
+        price = ON_DEMAND_PRICES.get(instance_type)
+        if price is None:
+            return {"PriceList": []}
+        product = {"terms": {"OnDemand": {"term": {"priceDimensions": {
+            "dimension": {"unit": "Hrs", "pricePerUnit": {"USD": str(price)}}
+        }}}}}
+        return {"PriceList": [json.dumps(product)]}
+
+def install_fake_aws(aws):
+    """Make aws_clients.get_client hand out clients backed by aws"""
+
+    import aws_clients
+
+    class FakeLazyClient(aws_clients.LazyClient):
+        def resolve(self):
+            if self.client is None:
+                self.client = aws.client(self.service, self.region_name)
+            return self.client
+
+    aws_clients.LazyClient = FakeLazyClient
+    aws_clients._clients.clear()
+
+class JenkinsStub:
+    """Local HTTP Jenkins answering readiness, crumb, build, queue and computer calls
+
+    Every request is answered 503 until boot_delay seconds after start() or
+    restart(); latency is added to every response.
+    """
+
+    def __init__(self, boot_delay=0.0, latency=0.0, username="admin", password="bench"):
+        self.boot_delay = boot_delay
+        self.latency = latency
+        self.username = username
+        self.password = password
+        self.crumb = "bench-crumb"
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.queue_items = []
+        self.computers = []
+        self.busy_executors = 0
+        self.total_executors = 0
+        self.queue = {}
+        self.next_queue_id = 1
+        self.next_build = 1
+        self.ready_at = 0.0
+        self.server = None
+        self.url = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(self))
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.restart(self.boot_delay)
+        return self
+
+    def restart(self, boot_delay=None):
+        self.ready_at = time.time() + (self.boot_delay if boot_delay is None else boot_delay)
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def set_agents(self, names, busy, executors=2):
+        """Computer API payload for agents registered under names, the first busy of them busy"""
+
+        now_ms = int(time.time() * 1000)
+        computers = [{"_class": "hudson.model.Hudson$MasterComputer", "displayName": "Built-In Node",
+                      "offline": False, "idle": True, "numExecutors": 0}]
+        for index, name in enumerate(names):
+            computers.append({
+                "_class": "hudson.slaves.SlaveComputer",
+                "displayName": name,
+                "offline": False,
+                "temporarilyOffline": False,
+                "idle": index >= busy,
+                "numExecutors": executors,
+                "idleStartMilliseconds": now_ms - 3600 * 1000
+            })
+        self.computers = computers
+        self.total_executors = len(names) * executors
+        self.busy_executors = min(busy, len(names)) * executors
+
+    def route(self, method, path, headers):
+        """Return (kind, status, body, extra headers) for one request"""
+
+        if time.time() < self.ready_at:
+            return "booting", 503, "<html>Jenkins is getting ready to work</html>", {}
+
+        if headers.get("Authorization") is None:
+            return "unauthorized", 401, "", {}
+
+        path, _, query = path.partition("?")
+        if method == "GET" and path == "/crumbIssuer/api/xml":
+            return "crumb", 200, f"Jenkins-Crumb:{self.crumb}", {"Set-Cookie": "JSESSIONID.bench=stub; Path=/"}
+        if method == "GET" and path == "/api/json":
+            return "readiness", 200, {"mode": "NORMAL", "quietingDown": False}, {}
+        if method == "GET" and path == "/queue/api/json":
+            return "queue", 200, {"items": self.queue_items}, {}
+        if method == "GET" and path == "/computer/api/json":
+            return "computer", 200, {
+                "busyExecutors": self.busy_executors,
+                "totalExecutors": self.total_executors,
+                "computer": self.computers
+            }, {}
+
+        match = re.match(r"^/job/([^/]+)/(buildWithParameters|build)$", path)
+        if method == "POST" and match:
+            if headers.get("Jenkins-Crumb") != self.crumb:
+                return "build_post", 403, "No valid crumb was included in the request", {}
+            with self.lock:
+                queue_id, build_number = self.next_queue_id, self.next_build
+                self.next_queue_id += 1
+                self.next_build += 1
+                self.queue[queue_id] = (match.group(1), build_number)
+            return "build_post", 201, "", {"Location": f"{self.url}/queue/item/{queue_id}/"}
+
+        match = re.match(r"^/computer/([^/]+)/toggleOffline$", path)
+        if method == "POST" and match:
+            if headers.get("Jenkins-Crumb") != self.crumb:
+                return "toggle_offline", 403, "No valid crumb was included in the request", {}
+            name = unquote(match.group(1))
+            for computer in self.computers:
+                if computer["displayName"] == name:
+                    offline = not computer.get("temporarilyOffline", False)
+                    computer["offline"] = computer["temporarilyOffline"] = offline
+                    computer["offlineCauseReason"] = parse_qs(query).get("offlineMessage", [""])[0] if offline else ""
+                    return "toggle_offline", 302, "", {"Location": f"{self.url}/computer/{match.group(1)}/"}
+            return "toggle_offline", 404, "", {}
+
+        match = re.match(r"^/queue/item/(\d+)/api/json$", path)
+        if method == "GET" and match:
+            queued = self.queue.get(int(match.group(1)))
+            if not queued:
+                return "queue_item", 404, "", {}
+            job, build_number = queued
+            return "queue_item", 200, {
+                "id": int(match.group(1)), "cancelled": False, "why": None,
+                "executable": {"number": build_number, "url": f"{self.url}/job/{job}/{build_number}/"}
+            }, {}
+
+        match = re.match(r"^/job/([^/]+)/(\d+)/api/json$", path)
+        if method == "GET" and match:
+            return "build_status", 200, {
+                "number": int(match.group(2)), "url": f"{self.url}{path[:-len('api/json')]}",
+                "building": False, "result": "SUCCESS", "duration": 1000, "estimatedDuration": 1000
+            }, {}
+
+        return "not_found", 404, "", {}
+
+def make_stub_handler(stub):
+    """Request handler class bound to one JenkinsStub"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so the Lambdas' pooled connections are reused as in production
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; without TCP_NODELAY every
+        # response waits out the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def handle_request(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+
+            if stub.latency:
+                time.sleep(stub.latency)
+            kind, status, body, extra_headers = stub.route(method, self.path, self.headers)
+            with stub.lock:
+                stub.requests[kind] += 1
+
+            if isinstance(body, dict):
+                payload, content_type = json.dumps(body).encode("utf-8"), "application/json"
+            else:
+                payload, content_type = body.encode("utf-8"), "text/plain"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in extra_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
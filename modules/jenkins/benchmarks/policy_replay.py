@@ -0,0 +1,666 @@
+"""Replay archived build triggers against shutdown and agent scaling policies
+
+Reads the trigger logs written by the build trigger Lambda and replays them
+through a model of the Jenkins fleet under each policy. The logs can come
+from S3 (through trigger_log_store.query_trigger_logs), from a local copy of
+build-triggers/ or build-triggers-compacted/, or be a synthetic workload.
+
+The model:
+  - the master is started by a trigger, the startup schedule or the warm
+    agent window, and can take builds master_boot_minutes later
+  - it stops on the shutdown schedule once running builds finish (builds
+    still running agent_drain_minutes later are lost) or, for idle
+    policies, idle_shutdown_minutes after the last queued or running build
+  - agents are usable agent_launch_minutes after they are requested and
+    run executors builds at a time, each lasting build_minutes
+  - "trigger" agent scaling raises the group to each trigger's agent_count,
+    as the trigger Lambda does. "queue" scaling also runs the autoscaler's
+    plan_agent_capacity every autoscale_minutes
+  - the master is billed on-demand and agents at spot, using prices from
+    the pricing snapshot
+
+For each policy it prints queue wait (trigger to build start) against
+cost. A * marks the policies that no other policy beats on both p95 wait and cost.
+
+    python modules/jenkins/benchmarks/policy_replay.py
+        (--logs DIR | --bucket NAME --start DATE --end DATE | --synthetic-days DAYS)
+        [--policies FILE] [--build-minutes M] [--master-boot-minutes M]
+        [--agent-launch-minutes M] [--json PATH]
+
+--policies takes a JSON list of policies; keys left out fall back to
+DEFAULT_POLICY.
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+# Offline prices unless asked otherwise; read by pricing at import
+os.environ.setdefault("PRICING_SOURCE", "snapshot")
+
+from agent_autoscaler import AGENT_EXECUTORS, AVG_BUILD_MINUTES, plan_agent_capacity  # noqa: E402
+from agent_warm_pool import in_warm_window, parse_days, parse_hours  # noqa: E402
+from pricing import ON_DEMAND, SPOT, get_hourly_price  # noqa: E402
+from trigger_log_store import normalize_trigger_record, parse_raw_log, query_trigger_logs  # noqa: E402
+
+# Defaults mirror the module variables
+DEFAULT_POLICY = {
+    "name": None,
+    "master": "always_on",              # always_on, cron or idle
+    "startup_schedule": "0 8 * * MON-FRI",
+    "shutdown_schedule": "0 22 * * MON-FRI",
+    "idle_shutdown_minutes": 60,
+    "idle_check_minutes": 10,
+    "agents": "trigger",                # trigger or queue
+    "agent_count": None,                # agents per trigger; None uses the logged agent_count
+    "min_agents": 0,
+    "max_agents": 5,
+    "autoscale_minutes": 2,
+    "agent_idle_minutes": 30,
+    "agent_drain_minutes": 30,
+    "warm_agents": 0,
+    "warm_agent_hours": "08:00-22:00",
+    "warm_agent_days": "MON-FRI"
+}
+
+POLICIES = [
+    {"name": "always-on"},
+    {"name": "cron", "master": "cron"},
+    {"name": "idle-60", "master": "idle"},
+    {"name": "cron+queue", "master": "cron", "agents": "queue"},
+    {"name": "idle-30+queue", "master": "idle", "idle_shutdown_minutes": 30, "agents": "queue"},
+    {"name": "cron+queue+warm-2", "master": "cron", "agents": "queue", "warm_agents": 2}
+]
+
+DEFAULT_SETTINGS = {
+    "build_minutes": AVG_BUILD_MINUTES,
+    "master_boot_minutes": 4.0,
+    "agent_launch_minutes": 3.0,
+    "executors": AGENT_EXECUTORS,
+    "master_instance_type": "t3.medium",
+    "agent_instance_type": "t3.large",
+    "agent_on_demand_share": 0.0,
+    "region": None
+}
+
+STOPPED = "stopped"
+BOOTING = "booting"
+RUNNING = "running"
+
+EPOCH = datetime(1970, 1, 1)
+DAY = 86400
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 3
+
+def to_seconds(value):
+    return (value - EPOCH).total_seconds()
+
+def to_datetime(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+def weekday(seconds):
+    return (int(seconds // DAY) + EPOCH_WEEKDAY) % 7
+
+def align_up(seconds, period):
+    """First multiple of period at or after seconds"""
+
+    return math.ceil(seconds / period) * period
+
+def parse_cron(expression):
+    """(minute of day, weekdays) of a "M H * * DAYS" schedule, with or without a year field"""
+
+    fields = expression.split()
+    if (len(fields) not in (5, 6) or not fields[0].isdigit() or not fields[1].isdigit()
+            or fields[2] not in ("*", "?") or fields[3] not in ("*", "?")):
+        raise ValueError(f"Unsupported schedule {expression!r}, expected \"M H * * DAYS\"")
+    return int(fields[1]) * 60 + int(fields[0]), parse_days("*" if fields[4] == "?" else fields[4])
+
+def next_daily(seconds, minute_of_day, days):
+    """First time after seconds that falls at minute_of_day on one of days"""
+
+    day_start = seconds - seconds % DAY
+    for offset in range(8):
+        candidate = day_start + offset * DAY + minute_of_day * 60
+        if candidate > seconds and weekday(candidate) in days:
+            return candidate
+    return None
+
+def previous_daily(seconds, minute_of_day, days):
+    """Last time at or before seconds that falls at minute_of_day on one of days"""
+
+    day_start = seconds - seconds % DAY
+    for offset in range(8):
+        candidate = day_start - offset * DAY + minute_of_day * 60
+        if candidate <= seconds and weekday(candidate) in days:
+            return candidate
+    return None
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class PolicyReplay:
+    """The fleet under one policy, advanced from event to event"""
+
+    def __init__(self, policy, settings, prices):
+        self.policy = policy
+        self.prices = prices
+        self.boot_seconds = settings["master_boot_minutes"] * 60
+        self.launch_seconds = settings["agent_launch_minutes"] * 60
+        self.executors = settings["executors"]
+
+        self.master = STOPPED
+        self.master_started_at = None
+        self.master_ready_at = 0.0
+        self.agents = []
+        self.queue = deque()
+        self.idle_seen = None
+        self.drain_until = None
+
+        self.waits = []
+        self.master_seconds = 0.0
+        self.agent_seconds = 0.0
+        self.master_starts = 0
+        self.agent_launches = 0
+        self.interrupted = 0
+
+        self.startup = self.shutdown = None
+        if policy["master"] == "cron":
+            self.startup = parse_cron(policy["startup_schedule"])
+            self.shutdown = parse_cron(policy["shutdown_schedule"])
+        elif policy["master"] not in ("always_on", "idle"):
+            raise ValueError(f"Policy {policy['name']}: unknown master policy {policy['master']!r}")
+        if policy["agents"] not in ("trigger", "queue"):
+            raise ValueError(f"Policy {policy['name']}: unknown agent policy {policy['agents']!r}")
+
+        self.warm_start = self.warm_end = None
+        if policy["warm_agents"]:
+            start, end = parse_hours(policy["warm_agent_hours"])
+            days = parse_days(policy["warm_agent_days"])
+            self.warm_start = (start, days)
+            # A window past midnight ends on the following day
+            self.warm_end = (end, days if end > start else {(d + 1) % 7 for d in days})
+
+        self.next_shutdown = self.next_startup = None
+        self.next_warm_start = self.next_warm_end = None
+        self.next_idle_check = self.next_autoscale = None
+
+    # Fleet actions
+
+    def start_master(self, now):
+        if self.master == STOPPED:
+            self.master = BOOTING
+            self.master_started_at = now
+            self.master_ready_at = now + self.boot_seconds
+            self.master_starts += 1
+
+    def begin_shutdown(self, now):
+        """What the shutdown action does: drain the agents, then stop the master"""
+
+        busy_until = [free_at for agent in self.agents for free_at in agent["slots"] if free_at > now]
+        if self.master != RUNNING or not busy_until:
+            self.stop_master(now)
+            return
+        for agent in [a for a in self.agents if all(free_at <= now for free_at in a["slots"])]:
+            self.terminate_agent(agent, now)
+        self.drain_until = min(max(busy_until), now + self.policy["agent_drain_minutes"] * 60)
+
+    def stop_master(self, now):
+        self.drain_until = None
+        if self.master != STOPPED:
+            self.master_seconds += now - self.master_started_at
+            self.master = STOPPED
+        for agent in list(self.agents):
+            self.terminate_agent(agent, now)
+        self.idle_seen = None
+
+    def launch_agents(self, count, now):
+        for _ in range(count):
+            self.agent_launches += 1
+            self.agents.append({
+                "name": f"agent-{self.agent_launches}",
+                "launched": now,
+                "ready_at": now + self.launch_seconds,
+                "slots": [0.0] * self.executors
+            })
+
+    def terminate_agent(self, agent, now):
+        self.interrupted += sum(1 for free_at in agent["slots"] if free_at > now)
+        self.agent_seconds += now - agent["launched"]
+        self.agents.remove(agent)
+
+    def scale_up_to(self, count, now):
+        count = min(count, self.policy["max_agents"])
+        if count > len(self.agents):
+            self.launch_agents(count - len(self.agents), now)
+
+    def warm_floor(self, now):
+        if not self.policy["warm_agents"]:
+            return 0
+        in_window = in_warm_window(to_datetime(now), self.policy["warm_agent_hours"], self.policy["warm_agent_days"])
+        return self.policy["warm_agents"] if in_window else 0
+
+    def busy_executors(self, now):
+        return sum(1 for agent in self.agents for free_at in agent["slots"] if free_at > now)
+
+    def is_idle(self, now):
+        return not self.queue and self.busy_executors(now) == 0
+
+    # Events
+
+    def on_trigger(self, build, now):
+        """What the trigger Lambda does: start the master and raise the agents"""
+
+        arrival, duration, agent_count = build
+        self.queue.append((arrival, duration))
+        self.idle_seen = None
+        if self.drain_until is not None:
+            return
+        self.start_master(now)
+        self.scale_up_to(self.policy["agent_count"] or agent_count, now)
+
+    def dispatch(self, now):
+        """Start queued builds on free executors, oldest first"""
+
+        # Draining agents are offline in Jenkins
+        if self.master != RUNNING or self.drain_until is not None:
+            return
+        while self.queue:
+            free = None
+            for agent in self.agents:
+                if agent["ready_at"] > now:
+                    continue
+                for index, free_at in enumerate(agent["slots"]):
+                    if free_at <= now:
+                        free = (agent, index, free_at)
+                        break
+                if free:
+                    break
+            if not free:
+                return
+
+            agent, index, free_at = free
+            arrival, duration = self.queue.popleft()
+            started = max(arrival, free_at, agent["ready_at"], self.master_ready_at)
+            agent["slots"][index] = started + duration
+            self.waits.append(started - arrival)
+            self.idle_seen = None
+
+    def idle_check(self, now):
+        """What the idle_check action does"""
+
+        if self.master != RUNNING or not self.is_idle(now):
+            self.idle_seen = None
+        elif self.idle_seen is None:
+            self.idle_seen = now
+        elif now - self.idle_seen >= self.policy["idle_shutdown_minutes"] * 60:
+            self.stop_master(now)
+
+    def autoscale(self, now):
+        """What the autoscale action does, using the autoscaler's own plan"""
+
+        if self.master != RUNNING or self.drain_until is not None:
+            return
+
+        agents = []
+        for agent in self.agents:
+            # Agents still launching have not registered with Jenkins yet
+            if agent["ready_at"] > now:
+                continue
+            idle = all(free_at <= now for free_at in agent["slots"])
+            agents.append({
+                "name": agent["name"],
+                "offline": False,
+                "idle": idle,
+                "executors": self.executors,
+                "idle_since": to_datetime(max(agent["slots"] + [agent["ready_at"]])) if idle else None
+            })
+        busy = self.busy_executors(now)
+        demand = {
+            "queued": len(self.queue),
+            "busy_executors": busy,
+            "idle_executors": len(agents) * self.executors - busy,
+            "agents": agents
+        }
+
+        plan = plan_agent_capacity(
+            demand, len(self.agents), {agent["name"] for agent in self.agents},
+            min_agents=max(self.policy["min_agents"], self.warm_floor(now)),
+            max_agents=self.policy["max_agents"],
+            executors_per_agent=self.executors,
+            idle_grace_seconds=self.policy["agent_idle_minutes"] * 60,
+            now=to_datetime(now)
+        )
+        self.scale_up_to(plan["desired_capacity"], now)
+        for agent in [a for a in self.agents if a["name"] in plan["terminate"]]:
+            self.terminate_agent(agent, now)
+
+    def scheduled_actions(self, now):
+        """Schedules, warm window and periodic checks due at now"""
+
+        if self.drain_until is not None and self.drain_until <= now:
+            self.stop_master(now)
+        if self.next_shutdown is not None and self.next_shutdown <= now:
+            self.begin_shutdown(now)
+            self.next_shutdown = next_daily(now, *self.shutdown)
+        if self.next_startup is not None and self.next_startup <= now:
+            self.start_master(now)
+            self.scale_up_to(self.warm_floor(now), now)
+            self.next_startup = next_daily(now, *self.startup)
+        if self.next_warm_start is not None and self.next_warm_start <= now:
+            self.start_master(now)
+            self.scale_up_to(self.policy["warm_agents"], now)
+            self.next_warm_start = next_daily(now, *self.warm_start)
+        if self.next_warm_end is not None and self.next_warm_end <= now:
+            self.next_warm_end = next_daily(now, *self.warm_end)
+        if self.next_idle_check is not None and self.next_idle_check <= now:
+            self.idle_check(now)
+        if self.next_autoscale is not None and self.next_autoscale <= now:
+            self.autoscale(now)
+
+    def next_wake(self, now, next_arrival, end):
+        """Earliest time anything can change, or None when nothing will"""
+
+        candidates = []
+        if next_arrival is not None:
+            candidates.append(next_arrival)
+        if self.master == BOOTING:
+            candidates.append(self.master_ready_at)
+        if self.drain_until is not None:
+            candidates.append(self.drain_until)
+        for agent in self.agents:
+            candidates.append(agent["ready_at"])
+            candidates.extend(agent["slots"])
+
+        # Schedules only matter inside the replayed period, or while builds wait on them
+        for boundary in (self.next_shutdown, self.next_startup, self.next_warm_start, self.next_warm_end):
+            if boundary is not None and (boundary <= end or self.queue):
+                candidates.append(boundary)
+
+        # Periodic checks are only woken for when they could act
+        self.next_idle_check = None
+        if self.policy["master"] == "idle" and self.master == RUNNING and self.is_idle(now):
+            due = now if self.idle_seen is None else self.idle_seen + self.policy["idle_shutdown_minutes"] * 60
+            self.next_idle_check = align_up(max(due, now + 1e-6), self.policy["idle_check_minutes"] * 60)
+            candidates.append(self.next_idle_check)
+
+        self.next_autoscale = None
+        if self.policy["agents"] == "queue" and self.master == RUNNING:
+            due = None
+            if self.queue:
+                due = now
+            elif len(self.agents) > max(self.policy["min_agents"], self.warm_floor(now)):
+                grace = self.policy["agent_idle_minutes"] * 60
+                idle_since = [max(a["slots"] + [a["ready_at"]]) for a in self.agents
+                              if a["ready_at"] <= now and all(f <= now for f in a["slots"])]
+                if idle_since:
+                    due = min(idle_since) + grace
+            if due is not None:
+                self.next_autoscale = align_up(max(due, now + 1e-6), self.policy["autoscale_minutes"] * 60)
+                candidates.append(self.next_autoscale)
+
+        later = [c for c in candidates if c > now]
+        return min(later) if later else None
+
+    def initial_state(self, start):
+        """Fleet state at the start of the replay, as the policy leaves it"""
+
+        if self.policy["master"] == "always_on":
+            self.master = RUNNING
+            self.master_started_at = start
+        elif self.policy["master"] == "cron":
+            started = previous_daily(start, *self.startup)
+            stopped = previous_daily(start, *self.shutdown)
+            if started is not None and (stopped is None or started > stopped):
+                self.master = RUNNING
+                self.master_started_at = start
+            self.next_startup = next_daily(start - 1e-6, *self.startup)
+            self.next_shutdown = next_daily(start - 1e-6, *self.shutdown)
+
+        if self.warm_start:
+            floor = self.warm_floor(start)
+            if floor:
+                self.master = RUNNING
+                self.master_started_at = start
+                self.launch_agents(floor, start - self.launch_seconds)
+            self.next_warm_start = next_daily(start - 1e-6, *self.warm_start)
+            self.next_warm_end = next_daily(start - 1e-6, *self.warm_end)
+
+    def run(self, builds, start, end):
+        """Replay builds (sorted (arrival, duration, agent_count) tuples) between start and end"""
+
+        self.initial_state(start)
+        now = start
+        index = 0
+        # Builds still queued at the end may wait for the next startup
+        limit = end + 7 * DAY
+
+        while True:
+            if self.master == BOOTING and self.master_ready_at <= now:
+                self.master = RUNNING
+            while index < len(builds) and builds[index][0] <= now:
+                self.on_trigger(builds[index], now)
+                index += 1
+            self.dispatch(now)
+            self.scheduled_actions(now)
+            self.dispatch(now)
+
+            wake = self.next_wake(now, builds[index][0] if index < len(builds) else None, end)
+            if wake is None or wake > limit:
+                break
+            now = wake
+
+        finish = max(now, end)
+        if self.master != STOPPED:
+            self.master_seconds += finish - self.master_started_at
+        for agent in self.agents:
+            self.agent_seconds += finish - agent["launched"]
+        return self.result(start, end)
+
+    def result(self, start, end):
+        waits = sorted(w / 60.0 for w in self.waits)
+        master_hours = self.master_seconds / 3600.0
+        agent_hours = self.agent_seconds / 3600.0
+        cost = master_hours * self.prices["master"] + agent_hours * self.prices["agent"]
+        days = (end - start) / float(DAY)
+        return {
+            "policy": self.policy["name"],
+            "builds": len(self.waits),
+            "unserved": len(self.queue),
+            "interrupted": self.interrupted,
+            "wait_p50_minutes": round(percentile(waits, 0.5), 2),
+            "wait_p95_minutes": round(percentile(waits, 0.95), 2),
+            "wait_max_minutes": round(waits[-1], 2) if waits else 0.0,
+            "wait_mean_minutes": round(sum(waits) / len(waits), 2) if waits else 0.0,
+            "master_hours": round(master_hours, 1),
+            "agent_hours": round(agent_hours, 1),
+            "master_starts": self.master_starts,
+            "agent_launches": self.agent_launches,
+            "cost": round(cost, 2),
+            "cost_per_30_days": round(cost / days * 30, 2) if days else 0.0,
+            "cost_per_build": round(cost / len(self.waits), 4) if self.waits else None
+        }
+
+def fleet_prices(settings):
+    """Hourly master (on-demand) and blended agent prices"""
+
+    master, _ = get_hourly_price(settings["master_instance_type"], ON_DEMAND, settings["region"])
+    agent_spot, _ = get_hourly_price(settings["agent_instance_type"], SPOT, settings["region"])
+    agent_on_demand, _ = get_hourly_price(settings["agent_instance_type"], ON_DEMAND, settings["region"])
+    share = settings["agent_on_demand_share"]
+    return {"master": master, "agent": agent_spot * (1 - share) + agent_on_demand * share}
+
+def rows_to_builds(rows, build_minutes, job_minutes=None):
+    """Sorted (arrival seconds, duration seconds, agent_count) per logged trigger"""
+
+    builds = []
+    for row in rows:
+        try:
+            arrival = to_seconds(datetime.fromisoformat(row["timestamp"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+        minutes = (job_minutes or {}).get(row.get("job_name"), build_minutes)
+        builds.append((arrival, minutes * 60.0, int(row.get("agent_count") or 1)))
+    builds.sort()
+    return builds
+
+def replay(rows, policies, settings=None, job_minutes=None):
+    """Replay trigger rows against every policy; returns one result per policy"""
+
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    builds = rows_to_builds(rows, settings["build_minutes"], job_minutes)
+    if not builds:
+        return []
+
+    # Whole UTC days, so schedules and costs cover complete days
+    start = builds[0][0] - builds[0][0] % DAY
+    end = builds[-1][0] - builds[-1][0] % DAY + DAY
+    prices = fleet_prices(settings)
+
+    results = []
+    for policy in policies:
+        unknown = set(policy) - set(DEFAULT_POLICY)
+        if unknown:
+            raise ValueError(f"Policy {policy.get('name')}: unknown keys {sorted(unknown)}")
+        policy = dict(DEFAULT_POLICY, **policy)
+        results.append(PolicyReplay(policy, settings, prices).run(builds, start, end))
+
+    # Policies no other policy beats on both p95 wait and cost
+    for result in results:
+        result["pareto"] = not any(
+            other["cost"] <= result["cost"] and other["wait_p95_minutes"] <= result["wait_p95_minutes"]
+            and (other["cost"], other["wait_p95_minutes"]) != (result["cost"], result["wait_p95_minutes"])
+            for other in results
+        )
+    return results
+
+def read_local_logs(path):
+    """Trigger rows from a local copy of build-triggers/ or build-triggers-compacted/"""
+
+    rows = []
+    for directory, _, files in os.walk(path):
+        for name in sorted(files):
+            file_path = os.path.join(directory, name)
+            if name.endswith(".gz"):
+                with gzip.open(file_path, "rt") as f:
+                    rows.extend(json.loads(line) for line in f if line.strip())
+            elif name.endswith((".json", ".jsonl")) and not name.startswith("_"):
+                with open(file_path) as f:
+                    rows.extend(normalize_trigger_record(entry) for entry in parse_raw_log(name, f.read()))
+    return rows
+
+def synthetic_rows(days, triggers_per_hour=3.0, seed=0):
+    """Weekday work-hour triggers with a quiet trickle at night and weekends"""
+
+    rng = random.Random(seed)
+    jobs = ["api", "web", "worker", "infra", "docs"]
+    first = date.today() - timedelta(days=days)
+    rows = []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        for hour in range(24):
+            busy = day.weekday() < 5 and 8 <= hour < 19
+            rate = triggers_per_hour if busy else triggers_per_hour / 20.0
+            moment = 0.0
+            while True:
+                moment += rng.expovariate(rate)
+                if moment >= 1.0:
+                    break
+                timestamp = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour + moment)
+                rows.append({"timestamp": timestamp.isoformat(), "job_name": rng.choice(jobs), "agent_count": 1})
+    return rows
+
+def print_results(results):
+    print(f"  {'policy':24} {'builds':>7} {'wait p50':>9} {'p95':>7} {'max':>7} "
+          f"{'master h':>9} {'agent h':>8} {'cost $':>9} {'$/30d':>8} {'lost':>5}")
+    for r in sorted(results, key=lambda r: r["cost"]):
+        marker = "*" if r["pareto"] else " "
+        print(f"{marker} {r['policy']:24} {r['builds']:7d} {r['wait_p50_minutes']:9.1f} {r['wait_p95_minutes']:7.1f} "
+              f"{r['wait_max_minutes']:7.1f} {r['master_hours']:9.1f} {r['agent_hours']:8.1f} "
+              f"{r['cost']:9.2f} {r['cost_per_30_days']:8.2f} {r['interrupted'] + r['unserved']:5d}")
+    print("Waits in minutes; lost counts builds cut off by a shutdown or never started.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay build triggers against shutdown and scaling policies")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--logs", help="local directory of raw or compacted trigger logs")
+    source.add_argument("--bucket", help="artifacts bucket holding build-triggers/")
+    source.add_argument("--synthetic-days", type=int, help="replay a generated workload of this many days")
+    parser.add_argument("--start", help="first day to replay from S3 (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last day to replay from S3 (YYYY-MM-DD)")
+    parser.add_argument("--policies", help="JSON file with a list of policies")
+    parser.add_argument("--build-minutes", type=float, default=DEFAULT_SETTINGS["build_minutes"])
+    parser.add_argument("--job-minutes", action="append", default=[], metavar="JOB=MINUTES",
+                        help="build duration of one job, repeatable")
+    parser.add_argument("--master-boot-minutes", type=float, default=DEFAULT_SETTINGS["master_boot_minutes"])
+    parser.add_argument("--agent-launch-minutes", type=float, default=DEFAULT_SETTINGS["agent_launch_minutes"])
+    parser.add_argument("--executors", type=int, default=DEFAULT_SETTINGS["executors"])
+    parser.add_argument("--master-instance-type", default=DEFAULT_SETTINGS["master_instance_type"])
+    parser.add_argument("--agent-instance-type", default=DEFAULT_SETTINGS["agent_instance_type"])
+    parser.add_argument("--region", help="pricing region (default AWS_REGION)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    loaded = time.perf_counter()
+    if args.synthetic_days:
+        rows = synthetic_rows(args.synthetic_days)
+    elif args.logs:
+        rows = read_local_logs(args.logs)
+    else:
+        if not args.start or not args.end:
+            parser.error("--bucket needs --start and --end")
+        from aws_clients import get_client
+
+        rows = query_trigger_logs(get_client("s3"), args.bucket, args.start, args.end)
+    loaded = time.perf_counter() - loaded
+
+    policies = POLICIES
+    if args.policies:
+        with open(args.policies) as f:
+            policies = json.load(f)
+    job_minutes = {}
+    for entry in args.job_minutes:
+        job, _, minutes = entry.partition("=")
+        job_minutes[job] = float(minutes)
+
+    settings = {
+        "build_minutes": args.build_minutes,
+        "master_boot_minutes": args.master_boot_minutes,
+        "agent_launch_minutes": args.agent_launch_minutes,
+        "executors": args.executors,
+        "master_instance_type": args.master_instance_type,
+        "agent_instance_type": args.agent_instance_type,
+        "region": args.region
+    }
+
+    started = time.perf_counter()
+    results = replay(rows, policies, settings, job_minutes)
+    elapsed = time.perf_counter() - started
+    if not results:
+        print("No triggers to replay")
+        return 1
+
+    print(f"Replayed {len(rows)} triggers against {len(results)} policies in {elapsed:.2f}s "
+          f"(loading took {loaded:.2f}s)")
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+from jenkins_api import get_json
+from trigger_log_store import query_trigger_logs
+
+# Jenkins agents register under their EC2 instance ID (see jenkins_agent.sh)
+AGENT_EXECUTORS = int(os.environ.get("AGENT_EXECUTORS", "2"))
+MIN_AGENTS = int(os.environ.get("MIN_AGENTS", "0"))
+MAX_AGENTS = int(os.environ.get("MAX_AGENTS", "5"))
+AGENT_IDLE_GRACE_SECONDS = int(os.environ.get("AGENT_IDLE_GRACE_SECONDS", "1800"))
+
+# Forecaster settings: pre-warm agents ahead of peaks seen in past trigger logs
+FORECAST_KEY = "autoscaler/trigger-forecast.json"
+FORECAST_WEEKS = int(os.environ.get("FORECAST_WEEKS", "4"))
+FORECAST_LEAD_MINUTES = int(os.environ.get("FORECAST_LEAD_MINUTES", "15"))
+FORECAST_MAX_AGE_HOURS = 24
+AVG_BUILD_MINUTES = float(os.environ.get("AVG_BUILD_MINUTES", "15"))
+PREWARM_MIN_TRIGGERS = float(os.environ.get("PREWARM_MIN_TRIGGERS", "1"))
+
+QUEUE_PATH = "/queue/api/json?tree=items[id,buildable,blocked,stuck]"
+COMPUTER_PATH = (
+    "/computer/api/json?tree=busyExecutors,totalExecutors,"
+    "computer[displayName,offline,temporarilyOffline,offlineCauseReason,idle,numExecutors,idleStartMilliseconds]"
+)
+MASTER_COMPUTER_CLASS = "hudson.model.Hudson$MasterComputer"
+
+# Offline cause set on agents taken out of service before scale-in (see agent_drain.py)
+DRAIN_OFFLINE_REASON = "Draining for scale-in"
+
+def get_agent_demand(jenkins_url, username, password):
+    """Read the Jenkins build queue and executor state"""
+
+    queue = get_json(jenkins_url, QUEUE_PATH, username, password)
+    computers = get_json(jenkins_url, COMPUTER_PATH, username, password)
+
+    agents = []
+    for computer in computers.get("computer", []):
+        # Builds never run on the built-in node, only on spot agents
+        if computer.get("_class") == MASTER_COMPUTER_CLASS:
+            continue
+
+        idle = computer.get("idle", False)
+        idle_start = computer.get("idleStartMilliseconds")
+        agents.append({
+            "name": computer.get("displayName"),
+            "offline": computer.get("offline", False),
+            "draining": computer.get("temporarilyOffline", False)
+                and computer.get("offlineCauseReason") == DRAIN_OFFLINE_REASON,
+            "idle": idle,
+            "executors": computer.get("numExecutors", AGENT_EXECUTORS),
+            "idle_since": datetime.utcfromtimestamp(idle_start / 1000.0) if idle and idle_start else None
+        })
+
+    busy_executors = computers.get("busyExecutors", 0)
+    return {
+        "queued": sum(1 for item in queue.get("items", []) if item.get("buildable")),
+        "busy_executors": busy_executors,
+        "idle_executors": max(0, computers.get("totalExecutors", 0) - busy_executors),
+        "agents": agents
+    }
+
+def plan_agent_capacity(demand, current_capacity, asg_instance_ids, forecast_agents=0,
+                        min_agents=None, max_agents=None, executors_per_agent=None,
+                        idle_grace_seconds=None, now=None):
+    """Work out the agent capacity that matches current and forecast demand
+
+    Scale-up goes straight to the target. Scale-down only removes agents that
+    have been idle for longer than the grace period (or are offline with
+    nothing running), and names the instances to terminate so busy agents are
+    never picked by the ASG.
+    """
+
+    min_agents = MIN_AGENTS if min_agents is None else min_agents
+    max_agents = MAX_AGENTS if max_agents is None else max_agents
+    executors_per_agent = executors_per_agent or AGENT_EXECUTORS
+    idle_grace_seconds = AGENT_IDLE_GRACE_SECONDS if idle_grace_seconds is None else idle_grace_seconds
+    now = now or datetime.utcnow()
+
+    needed = math.ceil((demand["queued"] + demand["busy_executors"]) / float(executors_per_agent))
+    target = min(max_agents, max(needed, forecast_agents, min_agents))
+
+    plan = {
+        "current_capacity": current_capacity,
+        "needed_agents": needed,
+        "forecast_agents": forecast_agents,
+        "target_capacity": target,
+        "desired_capacity": current_capacity,
+        "terminate": []
+    }
+
+    if target > current_capacity:
+        plan["desired_capacity"] = target
+        plan["reason"] = "scale_up"
+        return plan
+
+    if target == current_capacity:
+        plan["reason"] = "steady"
+        return plan
+
+    # Only agents we own and that have sat idle past the grace period may go;
+    # an offline agent may still be finishing a build
+    grace = timedelta(seconds=idle_grace_seconds)
+    candidates = []
+    for agent in demand["agents"]:
+        if agent["name"] not in asg_instance_ids:
+            continue
+        if agent["offline"] and agent["idle"]:
+            candidates.append((datetime.min, agent["name"]))
+        elif agent["idle"] and agent["idle_since"] and now - agent["idle_since"] >= grace:
+            candidates.append((agent["idle_since"], agent["name"]))
+
+    # Longest idle first
+    candidates.sort()
+    removable = min(current_capacity - target, len(candidates))
+    plan["terminate"] = [name for _, name in candidates[:removable]]
+    plan["desired_capacity"] = current_capacity - removable
+    plan["reason"] = "scale_down" if removable else "waiting_for_idle_grace"
+    return plan
+
+def build_trigger_forecast(s3_client, bucket, weeks=None, now=None):
+    """Average triggers per (weekday, hour) over the last few weeks of trigger logs"""
+
+    weeks = weeks or FORECAST_WEEKS
+    now = now or datetime.utcnow()
+    counts = {}
+
+    rows = query_trigger_logs(
+        s3_client, bucket,
+        (now - timedelta(days=weeks * 7)).date(),
+        (now - timedelta(days=1)).date()
+    )
+    for row in rows:
+        if row["hour"] is None:
+            continue
+        weekday = datetime.fromisoformat(row["date"]).weekday()
+        bucket_key = f"{weekday}-{row['hour']}"
+        counts[bucket_key] = counts.get(bucket_key, 0) + 1
+
+    return {
+        "generated_at": now.isoformat(),
+        "weeks": weeks,
+        "hourly": {k: round(v / float(weeks), 3) for k, v in counts.items()}
+    }
+
+def load_trigger_forecast(s3_client, bucket, now=None):
+    """Load the cached trigger forecast, rebuilding it once a day"""
+
+    now = now or datetime.utcnow()
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=FORECAST_KEY)["Body"].read()
+        forecast = json.loads(body.decode("utf-8"))
+        age = now - datetime.fromisoformat(forecast["generated_at"])
+        if age < timedelta(hours=FORECAST_MAX_AGE_HOURS):
+            return forecast
+    except Exception as e:
+        print(f"Rebuilding trigger forecast: {e}")
+
+    forecast = build_trigger_forecast(s3_client, bucket, now=now)
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=FORECAST_KEY,
+        Body=json.dumps(forecast),
+        ContentType="application/json"
+    )
+    return forecast
+
+def forecast_agents(forecast, now=None, lead_minutes=None, executors_per_agent=None):
+    """Agents to pre-warm for the triggers expected in the upcoming hour"""
+
+    if not forecast:
+        return 0
+
+    now = now or datetime.utcnow()
+    lead_minutes = FORECAST_LEAD_MINUTES if lead_minutes is None else lead_minutes
+    executors_per_agent = executors_per_agent or AGENT_EXECUTORS
+
+    upcoming = now + timedelta(minutes=lead_minutes)
+    expected = forecast.get("hourly", {}).get(f"{upcoming.weekday()}-{upcoming.hour}", 0)
+    if expected < PREWARM_MIN_TRIGGERS:
+        return 0
+
+    builds_per_agent_hour = executors_per_agent * (60.0 / AVG_BUILD_MINUTES)
+    return math.ceil(expected / builds_per_agent_hour)
@@ -0,0 +1,261 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from agent_autoscaler import DRAIN_OFFLINE_REASON, get_agent_demand
+from aws_clients import get_client
+from fleet_collector import chunked
+from jenkins_api import jenkins_request
+from metrics import get_metric_buffer
+
+# Scale-in drains agents rather than letting the ASG pick which to kill:
+#   1. agents are chosen cheapest first: unregistered, idle, then busy
+#   2. chosen agents are marked offline in Jenkins so no new build lands there
+#   3. busy agents are protected from scale-in while their builds run
+#   4. each chosen agent is terminated on its own once idle
+# One invocation waits at most AGENT_DRAIN_WAIT_SECONDS; agents still busy are
+# left to a follow-up invocation, and are terminated anyway once
+# AGENT_DRAIN_TIMEOUT_MINUTES have passed since the drain began.
+AGENT_DRAIN_TIMEOUT_MINUTES = int(os.environ.get("AGENT_DRAIN_TIMEOUT_MINUTES", "30"))
+AGENT_DRAIN_WAIT_SECONDS = int(os.environ.get("AGENT_DRAIN_WAIT_SECONDS", "240"))
+AGENT_DRAIN_POLL_SECONDS = int(os.environ.get("AGENT_DRAIN_POLL_SECONDS", "15"))
+
+# Time kept back from the Lambda timeout to finish up and schedule the follow-up
+DRAIN_RESERVE_SECONDS = 30
+
+# SetInstanceProtection takes at most 50 instances per call
+PROTECTION_BATCH_SIZE = 50
+
+LIVE_STATES = ("Pending", "InService")
+
+metrics = get_metric_buffer("Jenkins/CostOptimization")
+
+def jenkins_settings():
+    """Return (url, user, password) for this deployment's Jenkins, None if unset"""
+
+    jenkins_url = os.environ.get("JENKINS_URL")
+    jenkins_password = os.environ.get("JENKINS_PASSWORD")
+    if not all([jenkins_url, jenkins_password]):
+        return None
+    return jenkins_url, os.environ.get("JENKINS_USER", "admin"), jenkins_password
+
+def drain_window(event=None, context=None, now=None):
+    """Return the drain deadline and how long this invocation may wait for it
+
+    A follow-up invocation carries the deadline of the drain it continues.
+    """
+
+    now = now or datetime.utcnow()
+    if event and event.get("drain_deadline"):
+        deadline = datetime.fromisoformat(event["drain_deadline"])
+    else:
+        deadline = now + timedelta(minutes=AGENT_DRAIN_TIMEOUT_MINUTES)
+
+    wait_seconds = AGENT_DRAIN_WAIT_SECONDS
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        wait_seconds = min(wait_seconds, context.get_remaining_time_in_millis() / 1000.0 - DRAIN_RESERVE_SECONDS)
+
+    return {"deadline": deadline, "wait_until": min(deadline, now + timedelta(seconds=max(0, wait_seconds)))}
+
+def is_busy(agent):
+    """Whether an agent is running a build; unregistered agents never are"""
+
+    return agent is not None and not agent["idle"]
+
+def removal_order(agents, instance_ids):
+    """Order agent instances from cheapest to most expensive to remove
+
+    Instances not registered in Jenkins (booting or lost) go first, then idle
+    agents, offline and longest idle first, then busy agents already draining,
+    then the rest.
+    """
+
+    def rank(instance_id):
+        agent = agents.get(instance_id)
+        if agent is None:
+            return (0, datetime.min, instance_id)
+        if agent["idle"]:
+            return (1 if agent["offline"] else 2, agent["idle_since"] or datetime.min, instance_id)
+        return (3 if agent["draining"] else 4, datetime.min, instance_id)
+
+    return sorted(instance_ids, key=rank)
+
+def set_agents_offline(jenkins, agents, names, offline=True):
+    """Take agents out of service in Jenkins, or bring drained ones back
+
+    Agents already offline for another reason are left alone. Returns the
+    names that changed.
+    """
+
+    jenkins_url, jenkins_user, jenkins_password = jenkins
+    changed = []
+    for name in names:
+        agent = agents.get(name)
+        if agent is None or (agent["offline"] if offline else not agent["draining"]):
+            continue
+        response = jenkins_request(
+            "POST", jenkins_url,
+            f"/computer/{quote(name)}/toggleOffline?offlineMessage={quote(DRAIN_OFFLINE_REASON)}",
+            jenkins_user, jenkins_password, with_crumb=True
+        )
+        if response.status >= 400:
+            print(f"Could not toggle agent {name} offline: HTTP {response.status}")
+            continue
+        changed.append(name)
+    return changed
+
+def set_scale_in_protection(autoscaling_client, asg_name, instance_ids, protected):
+    """Set or clear scale-in protection on agent instances"""
+
+    for batch in chunked(sorted(instance_ids), PROTECTION_BATCH_SIZE):
+        autoscaling_client.set_instance_protection(
+            InstanceIds=batch,
+            AutoScalingGroupName=asg_name,
+            ProtectedFromScaleIn=protected
+        )
+
+def clear_scale_in_protection(autoscaling_client, asg):
+    """Release every protected agent, used once no build can be running"""
+
+    protected = [i["InstanceId"] for i in asg["Instances"] if i.get("ProtectedFromScaleIn")]
+    if protected:
+        print(f"Clearing scale-in protection on {protected}")
+        set_scale_in_protection(autoscaling_client, asg["AutoScalingGroupName"], protected, False)
+    return protected
+
+def sync_scale_in_protection(autoscaling_client, asg, instances, agents, keep_protected=()):
+    """Protect agents running builds and release idle ones"""
+
+    protect, release = [], []
+    for instance_id, instance in instances.items():
+        should_protect = is_busy(agents.get(instance_id)) or instance_id in keep_protected
+        if should_protect and not instance.get("ProtectedFromScaleIn"):
+            protect.append(instance_id)
+        elif not should_protect and instance.get("ProtectedFromScaleIn"):
+            release.append(instance_id)
+
+    if protect:
+        set_scale_in_protection(autoscaling_client, asg["AutoScalingGroupName"], protect, True)
+    if release:
+        set_scale_in_protection(autoscaling_client, asg["AutoScalingGroupName"], release, False)
+
+def terminate_agents(autoscaling_client, instance_ids):
+    """Terminate agents one by one, lowering desired capacity with each"""
+
+    for instance_id in instance_ids:
+        print(f"Terminating drained agent {instance_id}")
+        autoscaling_client.terminate_instance_in_auto_scaling_group(
+            InstanceId=instance_id,
+            ShouldDecrementDesiredCapacity=True
+        )
+
+def read_agents(jenkins):
+    """Jenkins agents by name (their EC2 instance ID)"""
+
+    demand = get_agent_demand(*jenkins)
+    return {agent["name"]: agent for agent in demand["agents"]}
+
+def drain_agents(autoscaling_client, asg, desired_capacity, window, jenkins):
+    """Scale an agent ASG down to desired_capacity without killing builds
+
+    Idle agents are terminated straight away, busy ones as soon as their
+    builds finish inside the wait window. Returns None when Jenkins cannot
+    say which agents are busy, so the caller can fall back to a plain
+    capacity change.
+    """
+
+    asg_name = asg["AutoScalingGroupName"]
+    current_capacity = asg["DesiredCapacity"]
+    instances = {i["InstanceId"]: i for i in asg["Instances"] if i["LifecycleState"] in LIVE_STATES}
+
+    try:
+        agents = read_agents(jenkins)
+    except Exception as e:
+        print(f"Jenkins agent state unavailable, cannot drain: {e}")
+        return None
+
+    victims = removal_order(agents, list(instances))[:max(0, current_capacity - desired_capacity)]
+    sync_scale_in_protection(autoscaling_client, asg, instances, agents)
+
+    # A build may have landed on an idle agent before it went offline
+    if set_agents_offline(jenkins, agents, victims):
+        agents = read_agents(jenkins)
+
+    terminated = []
+    pending = list(victims)
+    while True:
+        ready = [i for i in pending if not is_busy(agents.get(i))]
+        terminate_agents(autoscaling_client, ready)
+        terminated.extend(ready)
+        pending = [i for i in pending if i not in ready]
+
+        now = datetime.utcnow()
+        if not pending or now >= window["wait_until"]:
+            break
+        time.sleep(min(AGENT_DRAIN_POLL_SECONDS, (window["wait_until"] - now).total_seconds()))
+        try:
+            agents = read_agents(jenkins)
+        except Exception as e:
+            print(f"Lost Jenkins agent state while draining: {e}")
+            break
+
+    forced = []
+    if pending and datetime.utcnow() >= window["deadline"]:
+        print(f"Drain deadline passed, terminating busy agents {pending}")
+        terminate_agents(autoscaling_client, pending)
+        forced, pending = pending, []
+        metrics.put("AgentsForceTerminated", len(forced), dimensions={"AutoScalingGroup": asg_name})
+
+    new_capacity = current_capacity - len(terminated) - len(forced)
+
+    # Desired capacity above the live agents is only launches not yet started
+    live = len(instances) - len(terminated) - len(forced)
+    if not pending and new_capacity > desired_capacity >= live:
+        autoscaling_client.set_desired_capacity(
+            AutoScalingGroupName=asg_name,
+            DesiredCapacity=desired_capacity,
+            HonorCooldown=False
+        )
+        new_capacity = desired_capacity
+
+    if terminated:
+        metrics.put("AgentsDrained", len(terminated), dimensions={"AutoScalingGroup": asg_name})
+
+    return {
+        "previous_capacity": current_capacity,
+        "new_capacity": new_capacity,
+        "scaled": new_capacity != current_capacity,
+        "terminated": terminated,
+        "force_terminated": forced,
+        "draining": pending,
+        "drain_deadline": window["deadline"].isoformat()
+    }
+
+def restore_draining_agents(jenkins, agents):
+    """Bring agents still draining back online when capacity is needed again"""
+
+    draining = [agent["name"] for agent in agents if agent.get("draining")]
+    if not draining:
+        return []
+    restored = set_agents_offline(jenkins, {agent["name"]: agent for agent in agents}, draining, offline=False)
+    if restored:
+        print(f"Brought draining agents back online: {restored}")
+    return restored
+
+def schedule_drain_followup(context, event, drain_deadline):
+    """Asynchronously re-invoke this function to keep draining busy agents"""
+
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if not function_name:
+        print("Cannot schedule drain follow-up: unknown function name")
+        return False
+
+    get_client("lambda").invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps(dict(event, drain_deadline=drain_deadline))
+    )
+    print(f"Scheduled drain follow-up until {drain_deadline}")
+    return True
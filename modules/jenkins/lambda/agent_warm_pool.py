@@ -0,0 +1,128 @@
+import os
+from datetime import datetime
+
+from metrics import get_metric_buffer
+
+# Hot agents kept during work hours so the first builds of the day do not
+# wait for a spot launch, bootstrap and JNLP registration. Outside the window
+# the floor drops to MIN_AGENTS and idle agents drain as usual.
+WARM_AGENTS = int(os.environ.get("WARM_AGENTS", "0"))
+WARM_AGENT_HOURS = os.environ.get("WARM_AGENT_HOURS", "08:00-22:00")
+WARM_AGENT_DAYS = os.environ.get("WARM_AGENT_DAYS", "MON-FRI")
+
+DAY_NAMES = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+# EC2 sends the interruption warning two minutes before reclaiming a spot
+# instance; rebalance recommendations come earlier and are handled by the
+# ASG's capacity rebalancing
+SPOT_INTERRUPTION_WARNING = "EC2 Spot Instance Interruption Warning"
+REBALANCE_RECOMMENDATION = "EC2 Instance Rebalance Recommendation"
+
+metrics = get_metric_buffer("Jenkins/CostOptimization")
+
+def parse_days(spec):
+    """Weekday numbers for a spec like "MON-FRI", "MON,WED,FRI" or "*" """
+
+    if spec.strip() in ("*", ""):
+        return set(range(7))
+
+    days = set()
+    for part in spec.upper().split(","):
+        if "-" in part:
+            first, last = (DAY_NAMES.index(d.strip()) for d in part.split("-", 1))
+            day = first
+            while True:
+                days.add(day)
+                if day == last:
+                    break
+                day = (day + 1) % 7
+        else:
+            days.add(DAY_NAMES.index(part.strip()))
+    return days
+
+def parse_hours(spec):
+    """(start, end) minutes of the day for a spec like "08:00-22:00" """
+
+    minutes = []
+    for part in spec.split("-", 1):
+        hour, _, minute = part.strip().partition(":")
+        minutes.append(int(hour) * 60 + int(minute or 0))
+    return minutes[0], minutes[1]
+
+def in_warm_window(now=None, hours=None, days=None):
+    """Whether now (UTC) falls inside the warm agent window
+
+    A window that ends before it starts runs past midnight and belongs to
+    the day it started on.
+    """
+
+    now = now or datetime.utcnow()
+    start, end = parse_hours(hours or WARM_AGENT_HOURS)
+    active_days = parse_days(days or WARM_AGENT_DAYS)
+    minute = now.hour * 60 + now.minute
+
+    if start <= end:
+        return now.weekday() in active_days and start <= minute < end
+    if minute >= start:
+        return now.weekday() in active_days
+    return minute < end and (now.weekday() - 1) % 7 in active_days
+
+def warm_agent_floor(now=None):
+    """Agents to keep running right now"""
+
+    if WARM_AGENTS <= 0:
+        return 0
+    return WARM_AGENTS if in_warm_window(now) else 0
+
+def is_spot_interruption_event(event):
+    """Check whether the event is a spot interruption or rebalance notice"""
+
+    return event.get("source") == "aws.ec2" and event.get("detail-type") in (
+        SPOT_INTERRUPTION_WARNING, REBALANCE_RECOMMENDATION
+    )
+
+def replace_interrupted_agent(autoscaling_client, event, asg_names):
+    """Launch a replacement for an agent spot is about to reclaim
+
+    The instance is detached without lowering desired capacity, so the ASG
+    starts a replacement straight away while the doomed agent uses its last
+    two minutes. Instances outside the given ASGs are ignored.
+    """
+
+    instance_id = event.get("detail", {}).get("instance-id")
+    kind = "interruption" if event.get("detail-type") == SPOT_INTERRUPTION_WARNING else "rebalance"
+    result = {"instance_id": instance_id, "kind": kind, "replaced": False}
+
+    if not instance_id:
+        result["reason"] = "no_instance_id"
+        return result
+
+    response = autoscaling_client.describe_auto_scaling_instances(InstanceIds=[instance_id])
+    instances = response.get("AutoScalingInstances", [])
+    if not instances or instances[0]["AutoScalingGroupName"] not in asg_names:
+        result["reason"] = "not_a_jenkins_agent"
+        return result
+
+    asg_name = instances[0]["AutoScalingGroupName"]
+    result["asg_name"] = asg_name
+    metrics.put("SpotInterruptions", 1, dimensions={"AutoScalingGroup": asg_name, "Kind": kind})
+
+    # Capacity rebalancing already launches a replacement for recommendations
+    if kind == "rebalance":
+        result["reason"] = "capacity_rebalance"
+        return result
+
+    if instances[0]["LifecycleState"] not in ("InService", "Pending"):
+        result["reason"] = f"instance_{instances[0]['LifecycleState'].lower()}"
+        return result
+
+    print(f"Spot interruption for agent {instance_id}, launching a replacement in {asg_name}")
+    autoscaling_client.detach_instances(
+        InstanceIds=[instance_id],
+        AutoScalingGroupName=asg_name,
+        ShouldDecrementDesiredCapacity=False
+    )
+    metrics.put("AgentsReplaced", 1, dimensions={"AutoScalingGroup": asg_name})
+
+    result["replaced"] = True
+    return result
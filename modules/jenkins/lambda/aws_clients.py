@@ -0,0 +1,68 @@
+import os
+import threading
+
+from tracing import instrument_client
+
+# One client per (service, region) for the life of the container. Clients are
+# only built on first use, so an invocation pays for the services it actually
+# calls, and boto3 itself is imported on the first client rather than at init.
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT_SECONDS", "3"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT_SECONDS", "10"))
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "4"))
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "16"))
+
+_clients = {}
+_lock = threading.Lock()
+
+def client_config():
+    """botocore config shared by every client"""
+
+    from botocore.config import Config
+
+    return Config(
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=AWS_READ_TIMEOUT,
+        retries={"mode": "adaptive", "max_attempts": AWS_MAX_ATTEMPTS},
+        # Thread pools in the optimizer share one client per service
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True
+    )
+
+class LazyClient:
+    """Stand-in for a boto3 client that is only built on first attribute access"""
+
+    def __init__(self, service, region_name=None):
+        self.service = service
+        self.region_name = region_name
+        self.client = None
+
+    def resolve(self):
+        if self.client is None:
+            with _lock:
+                if self.client is None:
+                    import boto3
+
+                    kwargs = {"config": client_config()}
+                    if self.region_name:
+                        kwargs["region_name"] = self.region_name
+                    self.client = instrument_client(boto3.client(self.service, **kwargs))
+        return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+def get_client(service, region_name=None):
+    """Return the container-wide client for a service"""
+
+    key = (service, region_name)
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                _clients[key] = LazyClient(service, region_name)
+    return _clients[key]
+
+def created_clients():
+    """Services whose client has actually been built in this container"""
+
+    return sorted(f"{service}@{region}" if region else service
+                  for (service, region), lazy in _clients.items() if lazy.client is not None)
@@ -0,0 +1,346 @@
+import json
+import os
+import re
+import time
+
+from aws_clients import get_client
+
+# Change-aware routing for push triggers (GitHub webhooks, CodeCommit pushes
+# and trigger files listing changed_files). Rules map the branch and changed
+# paths of a push to the jobs that need to run:
+#   {"ignore_paths": ["docs/", "**/*.md"],
+#    "rules": [{"job_name": "api", "branches": ["main", "release/*"], "paths": ["services/api/"]},
+#              {"job_name": "web", "paths": ["web/**", "package.json"]}],
+#    "unmatched": "drop"}
+# A bare list is taken as the rules. A push no rule matches is dropped, or
+# rerouted to the job named by "unmatched". Without rules every push builds.
+# Path patterns: "**" spans directories, "*" and "?" stay inside one, and a
+# pattern without wildcards (or ending in "/") matches everything below it.
+# Sources, first match wins: BUILD_RULES inline JSON, BUILD_RULES_S3_URI.
+BUILD_RULES_CACHE_TTL_SECONDS = int(os.environ.get("BUILD_RULES_CACHE_TTL_SECONDS", "300"))
+UNMATCHED_DROP = "drop"
+RULE_KEYS = {"job_name", "branches", "paths", "ignore_paths", "agent_count", "build_parameters"}
+CONFIG_KEYS = {"rules", "ignore_paths", "unmatched"}
+
+# Changed files come from the push payload; when it is truncated or missing
+# they are looked up with one diff call. A change that cannot be listed is
+# never dropped on its paths: every rule whose branches match builds.
+GITHUB_WEBHOOK_COMMIT_LIMIT = 20
+GITHUB_COMPARE_FILE_LIMIT = 300
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TOKEN_PARAMETER = os.environ.get("GITHUB_TOKEN_PARAMETER")
+DIFF_LOOKUP_TIMEOUT_SECONDS = float(os.environ.get("DIFF_LOOKUP_TIMEOUT_SECONDS", "3"))
+MAX_CHANGED_FILES = int(os.environ.get("MAX_CHANGED_FILES", "3000"))
+NULL_SHA = "0" * 40
+
+_rules = {"value": None, "expires_at": 0}
+_github_token = {}
+
+class PatternSet:
+    """Compiled path or branch patterns; literal prefixes skip the regex"""
+
+    def __init__(self, patterns):
+        self.exact = set()
+        prefixes = []
+        globs = []
+        for pattern in patterns:
+            pattern = pattern.lstrip("/")
+            if pattern.endswith("/**") and not has_wildcard(pattern[:-3]):
+                prefixes.append(pattern[:-2])
+            elif has_wildcard(pattern):
+                globs.append(glob_to_regex(pattern))
+            elif pattern.endswith("/"):
+                prefixes.append(pattern)
+            else:
+                self.exact.add(pattern)
+                prefixes.append(pattern + "/")
+        self.prefixes = tuple(prefixes)
+        self.regex = re.compile("|".join(f"(?:{g})" for g in globs)) if globs else None
+
+    def matches(self, value):
+        if value in self.exact or value.startswith(self.prefixes):
+            return True
+        return self.regex is not None and self.regex.fullmatch(value) is not None
+
+def has_wildcard(pattern):
+    """Whether a pattern needs the regex rather than a prefix test"""
+
+    return "*" in pattern or "?" in pattern
+
+def glob_to_regex(pattern):
+    """Translate a path glob into a regex; unlike fnmatch, "*" stops at "/" """
+
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+def compile_patterns(patterns, field):
+    """Compile an optional list of patterns, None when absent"""
+
+    if patterns is None:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not isinstance(patterns, list) or not all(isinstance(p, str) and p for p in patterns):
+        raise ValueError(f"{field} must be a list of non-empty strings")
+    return PatternSet(patterns)
+
+def compile_build_rules(config):
+    """Validate a rules document and compile its patterns"""
+
+    if isinstance(config, list):
+        config = {"rules": config}
+    if not isinstance(config, dict):
+        raise ValueError("build rules must be a JSON object or list")
+
+    unknown = sorted(set(config) - CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"unknown build rules keys: {', '.join(unknown)}")
+
+    rules = []
+    for index, rule in enumerate(config.get("rules") or []):
+        if not isinstance(rule, dict) or not rule.get("job_name"):
+            raise ValueError(f"build rule {index} has no job_name")
+        unknown = sorted(set(rule) - RULE_KEYS)
+        if unknown:
+            raise ValueError(f"build rule {index} has unknown keys: {', '.join(unknown)}")
+        rules.append({
+            "job_name": rule["job_name"],
+            "branches": compile_patterns(rule.get("branches"), "branches"),
+            "paths": compile_patterns(rule.get("paths"), "paths"),
+            "ignore_paths": compile_patterns(rule.get("ignore_paths"), "ignore_paths"),
+            "agent_count": rule.get("agent_count"),
+            "build_parameters": rule.get("build_parameters") or {}
+        })
+
+    if not rules:
+        return None
+
+    return {
+        "rules": rules,
+        "ignore_paths": compile_patterns(config.get("ignore_paths"), "ignore_paths"),
+        "unmatched": config.get("unmatched") or UNMATCHED_DROP,
+        # Branch-only rules never need the changed file list
+        "needs_changes": bool(config.get("ignore_paths")) or any(
+            rule["paths"] or rule["ignore_paths"] for rule in rules
+        )
+    }
+
+def get_build_rules():
+    """Return the compiled rules, None when routing is off
+
+    Compiled once per container and reloaded after BUILD_RULES_CACHE_TTL_SECONDS
+    so S3-hosted rules can change without a redeploy.
+    """
+
+    if _rules["expires_at"] > time.time():
+        return _rules["value"]
+
+    config = None
+    if os.environ.get("BUILD_RULES"):
+        config = json.loads(os.environ["BUILD_RULES"])
+    elif os.environ.get("BUILD_RULES_S3_URI"):
+        bucket, _, key = os.environ["BUILD_RULES_S3_URI"][len("s3://"):].partition("/")
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+        config = json.loads(body.decode("utf-8"))
+
+    _rules["value"] = compile_build_rules(config) if config else None
+    _rules["expires_at"] = time.time() + BUILD_RULES_CACHE_TTL_SECONDS
+    return _rules["value"]
+
+def rule_matches(rule, branch, changed_files):
+    """Whether one rule selects a push of branch touching changed_files"""
+
+    if rule["branches"] and not rule["branches"].matches(branch):
+        return False
+    if changed_files is None or not (rule["paths"] or rule["ignore_paths"]):
+        return True
+
+    for path in changed_files:
+        if rule["ignore_paths"] and rule["ignore_paths"].matches(path):
+            continue
+        if rule["paths"] is None or rule["paths"].matches(path):
+            return True
+    return False
+
+def route_build(rules, build_params, changed_files):
+    """Return (builds, reason) for one push
+
+    builds is empty when the push needs no build; otherwise it holds one copy
+    of build_params per matching job. changed_files None means unknown.
+    """
+
+    if changed_files is not None and rules["ignore_paths"]:
+        changed_files = [path for path in changed_files if not rules["ignore_paths"].matches(path)]
+
+    # Nothing left to build once the ignored paths are gone, whatever the rules
+    if changed_files is not None and not changed_files:
+        return [], "no relevant changes"
+
+    branch = build_params.get("branch", "")
+    builds = []
+    for rule in rules["rules"]:
+        if any(build["job_name"] == rule["job_name"] for build in builds):
+            continue
+        if not rule_matches(rule, branch, changed_files):
+            continue
+        build = dict(build_params, job_name=rule["job_name"])
+        if rule["agent_count"]:
+            build["agent_count"] = rule["agent_count"]
+        if rule["build_parameters"]:
+            build["build_parameters"] = dict(build_params.get("build_parameters") or {}, **rule["build_parameters"])
+        builds.append(build)
+
+    if builds:
+        return builds, "matched"
+    if rules["unmatched"] != UNMATCHED_DROP:
+        return [dict(build_params, job_name=rules["unmatched"])], "unmatched"
+    return [], "no matching rule"
+
+def is_github_push(payload):
+    """Whether a payload is a GitHub push webhook"""
+
+    return isinstance(payload, dict) and "pusher" in payload and isinstance(payload.get("repository"), dict)
+
+def github_changed_files(payload):
+    """List the paths a GitHub push touched, None if they cannot be listed"""
+
+    commits = payload.get("commits")
+    # The payload lists at most 20 commits; new branches may list none
+    if commits is None or len(commits) >= GITHUB_WEBHOOK_COMMIT_LIMIT or (payload.get("created") and not commits):
+        return github_compare_files(payload)
+
+    changed = set()
+    for commit in commits:
+        for field in ("added", "modified", "removed"):
+            changed.update(commit.get(field) or [])
+    return sorted(changed)
+
+def github_compare_files(payload):
+    """Look the changed paths up with one compare API call"""
+
+    before = payload.get("before") or NULL_SHA
+    after = payload.get("after") or NULL_SHA
+    full_name = payload.get("repository", {}).get("full_name")
+    if NULL_SHA in (before, after) or not full_name:
+        return None
+
+    from jenkins_api import get_http
+
+    headers = {"Accept": "application/vnd.github+json", "User-Agent": "jenkins-trigger"}
+    token = get_github_token()
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    try:
+        response = get_http().request(
+            "GET", f"{GITHUB_API_URL}/repos/{full_name}/compare/{before}...{after}",
+            headers=headers, timeout=DIFF_LOOKUP_TIMEOUT_SECONDS
+        )
+        if response.status != 200:
+            print(f"GitHub compare for {full_name} returned {response.status}")
+            return None
+        files = json.loads(response.data.decode("utf-8")).get("files") or []
+    except Exception as e:
+        print(f"GitHub compare for {full_name} failed: {e}")
+        return None
+
+    # The compare API stops listing files at 300
+    if len(files) >= GITHUB_COMPARE_FILE_LIMIT:
+        return None
+    changed = set()
+    for entry in files:
+        changed.add(entry["filename"])
+        if entry.get("previous_filename"):
+            changed.add(entry["previous_filename"])
+    return sorted(changed)
+
+def get_github_token():
+    """Read the GitHub token from SSM once per container"""
+
+    if not GITHUB_TOKEN_PARAMETER:
+        return None
+    if GITHUB_TOKEN_PARAMETER not in _github_token:
+        try:
+            response = get_client("ssm").get_parameter(Name=GITHUB_TOKEN_PARAMETER, WithDecryption=True)
+            _github_token[GITHUB_TOKEN_PARAMETER] = response["Parameter"]["Value"] or None
+        except Exception as e:
+            print(f"Could not read GitHub token: {e}")
+            return None
+    return _github_token[GITHUB_TOKEN_PARAMETER]
+
+def codecommit_changed_files(detail):
+    """List the paths a CodeCommit reference update touched with GetDifferences"""
+
+    if not detail.get("oldCommitId") or not detail.get("commitId"):
+        return None
+
+    changed = set()
+    try:
+        paginator = get_client("codecommit").get_paginator("get_differences")
+        for page in paginator.paginate(
+            repositoryName=detail["repositoryName"],
+            beforeCommitSpecifier=detail["oldCommitId"],
+            afterCommitSpecifier=detail["commitId"]
+        ):
+            for difference in page["differences"]:
+                for blob in ("beforeBlob", "afterBlob"):
+                    if difference.get(blob, {}).get("path"):
+                        changed.add(difference[blob]["path"])
+            if len(changed) > MAX_CHANGED_FILES:
+                return None
+    except Exception as e:
+        print(f"CodeCommit diff for {detail.get('repositoryName')} failed: {e}")
+        return None
+    return sorted(changed)
+
+def is_branch_deletion(event):
+    """Whether a push event deletes its branch, which never needs a build"""
+
+    if event.get("source") == "aws.codecommit":
+        return event.get("detail", {}).get("event") == "referenceDeleted"
+    return bool(push_payload(event).get("deleted"))
+
+def push_payload(event):
+    """Return the GitHub push payload of a direct or API Gateway event"""
+
+    if "httpMethod" in event:
+        try:
+            body = json.loads(event.get("body") or "{}")
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+    return event
+
+def event_changed_files(event, build_params):
+    """List the paths a push touched, None when they cannot be determined"""
+
+    payload = push_payload(event)
+    if build_params.get("changed_files") is not None:
+        files = build_params["changed_files"]
+    elif event.get("source") == "aws.codecommit":
+        files = codecommit_changed_files(event.get("detail", {}))
+    elif is_github_push(payload):
+        files = github_changed_files(payload)
+    else:
+        return None
+
+    if files is not None and len(files) > MAX_CHANGED_FILES:
+        return None
+    return files
@@ -1,7 +1,19 @@
 import json
-import boto3
 import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from agent_warm_pool import is_spot_interruption_event, replace_interrupted_agent, warm_agent_floor
+from aws_clients import get_client
+from fleet_collector import (
+    INSTANCE_ID_CHUNK_SIZE, chunked, collect_fleet_snapshot, describe_asg, describe_instances_by_id
+)
+from fleet_registry import load_fleet_registry, local_fleet, run_per_fleet
+from metrics import get_metric_buffer
+from pricing import ON_DEMAND, SPOT, get_hourly_price
+
+# Buffered for the invocation and flushed once by the handler
+metrics = get_metric_buffer("Jenkins/CostOptimization")
 
 def handler(event, context):
     """
@@ -11,30 +23,81 @@ def handler(event, context):
     
     print(f"Received event: {json.dumps(event, default=str)}")
     
-    # Get environment variables
-    jenkins_instance_id = os.environ.get("JENKINS_INSTANCE_ID")
-    asg_name = os.environ.get("ASG_NAME")
-    
-    if not jenkins_instance_id:
-        return {
-            "statusCode": 400,
-            "body": json.dumps("Missing JENKINS_INSTANCE_ID environment variable")
-        }
-    
-    # Initialize AWS clients
-    ec2_client = boto3.client("ec2")
-    autoscaling_client = boto3.client("autoscaling")
-    cloudwatch_client = boto3.client("cloudwatch")
+    # Container-wide clients, built on first use
+    ec2_client = get_client("ec2")
+    autoscaling_client = get_client("autoscaling")
+    cloudwatch_client = get_client("cloudwatch")
     
     try:
-        # Parse the action from the event
-        action = event.get("action", "unknown")
-        print(f"Executing action: {action}")
+        # Resolve the fleets to act on; a single-fleet deployment resolves to
+        # its own JENKINS_INSTANCE_ID / ASG_NAME
+        fleets = load_fleet_registry(event, ec2_client, autoscaling_client)
+        if not fleets:
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Missing JENKINS_INSTANCE_ID environment variable or fleet registry")
+            }
+        
+        multi_fleet = len(fleets) > 1 or "fleets" in event
         
-        if action == "shutdown":
+        # Actions that are not fanned out act on this deployment's own fleet,
+        # whichever position the registry lists it in
+        local = local_fleet(fleets)
+        if local is None:
+            return {
+                "statusCode": 400,
+                "body": json.dumps("Missing JENKINS_INSTANCE_ID environment variable for the local fleet")
+            }
+        jenkins_instance_id = local["jenkins_instance_id"]
+        asg_name = local["asg_name"]
+        
+        # Parse the action from the event; spot notices arrive straight from EC2
+        action = event.get("action") or ("spot_interruption" if is_spot_interruption_event(event) else "unknown")
+        print(f"Executing action: {action} on {len(fleets)} fleet(s)")
+        
+        if multi_fleet and action == "shutdown":
+            result = shutdown_jenkins_fleets(
+                ec2_client, autoscaling_client, cloudwatch_client, fleets,
+                window=get_drain_window(event, context)
+            )
+        elif multi_fleet and action == "startup":
+            result = startup_jenkins_fleets(
+                ec2_client, autoscaling_client, cloudwatch_client, fleets
+            )
+        elif multi_fleet and action == "scale_agents":
+            result = scale_fleet_agents(
+                autoscaling_client, cloudwatch_client, fleets, local,
+                event.get("desired_capacity", 0), window=get_drain_window(event, context)
+            )
+        elif multi_fleet and action == "idle_check":
+            result = idle_check_fleets(
+                ec2_client, autoscaling_client, cloudwatch_client, fleets,
+                window=get_drain_window(event, context), resume_drain=bool(event.get("drain_deadline"))
+            )
+        elif multi_fleet and action == "utilization_report":
+            result = run_per_fleet(
+                fleets,
+                lambda fleet: generate_utilization_report(
+                    ec2_client, autoscaling_client, cloudwatch_client,
+                    fleet["jenkins_instance_id"], fleet["asg_name"], event
+                )
+            )
+        elif multi_fleet and action == "cost_report":
+            result = run_per_fleet(
+                fleets,
+                lambda fleet: generate_cost_report(
+                    ec2_client, autoscaling_client, cloudwatch_client,
+                    fleet["jenkins_instance_id"], fleet["asg_name"]
+                )
+            )
+        elif action == "spot_interruption":
+            result = replace_interrupted_agent(
+                autoscaling_client, event, [f["asg_name"] for f in fleets if f["asg_name"]]
+            )
+        elif action == "shutdown":
             result = shutdown_jenkins_infrastructure(
                 ec2_client, autoscaling_client, cloudwatch_client,
-                jenkins_instance_id, asg_name
+                jenkins_instance_id, asg_name, window=get_drain_window(event, context)
             )
         elif action == "startup":
             result = startup_jenkins_infrastructure(
@@ -45,7 +108,24 @@ def handler(event, context):
             desired_capacity = event.get("desired_capacity", 0)
             result = scale_jenkins_agents(
                 autoscaling_client, cloudwatch_client,
-                asg_name, desired_capacity
+                asg_name, desired_capacity, window=get_drain_window(event, context)
+            )
+        elif action == "idle_check":
+            result = idle_check_jenkins(
+                ec2_client, autoscaling_client, cloudwatch_client,
+                jenkins_instance_id, asg_name,
+                window=get_drain_window(event, context), resume_drain=bool(event.get("drain_deadline"))
+            )
+        elif action == "autoscale":
+            result = autoscale_jenkins_agents(
+                autoscaling_client, cloudwatch_client, asg_name
+            )
+        elif action == "compact_trigger_logs":
+            result = compact_build_trigger_logs(event)
+        elif action == "utilization_report":
+            result = generate_utilization_report(
+                ec2_client, autoscaling_client, cloudwatch_client,
+                jenkins_instance_id, asg_name, event
             )
         elif action == "cost_report":
             result = generate_cost_report(
@@ -58,6 +138,12 @@ def handler(event, context):
                 "body": json.dumps(f"Unknown action: {action}")
             }
         
+        # Builds still running on agents being drained; finish in a follow-up
+        if result.get("draining"):
+            from agent_drain import schedule_drain_followup
+            
+            schedule_drain_followup(context, event, result["drain_deadline"])
+        
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -73,10 +159,18 @@ def handler(event, context):
             "statusCode": 500,
             "body": json.dumps(f"Error executing cost optimization: {str(e)}")
         }
+    
+    finally:
+        metrics.flush(cloudwatch_client)
 
 def shutdown_jenkins_infrastructure(ec2_client, autoscaling_client, cloudwatch_client, 
-                                  jenkins_instance_id, asg_name):
-    """Shutdown Jenkins infrastructure to save costs"""
+                                  jenkins_instance_id, asg_name, window=None):
+    """Shutdown Jenkins infrastructure to save costs
+    
+    Agents are drained before the master stops, since stopping it ends every
+    running build. While builds are still finishing the master is left
+    running and the result lists the draining agents.
+    """
     
     result = {
         "jenkins_master": "not_changed",
@@ -92,6 +186,21 @@ def shutdown_jenkins_infrastructure(ec2_client, autoscaling_client, cloudwatch_c
         
         print(f"Jenkins master current state: {instance_state}")
         
+        # Scale down Jenkins agents to 0; builds can only still be running
+        # while the master is up
+        if asg_name:
+            agents_scaled = scale_jenkins_agents(
+                autoscaling_client, cloudwatch_client, asg_name, 0,
+                drain=instance_state == "running", window=window
+            )
+            result["agents_scaled"] = agents_scaled.get("previous_capacity", 0)
+            if agents_scaled.get("draining"):
+                result["jenkins_master"] = "draining"
+                result["draining"] = agents_scaled["draining"]
+                result["drain_deadline"] = agents_scaled["drain_deadline"]
+                print(f"Waiting for builds on {result['draining']} before stopping the master")
+                return result
+        
         # Stop Jenkins master if it's running
         if instance_state == "running":
             print("Stopping Jenkins master instance...")
@@ -99,30 +208,19 @@ def shutdown_jenkins_infrastructure(ec2_client, autoscaling_client, cloudwatch_c
             result["jenkins_master"] = "stopped"
             
             # Send custom metric
-            cloudwatch_client.put_metric_data(
-                Namespace="Jenkins/CostOptimization",
-                MetricData=[
-                    {
-                        "MetricName": "MasterInstanceStopped",
-                        "Value": 1,
-                        "Unit": "Count",
-                        "Timestamp": datetime.utcnow()
-                    }
-                ]
-            )
+            metrics.put("MasterInstanceStopped", 1)
         else:
             print(f"Jenkins master already in state: {instance_state}")
         
-        # Scale down Jenkins agents to 0
-        if asg_name:
-            agents_scaled = scale_jenkins_agents(
-                autoscaling_client, cloudwatch_client, asg_name, 0
-            )
-            result["agents_scaled"] = agents_scaled.get("previous_capacity", 0)
-        
-        # Calculate estimated cost savings
+        # Calculate estimated cost savings: the on-demand master plus the spot
+        # agents that were scaled away
         instance_type = instance.get("InstanceType", "t3.medium")
-        estimated_hourly_savings = get_estimated_hourly_cost(instance_type)
+        estimated_hourly_savings = 0.0
+        if result["jenkins_master"] == "stopped":
+            estimated_hourly_savings += get_estimated_hourly_cost(instance_type)
+        agent_type = os.environ.get("AGENT_INSTANCE_TYPE")
+        if agent_type and result["agents_scaled"]:
+            estimated_hourly_savings += result["agents_scaled"] * get_estimated_hourly_cost(agent_type, spot=True)
         result["estimated_hourly_savings"] = f"${estimated_hourly_savings:.4f}"
         
         print(f"Shutdown completed: {result}")
@@ -157,36 +255,30 @@ def startup_jenkins_infrastructure(ec2_client, autoscaling_client, cloudwatch_cl
             result["jenkins_master"] = "started"
             
             # Send custom metric
-            cloudwatch_client.put_metric_data(
-                Namespace="Jenkins/CostOptimization",
-                MetricData=[
-                    {
-                        "MetricName": "MasterInstanceStarted",
-                        "Value": 1,
-                        "Unit": "Count",
-                        "Timestamp": datetime.utcnow()
-                    }
-                ]
-            )
+            metrics.put("MasterInstanceStarted", 1)
             
             # Wait for instance to be running (with timeout)
             print("Waiting for Jenkins master to be running...")
             waiter = ec2_client.get_waiter("instance_running")
-            waiter.wait(
-                InstanceIds=[jenkins_instance_id],
-                WaiterConfig={"Delay": 15, "MaxAttempts": 20}
-            )
+            with metrics.timer("MasterBootWait"):
+                waiter.wait(
+                    InstanceIds=[jenkins_instance_id],
+                    WaiterConfig={"Delay": 15, "MaxAttempts": 20}
+                )
             print("Jenkins master is now running")
             
         elif instance_state == "running":
             print("Jenkins master is already running")
             result["jenkins_master"] = "already_running"
         
-        # Prepare agents for potential builds (but don't start them yet)
-        # They will be started on-demand by the build trigger Lambda
+        # Bring up the warm agents for the day; any others are started
+        # on demand by the build trigger Lambda and the autoscaler
         if asg_name:
-            # Ensure ASG is configured but keep desired capacity at 0
-            # Agents will be scaled up when builds are triggered
+            warm_agents = warm_agent_floor()
+            if warm_agents:
+                result["warm_agents"] = scale_agents_to_floor(
+                    autoscaling_client, cloudwatch_client, asg_name, warm_agents
+                )
             result["agents_ready"] = True
         
         print(f"Startup completed: {result}")
@@ -196,8 +288,182 @@ def startup_jenkins_infrastructure(ec2_client, autoscaling_client, cloudwatch_cl
         print(f"Error during startup: {e}")
         raise
 
-def scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, desired_capacity):
-    """Scale Jenkins agents up or down"""
+def get_drain_window(event, context):
+    """Drain deadline and wait budget for this invocation (see agent_drain.py)"""
+    
+    from agent_drain import drain_window
+    
+    return drain_window(event, context)
+
+def scale_agents_to_floor(autoscaling_client, cloudwatch_client, asg_name, floor):
+    """Raise the agent ASG to at least floor agents, never lowering it"""
+    
+    response = autoscaling_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
+    if not response["AutoScalingGroups"]:
+        return {"error": f"ASG {asg_name} not found"}
+    
+    current_capacity = response["AutoScalingGroups"][0]["DesiredCapacity"]
+    if current_capacity >= floor:
+        return {"current_capacity": current_capacity, "scaled": False}
+    return scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, floor)
+
+def describe_fleet_masters(ec2_client, fleets):
+    """Describe every fleet's master in sharded, concurrent batches"""
+    
+    master_ids = sorted({fleet["jenkins_instance_id"] for fleet in fleets})
+    masters = {}
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        shards = pool.map(
+            lambda shard: describe_instances_by_id(ec2_client, shard),
+            chunked(master_ids, INSTANCE_ID_CHUNK_SIZE)
+        )
+        for shard in shards:
+            masters.update((inst["instance_id"], inst) for inst in shard)
+    return masters
+
+def shutdown_jenkins_fleets(ec2_client, autoscaling_client, cloudwatch_client, fleets, window=None):
+    """Shutdown many Jenkins fleets with batched EC2 calls
+    
+    This deployment's own fleet is drained like a single-fleet shutdown, so
+    its running builds finish first. Other fleets' Jenkins cannot be asked
+    which agents are busy; their agents are scaled to 0 before their masters
+    stop.
+    """
+    
+    local_instance_id = os.environ.get("JENKINS_INSTANCE_ID")
+    local = [f for f in fleets if f["jenkins_instance_id"] == local_instance_id]
+    remote = [f for f in fleets if f["jenkins_instance_id"] != local_instance_id]
+    
+    local_results = run_per_fleet(
+        local,
+        lambda fleet: shutdown_jenkins_infrastructure(
+            ec2_client, autoscaling_client, cloudwatch_client,
+            fleet["jenkins_instance_id"], fleet["asg_name"], window=window
+        )
+    )
+    
+    masters = describe_fleet_masters(ec2_client, remote) if remote else {}
+    
+    # Agents go first so none keeps running after its master has stopped
+    agents = run_per_fleet(
+        [f for f in remote if f["asg_name"]],
+        lambda fleet: scale_jenkins_agents(
+            autoscaling_client, cloudwatch_client, fleet["asg_name"], 0, drain=False
+        )
+    )
+    
+    to_stop = sorted(i for i, m in masters.items() if m["state"] == "running")
+    
+    # One StopInstances call per shard of masters instead of one per fleet
+    for shard in chunked(to_stop, INSTANCE_ID_CHUNK_SIZE):
+        print(f"Stopping Jenkins masters: {shard}")
+        ec2_client.stop_instances(InstanceIds=shard)
+    
+    if to_stop:
+        metrics.put("MasterInstanceStopped", len(to_stop))
+    
+    agent_type = os.environ.get("AGENT_INSTANCE_TYPE")
+    result = {"fleets": {}, "masters_stopped": len(to_stop)}
+    total_savings = 0.0
+    for fleet in remote:
+        master = masters.get(fleet["jenkins_instance_id"])
+        fleet_result = {
+            "jenkins_master": "not_found" if not master else (
+                "stopped" if fleet["jenkins_instance_id"] in to_stop else "not_changed"
+            ),
+            "agents_scaled": agents.get(fleet["name"], {}).get("previous_capacity", 0)
+        }
+        if fleet["name"] in agents and "error" in agents[fleet["name"]]:
+            fleet_result["agents_error"] = agents[fleet["name"]]["error"]
+        
+        savings = 0.0
+        if fleet_result["jenkins_master"] == "stopped":
+            savings += get_estimated_hourly_cost(master["instance_type"])
+        if agent_type and fleet_result["agents_scaled"]:
+            savings += fleet_result["agents_scaled"] * get_estimated_hourly_cost(agent_type, spot=True)
+        fleet_result["estimated_hourly_savings"] = f"${savings:.4f}"
+        total_savings += savings
+        
+        result["fleets"][fleet["name"]] = fleet_result
+    
+    for name, fleet_result in local_results.items():
+        result["fleets"][name] = fleet_result
+        if fleet_result.get("jenkins_master") == "stopped":
+            result["masters_stopped"] += 1
+        total_savings += float(fleet_result.get("estimated_hourly_savings", "$0").lstrip("$"))
+        
+        # The handler schedules the drain follow-up from the top-level fields
+        if fleet_result.get("draining"):
+            result["draining"] = fleet_result["draining"]
+            result["drain_deadline"] = fleet_result["drain_deadline"]
+    
+    result["estimated_hourly_savings"] = f"${total_savings:.4f}"
+    print(f"Fleet shutdown completed: {result}")
+    return result
+
+def startup_jenkins_fleets(ec2_client, autoscaling_client, cloudwatch_client, fleets):
+    """Startup many Jenkins fleets with batched EC2 calls"""
+    
+    masters = describe_fleet_masters(ec2_client, fleets)
+    to_start = sorted(i for i, m in masters.items() if m["state"] == "stopped")
+    shards = chunked(to_start, INSTANCE_ID_CHUNK_SIZE)
+    
+    for shard in shards:
+        print(f"Starting Jenkins masters: {shard}")
+        ec2_client.start_instances(InstanceIds=shard)
+    
+    if to_start:
+        metrics.put("MasterInstanceStarted", len(to_start))
+        
+        # All masters boot in parallel; wait on each shard once
+        waiter = ec2_client.get_waiter("instance_running")
+        with metrics.timer("MasterBootWait"):
+            for shard in shards:
+                waiter.wait(
+                    InstanceIds=shard,
+                    WaiterConfig={"Delay": 15, "MaxAttempts": 20}
+                )
+        print("Jenkins masters are now running")
+    
+    result = {"fleets": {}, "masters_started": len(to_start), "startup_time": datetime.utcnow().isoformat()}
+    for fleet in fleets:
+        master = masters.get(fleet["jenkins_instance_id"])
+        if not master:
+            state = "not_found"
+        elif fleet["jenkins_instance_id"] in to_start:
+            state = "started"
+        elif master["state"] == "running":
+            state = "already_running"
+        else:
+            state = "not_changed"
+        # Beyond the warm agents, agents start when the build trigger Lambda asks for them
+        result["fleets"][fleet["name"]] = {
+            "jenkins_master": state,
+            "agents_ready": bool(fleet["asg_name"])
+        }
+    
+    warm_agents = warm_agent_floor()
+    if warm_agents:
+        warmed = run_per_fleet(
+            [f for f in fleets if f["asg_name"]],
+            lambda fleet: scale_agents_to_floor(
+                autoscaling_client, cloudwatch_client, fleet["asg_name"], warm_agents
+            )
+        )
+        for name, warm_result in warmed.items():
+            result["fleets"][name]["warm_agents"] = warm_result
+    
+    print(f"Fleet startup completed: {result}")
+    return result
+
+def scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, desired_capacity,
+                         drain=True, window=None):
+    """Scale Jenkins agents up or down
+    
+    Scale-down drains agents through Jenkins so running builds finish first
+    (see agent_drain.py). drain=False is for fleets whose Jenkins this
+    function cannot reach.
+    """
     
     if not asg_name:
         return {"error": "No ASG name provided"}
@@ -216,6 +482,24 @@ def scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, desire
         
         print(f"Current agent capacity: {current_capacity}, desired: {desired_capacity}")
         
+        if drain and desired_capacity < current_capacity:
+            # Only scale-in needs Jenkins and the drain helpers
+            from agent_drain import clear_scale_in_protection, drain_agents, drain_window, jenkins_settings
+            
+            jenkins = jenkins_settings()
+            drained = None
+            if jenkins:
+                drained = drain_agents(
+                    autoscaling_client, asg, desired_capacity, window or drain_window(), jenkins
+                )
+            if drained is not None:
+                if drained["scaled"]:
+                    metrics.put("AgentsScaled", drained["new_capacity"], dimensions={"AutoScalingGroup": asg_name})
+                return drained
+            
+            # Without Jenkins no build can be running; protection would only block the scale-in
+            clear_scale_in_protection(autoscaling_client, asg)
+        
         if current_capacity != desired_capacity:
             print(f"Scaling agents from {current_capacity} to {desired_capacity}")
             
@@ -226,23 +510,7 @@ def scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, desire
             )
             
             # Send custom metric
-            cloudwatch_client.put_metric_data(
-                Namespace="Jenkins/CostOptimization",
-                MetricData=[
-                    {
-                        "MetricName": "AgentsScaled",
-                        "Value": desired_capacity,
-                        "Unit": "Count",
-                        "Timestamp": datetime.utcnow(),
-                        "Dimensions": [
-                            {
-                                "Name": "AutoScalingGroup",
-                                "Value": asg_name
-                            }
-                        ]
-                    }
-                ]
-            )
+            metrics.put("AgentsScaled", desired_capacity, dimensions={"AutoScalingGroup": asg_name})
             
             return {
                 "previous_capacity": current_capacity,
@@ -260,6 +528,283 @@ def scale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name, desire
         print(f"Error scaling agents: {e}")
         raise
 
+def autoscale_jenkins_agents(autoscaling_client, cloudwatch_client, asg_name):
+    """Size the agent ASG to the Jenkins build queue and forecast demand"""
+    
+    # Only this action needs the autoscaler and the trigger log store
+    from agent_autoscaler import (
+        MIN_AGENTS, forecast_agents, get_agent_demand, load_trigger_forecast, plan_agent_capacity
+    )
+    from agent_drain import (
+        is_busy, read_agents, restore_draining_agents, set_agents_offline, sync_scale_in_protection,
+        terminate_agents
+    )
+    
+    if not asg_name:
+        return {"error": "No ASG name provided"}
+    
+    jenkins_url = os.environ.get("JENKINS_URL")
+    jenkins_user = os.environ.get("JENKINS_USER", "admin")
+    jenkins_password = os.environ.get("JENKINS_PASSWORD")
+    s3_bucket = os.environ.get("S3_BUCKET")
+    
+    if not all([jenkins_url, jenkins_password]):
+        return {"error": "Missing Jenkins connection settings"}
+    
+    response = autoscaling_client.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[asg_name]
+    )
+    if not response["AutoScalingGroups"]:
+        return {"error": f"ASG {asg_name} not found"}
+    
+    asg = response["AutoScalingGroups"][0]
+    current_capacity = asg["DesiredCapacity"]
+    asg_instance_ids = {inst["InstanceId"] for inst in asg["Instances"]}
+    
+    try:
+        demand = get_agent_demand(jenkins_url, jenkins_user, jenkins_password)
+    except Exception as e:
+        # Master stopped or still booting: leave capacity to the trigger and shutdown paths
+        print(f"Jenkins demand unavailable, not autoscaling: {e}")
+        return {"scaled": False, "reason": "jenkins_unreachable", "current_capacity": current_capacity}
+    
+    prewarm = 0
+    if s3_bucket:
+        try:
+            prewarm = forecast_agents(load_trigger_forecast(get_client("s3"), s3_bucket))
+        except Exception as e:
+            print(f"Error loading trigger forecast: {e}")
+    
+    plan = plan_agent_capacity(
+        demand, current_capacity, asg_instance_ids, forecast_agents=prewarm,
+        min_agents=max(MIN_AGENTS, warm_agent_floor())
+    )
+    print(f"Autoscaling plan: {plan}")
+    
+    jenkins = (jenkins_url, jenkins_user, jenkins_password)
+    agents = {agent["name"]: agent for agent in demand["agents"]}
+    
+    if plan["desired_capacity"] > current_capacity:
+        # Agents left draining by an earlier scale-in can take builds again
+        restore_draining_agents(jenkins, demand["agents"])
+        scale_jenkins_agents(
+            autoscaling_client, cloudwatch_client, asg_name, plan["desired_capacity"]
+        )
+    
+    # Scale down by terminating the chosen idle agents only, never a busy one.
+    # They go offline first and are checked again, so a build that started
+    # since the demand was read keeps its agent until it finishes.
+    terminated = []
+    if plan["terminate"]:
+        if set_agents_offline(jenkins, agents, plan["terminate"]):
+            agents = read_agents(jenkins)
+        terminated = [i for i in plan["terminate"] if not is_busy(agents.get(i))]
+        terminate_agents(autoscaling_client, terminated)
+    
+    if terminated:
+        metrics.put("AgentsScaled", current_capacity - len(terminated), dimensions={"AutoScalingGroup": asg_name})
+    
+    # Running builds keep their agents whatever else scales the group in
+    sync_scale_in_protection(
+        autoscaling_client, asg,
+        {i["InstanceId"]: i for i in asg["Instances"] if i["InstanceId"] not in terminated}, agents
+    )
+    
+    new_capacity = current_capacity - len(terminated)
+    if plan["desired_capacity"] > current_capacity:
+        new_capacity = plan["desired_capacity"]
+    return {
+        "scaled": new_capacity != current_capacity,
+        "reason": plan["reason"],
+        "previous_capacity": current_capacity,
+        "new_capacity": new_capacity,
+        "queued_builds": demand["queued"],
+        "busy_executors": demand["busy_executors"],
+        "idle_executors": demand["idle_executors"],
+        "forecast_agents": prewarm,
+        "terminated": terminated
+    }
+
+def scale_fleet_agents(autoscaling_client, cloudwatch_client, fleets, local, desired_capacity, window=None):
+    """Scale the local fleet's agents, draining busy ones first
+    
+    Other fleets' builds are not visible from the local Jenkins, so a
+    scale-in there could cut running builds off; they are skipped.
+    """
+    
+    def is_local(fleet):
+        return fleet["jenkins_instance_id"] == local["jenkins_instance_id"]
+    
+    def scale(fleet):
+        if not is_local(fleet):
+            print(f"Skipping agent scaling for fleet {fleet['name']}: its Jenkins is not this deployment's")
+            return {"scaled": False, "reason": "remote_jenkins"}
+        return scale_jenkins_agents(
+            autoscaling_client, cloudwatch_client, local["asg_name"], desired_capacity, window=window
+        )
+    
+    result = {"fleets": run_per_fleet([f for f in fleets if f["asg_name"] or is_local(f)], scale)}
+    
+    # The handler schedules the drain follow-up from the top-level fields
+    for fleet_result in result["fleets"].values():
+        if fleet_result.get("draining"):
+            result["draining"] = fleet_result["draining"]
+            result["drain_deadline"] = fleet_result["drain_deadline"]
+    return result
+
+def idle_check_fleets(ec2_client, autoscaling_client, cloudwatch_client, fleets,
+                      window=None, resume_drain=False):
+    """Idle check across fleets; only this deployment's Jenkins can be asked for demand
+    
+    Other fleets' agents are not registered on the local Jenkins, so they
+    are left alone rather than judged idle from its queue.
+    """
+    
+    local_instance_id = os.environ.get("JENKINS_INSTANCE_ID")
+    
+    def check(fleet):
+        if fleet["jenkins_instance_id"] != local_instance_id:
+            return {"shutdown": False, "reason": "remote_jenkins"}
+        return idle_check_jenkins(
+            ec2_client, autoscaling_client, cloudwatch_client,
+            fleet["jenkins_instance_id"], fleet["asg_name"],
+            window=window, resume_drain=resume_drain
+        )
+    
+    result = {"fleets": run_per_fleet(fleets, check)}
+    
+    # The handler schedules the drain follow-up from the top-level fields
+    for fleet_result in result["fleets"].values():
+        if fleet_result.get("draining"):
+            result["draining"] = fleet_result["draining"]
+            result["drain_deadline"] = fleet_result["drain_deadline"]
+    return result
+
+def idle_check_jenkins(ec2_client, autoscaling_client, cloudwatch_client,
+                       jenkins_instance_id, asg_name, now=None, window=None, resume_drain=False):
+    """Stop the master and its agents once Jenkins has been idle long enough
+    
+    Idle means no queued or running builds and no master or agent CPU above
+    IDLE_CPU_THRESHOLD. Any activity restarts the idle clock; a shutdown is
+    never made while a build is running. A follow-up invocation
+    (resume_drain) finishes a shutdown that was waiting for agents to drain.
+    """
+    
+    # Only this action needs Jenkins demand and the CPU queries
+    from agent_autoscaler import get_agent_demand
+    from idle_shutdown import (
+        IDLE_CPU_THRESHOLD, IDLE_SHUTDOWN_MINUTES, clear_idle_since, idle_window_start,
+        load_idle_since, max_cpu_utilization, save_idle_since
+    )
+    
+    now = now or datetime.utcnow()
+    jenkins_url = os.environ.get("JENKINS_URL")
+    jenkins_user = os.environ.get("JENKINS_USER", "admin")
+    jenkins_password = os.environ.get("JENKINS_PASSWORD")
+    s3_bucket = os.environ.get("S3_BUCKET")
+    s3_client = get_client("s3") if s3_bucket else None
+    
+    def not_idle(reason, **fields):
+        if s3_client:
+            clear_idle_since(s3_client, s3_bucket, jenkins_instance_id)
+        return dict({"shutdown": False, "reason": reason}, **fields)
+    
+    if resume_drain:
+        return idle_shutdown(
+            ec2_client, autoscaling_client, cloudwatch_client, jenkins_instance_id, asg_name, window
+        )
+    
+    masters = describe_instances_by_id(ec2_client, [jenkins_instance_id])
+    if not masters:
+        return {"shutdown": False, "reason": "master_not_found"}
+    master = masters[0]
+    if master["state"] != "running":
+        return not_idle(f"master_{master['state']}")
+    
+    if not all([jenkins_url, jenkins_password]):
+        return {"shutdown": False, "reason": "missing_jenkins_settings"}
+    
+    try:
+        demand = get_agent_demand(jenkins_url, jenkins_user, jenkins_password)
+    except Exception as e:
+        # Still booting or unhealthy; neither counts as idle
+        print(f"Jenkins demand unavailable, not shutting down: {e}")
+        return {"shutdown": False, "reason": "jenkins_unreachable"}
+    
+    if demand["queued"] or demand["busy_executors"]:
+        return not_idle("builds_running", queued_builds=demand["queued"], busy_executors=demand["busy_executors"])
+    
+    asg = describe_asg(autoscaling_client, asg_name) if asg_name else None
+    instance_ids = [jenkins_instance_id] + (asg["instance_ids"] if asg else [])
+    cpu = max_cpu_utilization(
+        cloudwatch_client, instance_ids, now - timedelta(minutes=IDLE_SHUTDOWN_MINUTES), now
+    )
+    busy = {i: round(v, 1) for i, v in cpu.items() if v >= IDLE_CPU_THRESHOLD}
+    if busy:
+        return not_idle("cpu_active", cpu_utilization=busy)
+    
+    launch_time = datetime.fromisoformat(master["launch_time"]) if master["launch_time"] else None
+    if launch_time and launch_time.tzinfo:
+        launch_time = launch_time.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    idle_since = None
+    if s3_client:
+        idle_since = load_idle_since(s3_client, s3_bucket, jenkins_instance_id)
+        if idle_since is None:
+            idle_since = now
+            save_idle_since(s3_client, s3_bucket, jenkins_instance_id, idle_since)
+    
+    idle_minutes = (now - idle_window_start(now, launch_time, idle_since)).total_seconds() / 60.0
+    if idle_minutes < IDLE_SHUTDOWN_MINUTES:
+        return {"shutdown": False, "reason": "waiting_for_idle_period", "idle_minutes": round(idle_minutes, 1)}
+    
+    # Builds may have been queued since the first look
+    demand = get_agent_demand(jenkins_url, jenkins_user, jenkins_password)
+    if demand["queued"] or demand["busy_executors"]:
+        return not_idle("builds_running", queued_builds=demand["queued"], busy_executors=demand["busy_executors"])
+    
+    print(f"Jenkins idle for {idle_minutes:.0f} minutes, shutting down")
+    metrics.put("IdleShutdowns", 1)
+    if s3_client:
+        clear_idle_since(s3_client, s3_bucket, jenkins_instance_id)
+    
+    result = idle_shutdown(
+        ec2_client, autoscaling_client, cloudwatch_client, jenkins_instance_id, asg_name, window
+    )
+    result["idle_minutes"] = round(idle_minutes, 1)
+    return result
+
+def idle_shutdown(ec2_client, autoscaling_client, cloudwatch_client, jenkins_instance_id, asg_name, window):
+    """Shut down an idle master, surfacing agents still draining to the handler"""
+    
+    shutdown = shutdown_jenkins_infrastructure(
+        ec2_client, autoscaling_client, cloudwatch_client, jenkins_instance_id, asg_name, window=window
+    )
+    result = {"shutdown": True, "reason": "idle", "result": shutdown}
+    if shutdown.get("draining"):
+        result["draining"] = shutdown["draining"]
+        result["drain_deadline"] = shutdown["drain_deadline"]
+    return result
+
+def compact_build_trigger_logs(event):
+    """Compact raw build trigger logs into the partitioned analytics store"""
+    
+    from trigger_log_store import compact_trigger_logs
+    
+    s3_bucket = os.environ.get("S3_BUCKET")
+    if not s3_bucket:
+        return {"error": "No S3 bucket configured"}
+    
+    days = None
+    if event.get("dates"):
+        days = [datetime.strptime(d, "%Y-%m-%d").date() for d in event["dates"]]
+    
+    return compact_trigger_logs(
+        get_client("s3"), s3_bucket,
+        lookback_days=int(event.get("lookback_days", 7)),
+        days=days
+    )
+
 def generate_cost_report(ec2_client, autoscaling_client, cloudwatch_client,
                         jenkins_instance_id, asg_name):
     """Generate a cost optimization report"""
@@ -272,107 +817,164 @@ def generate_cost_report(ec2_client, autoscaling_client, cloudwatch_client,
             "cost_optimization": {}
         }
         
+        # Collect master, agents and metrics concurrently in one snapshot
+        snapshot = collect_fleet_snapshot(
+            ec2_client, autoscaling_client, cloudwatch_client,
+            jenkins_instance_id, asg_name
+        )
+        
         # Get Jenkins master info
-        response = ec2_client.describe_instances(InstanceIds=[jenkins_instance_id])
-        instance = response["Reservations"][0]["Instances"][0]
+        master = snapshot["master"]
+        if not master:
+            raise Exception(f"Jenkins master {jenkins_instance_id} not found")
         
         report["jenkins_master"] = {
             "instance_id": jenkins_instance_id,
-            "instance_type": instance.get("InstanceType", "unknown"),
-            "state": instance["State"]["Name"],
-            "launch_time": instance.get("LaunchTime", "").isoformat() if instance.get("LaunchTime") else None,
-            "estimated_hourly_cost": f"${get_estimated_hourly_cost(instance.get(\"InstanceType\", \"t3.medium\")):.4f}"
+            "instance_type": master["instance_type"],
+            "state": master["state"],
+            "launch_time": master["launch_time"],
+            "estimated_hourly_cost": f"${get_estimated_hourly_cost(master['instance_type']):.4f}"
         }
         
         # Get Jenkins agents info
-        if asg_name:
-            asg_response = autoscaling_client.describe_auto_scaling_groups(
-                AutoScalingGroupNames=[asg_name]
-            )
-            
-            if asg_response["AutoScalingGroups"]:
-                asg = asg_response["AutoScalingGroups"][0]
-                
-                # Get running instances
-                running_instances = []
-                if asg["Instances"]:
-                    instance_ids = [inst["InstanceId"] for inst in asg["Instances"]]
-                    instances_response = ec2_client.describe_instances(InstanceIds=instance_ids)
-                    
-                    for reservation in instances_response["Reservations"]:
-                        for inst in reservation["Instances"]:
-                            if inst["State"]["Name"] == "running":
-                                running_instances.append({
-                                    "instance_id": inst["InstanceId"],
-                                    "instance_type": inst.get("InstanceType", "unknown"),
-                                    "launch_time": inst.get("LaunchTime", "").isoformat() if inst.get("LaunchTime") else None,
-                                    "spot_instance": inst.get("InstanceLifecycle") == "spot"
-                                })
-                
-                report["jenkins_agents"] = {
-                    "asg_name": asg_name,
-                    "desired_capacity": asg["DesiredCapacity"],
-                    "running_instances": len(running_instances),
-                    "instances": running_instances,
-                    "spot_instances_enabled": True
+        if snapshot["asg"]:
+            running_instances = [
+                {
+                    "instance_id": inst["instance_id"],
+                    "instance_type": inst["instance_type"],
+                    "launch_time": inst["launch_time"],
+                    "spot_instance": inst["spot_instance"],
+                    "estimated_hourly_cost": round(
+                        get_estimated_hourly_cost(inst["instance_type"], spot=inst["spot_instance"]), 6
+                    )
                 }
+                for inst in snapshot["agent_instances"] if inst["state"] == "running"
+            ]
+            
+            report["jenkins_agents"] = {
+                "asg_name": asg_name,
+                "desired_capacity": snapshot["asg"]["desired_capacity"],
+                "running_instances": len(running_instances),
+                "instances": running_instances,
+                "spot_instances_enabled": True
+            }
         
         # Cost optimization metrics
         total_running_instances = 1 if report["jenkins_master"]["state"] == "running" else 0
         total_running_instances += len(report["jenkins_agents"].get("instances", []))
         
-        # Get CloudWatch metrics for the last 24 hours
-        try:
-            metrics_response = cloudwatch_client.get_metric_statistics(
-                Namespace="Jenkins/CostOptimization",
-                MetricName="MasterInstanceStopped",
-                StartTime=datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
-                EndTime=datetime.utcnow(),
-                Period=3600,
-                Statistics=["Sum"]
-            )
-            
-            shutdowns_today = sum([point["Sum"] for point in metrics_response["Datapoints"]])
-            
-        except Exception as e:
-            print(f"Error getting CloudWatch metrics: {e}")
-            shutdowns_today = 0
+        shutdowns_today = snapshot["metrics"]["shutdowns_today"]
+        
+        master_hourly_cost = get_estimated_hourly_cost(master["instance_type"])
+        fleet_hourly_cost = master_hourly_cost if master["state"] == "running" else 0.0
+        fleet_hourly_cost += sum(inst["estimated_hourly_cost"] for inst in report["jenkins_agents"].get("instances", []))
         
         report["cost_optimization"] = {
             "total_running_instances": total_running_instances,
             "shutdowns_today": shutdowns_today,
             "spot_instances_used": True,
             "auto_scaling_enabled": True,
-            "estimated_daily_savings": f"${get_estimated_hourly_cost(\"t3.medium\") * 16:.2f}",  # 16 hours off
+            "current_hourly_cost": f"${fleet_hourly_cost:.4f}",
+            "off_hours_per_day": get_off_hours_per_day(),
+            "estimated_daily_savings": f"${master_hourly_cost * get_off_hours_per_day():.2f}",
             "recommendations": generate_cost_recommendations(report)
         }
         
+        # Measured figures from the stored utilization history, when there is one
+        measured = load_measured_savings(jenkins_instance_id)
+        if measured:
+            report["cost_optimization"]["measured_last_30_days"] = measured
+        
         return report
         
     except Exception as e:
         print(f"Error generating cost report: {e}")
         raise
 
-def get_estimated_hourly_cost(instance_type):
-    """Get estimated hourly cost for an instance type (rough estimates)"""
-    
-    # Rough on-demand pricing estimates (actual prices vary by region)
-    pricing = {
-        "t3.micro": 0.0104,
-        "t3.small": 0.0208,
-        "t3.medium": 0.0416,
-        "t3.large": 0.0832,
-        "t3.xlarge": 0.1664,
-        "t3.2xlarge": 0.3328,
-        "m5.large": 0.096,
-        "m5.xlarge": 0.192,
-        "m5.2xlarge": 0.384,
-        "c5.large": 0.085,
-        "c5.xlarge": 0.17,
-        "c5.2xlarge": 0.34
+def generate_utilization_report(ec2_client, autoscaling_client, cloudwatch_client,
+                                jenkins_instance_id, asg_name, event=None):
+    """Daily and monthly uptime, agent hours, builds and measured savings
+    
+    Complete days since the last run are aggregated and stored first; the
+    report itself is then read from the stored rows. The event may carry
+    "start" and "end" dates, or "months" to report on (default 3).
+    """
+    
+    # Only this action needs the utilization store
+    from utilization_report import get_utilization_store, summarize_utilization, update_utilization
+    
+    event = event or {}
+    now = datetime.utcnow()
+    
+    masters = describe_instances_by_id(ec2_client, [jenkins_instance_id])
+    if not masters:
+        raise Exception(f"Jenkins master {jenkins_instance_id} not found")
+    asg = describe_asg(autoscaling_client, asg_name) if asg_name else None
+    
+    agent_type = os.environ.get("AGENT_INSTANCE_TYPE", "t3.large")
+    prices = {
+        "master_on_demand": get_estimated_hourly_cost(masters[0]["instance_type"]),
+        "agent_spot": get_estimated_hourly_cost(agent_type, spot=True),
+        "agent_on_demand": get_estimated_hourly_cost(agent_type),
+        "agent_on_demand_share": (asg["on_demand_percentage"] if asg else 0) / 100.0
     }
     
-    return pricing.get(instance_type, 0.05)  # Default fallback
+    s3_bucket = os.environ.get("S3_BUCKET")
+    store = get_utilization_store(get_client("s3") if s3_bucket else None, s3_bucket)
+    document = update_utilization(
+        cloudwatch_client, store, jenkins_instance_id, jenkins_instance_id, asg_name, prices, now=now
+    )
+    
+    if event.get("start"):
+        start_day = datetime.fromisoformat(event["start"]).date()
+    else:
+        first_of_month = now.date().replace(day=1)
+        start_day = first_of_month
+        for _ in range(int(event.get("months", 3)) - 1):
+            start_day = (start_day - timedelta(days=1)).replace(day=1)
+    end_day = datetime.fromisoformat(event["end"]).date() if event.get("end") else None
+    
+    report = summarize_utilization(document, start_day, end_day)
+    report["prices"] = prices
+    return report
+
+def load_measured_savings(jenkins_instance_id, days=30):
+    """Totals of the last days of stored utilization rows, without refreshing them"""
+    
+    from utilization_report import get_utilization_store, summarize_utilization
+    
+    s3_bucket = os.environ.get("S3_BUCKET")
+    try:
+        store = get_utilization_store(get_client("s3") if s3_bucket else None, s3_bucket)
+        document = store.load(jenkins_instance_id)
+    except Exception as e:
+        print(f"Error loading utilization history: {e}")
+        return None
+    if not document or not document["days"]:
+        return None
+    
+    start_day = datetime.utcnow().date() - timedelta(days=days)
+    return summarize_utilization(document, start_day)["totals"]
+
+def get_estimated_hourly_cost(instance_type, spot=False):
+    """Get estimated hourly cost for an instance type in the current region
+    
+    Prices come from the cached pricing tables (Pricing API / spot price
+    history, falling back to the bundled snapshot).
+    """
+    
+    price, _ = get_hourly_price(instance_type, SPOT if spot else ON_DEMAND)
+    return price
+
+def get_off_hours_per_day():
+    """Hours per day the master is shut down, from the shutdown/startup crons"""
+    
+    try:
+        shutdown_hour = int(os.environ["SHUTDOWN_SCHEDULE"].split()[1])
+        startup_hour = int(os.environ["STARTUP_SCHEDULE"].split()[1])
+        return (startup_hour - shutdown_hour) % 24
+    except (KeyError, IndexError, ValueError):
+        return 16
 
 def generate_cost_recommendations(report):
     """Generate cost optimization recommendations based on the report"""
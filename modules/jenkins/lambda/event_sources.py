@@ -0,0 +1,137 @@
+import base64
+import json
+from datetime import datetime
+
+# Batches delivered by Lambda event source mappings. Each record carries one
+# build request in any shape the trigger Lambda accepts when invoked directly
+# (a trigger queue message, a manual or fan-out request, an S3, EventBridge
+# or GitHub push event):
+#   SQS          - Records[].body, JSON text
+#   Kinesis      - Records[].kinesis.data, base64 JSON
+#   MSK / Kafka  - records["<topic>-<partition>"][].value, base64 JSON
+# Every adapter yields stream records
+#   {"id": ..., "payload": {...}, "received_at": "...", "event_id": ...}
+# where id is the identifier reported back when the record has to be retried.
+SQS = "sqs"
+KINESIS = "kinesis"
+KAFKA = "kafka"
+
+KAFKA_EVENT_SOURCES = ("aws:kafka", "SelfManagedKafka")
+
+class BatchRetryError(Exception):
+    """Records of a batch failed and the source cannot retry them one by one"""
+
+def batch_event_source(event):
+    """Return the source of an event source mapping batch, None for other events"""
+
+    if event.get("eventSource") in KAFKA_EVENT_SOURCES and isinstance(event.get("records"), dict):
+        return KAFKA
+
+    records = event.get("Records") or []
+    if not records:
+        return None
+    source = records[0].get("eventSource")
+    if source == "aws:sqs":
+        return SQS
+    if source == "aws:kinesis":
+        return KINESIS
+    return None
+
+def supports_partial_batch(source):
+    """Whether the source redelivers only the records named in batchItemFailures
+
+    Kafka mappings retry the whole batch when the function fails; records
+    that were built are then dropped as duplicates by their idempotency claim.
+    """
+
+    return source in (SQS, KINESIS)
+
+def decode_json(data, encoded=False):
+    """Decode a record value into a JSON object, base64 first when encoded"""
+
+    if encoded:
+        data = base64.b64decode(data)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    payload = json.loads(data)
+    if not isinstance(payload, dict):
+        raise ValueError(f"expected a JSON object, got {type(payload).__name__}")
+    return payload
+
+def timestamp_iso(epoch_seconds):
+    """ISO timestamp for an epoch time, None when the source left it out"""
+
+    return datetime.utcfromtimestamp(epoch_seconds).isoformat() if epoch_seconds else None
+
+def sqs_stream_records(event):
+    """Stream records of an SQS batch"""
+
+    for record in event["Records"]:
+        sent_ms = int(record.get("attributes", {}).get("SentTimestamp", "0"))
+        yield {
+            "id": record.get("messageId"),
+            "body": record.get("body"),
+            "encoded": False,
+            "received_at": timestamp_iso(sent_ms / 1000.0),
+            # Raw events sent straight to the queue carry their own ID
+            "event_id": None
+        }
+
+def kinesis_stream_records(event):
+    """Stream records of a Kinesis batch, identified by sequence number"""
+
+    for record in event["Records"]:
+        kinesis = record.get("kinesis", {})
+        yield {
+            "id": kinesis.get("sequenceNumber"),
+            "body": kinesis.get("data"),
+            "encoded": True,
+            "received_at": timestamp_iso(kinesis.get("approximateArrivalTimestamp")),
+            "event_id": record.get("eventID")
+        }
+
+def kafka_stream_records(event):
+    """Stream records of an MSK or self-managed Kafka batch, partition by partition"""
+
+    for partition_records in event["records"].values():
+        for record in partition_records:
+            record_id = f"{record.get('topic')}-{record.get('partition')}@{record.get('offset')}"
+            yield {
+                "id": record_id,
+                "body": record.get("value"),
+                "encoded": True,
+                "received_at": timestamp_iso((record.get("timestamp") or 0) / 1000.0),
+                "event_id": record_id
+            }
+
+STREAM_RECORD_READERS = {
+    SQS: sqs_stream_records,
+    KINESIS: kinesis_stream_records,
+    KAFKA: kafka_stream_records
+}
+
+def stream_records(source, event):
+    """Decode every record of a batch
+
+    Returns (records, malformed). Malformed records are never retried: a
+    redelivery would fail the same way.
+    """
+
+    records, malformed = [], []
+    for record in STREAM_RECORD_READERS[source](event):
+        # Kafka tombstones carry no value
+        if record["body"] is None:
+            continue
+        try:
+            record["payload"] = decode_json(record.pop("body"), record.pop("encoded"))
+        except (TypeError, ValueError) as e:
+            print(f"Skipping malformed {source} record {record['id']}: {e}")
+            malformed.append(record["id"])
+            continue
+        records.append(record)
+    return records, malformed
+
+def batch_response(record_ids):
+    """Partial batch response naming the records to redeliver"""
+
+    return {"batchItemFailures": [{"itemIdentifier": record_id} for record_id in record_ids]}
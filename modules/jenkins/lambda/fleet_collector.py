@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# DescribeInstances with explicit IDs is sharded so large fleets stay inside
+# API request limits; shards, the ASG lookup and CloudWatch run concurrently.
+# boto3 clients are thread-safe, so one client per service is shared.
+INSTANCE_ID_CHUNK_SIZE = int(os.environ.get("INSTANCE_ID_CHUNK_SIZE", "100"))
+COLLECTOR_MAX_WORKERS = int(os.environ.get("COLLECTOR_MAX_WORKERS", "8"))
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def summarize_instance(instance):
+    """Keep only the instance fields the report needs, to bound memory use"""
+
+    launch_time = instance.get("LaunchTime")
+    return {
+        "instance_id": instance["InstanceId"],
+        "instance_type": instance.get("InstanceType", "unknown"),
+        "state": instance["State"]["Name"],
+        "launch_time": launch_time.isoformat() if hasattr(launch_time, "isoformat") else launch_time,
+        "spot_instance": instance.get("InstanceLifecycle") == "spot",
+        "availability_zone": instance.get("Placement", {}).get("AvailabilityZone")
+    }
+
+def describe_instances_by_id(ec2_client, instance_ids):
+    """Describe one shard of instance IDs, following pagination"""
+
+    instances = []
+    paginator = ec2_client.get_paginator("describe_instances")
+    for page in paginator.paginate(InstanceIds=instance_ids):
+        for reservation in page["Reservations"]:
+            instances.extend(summarize_instance(inst) for inst in reservation["Instances"])
+    return instances
+
+def describe_asg(autoscaling_client, asg_name):
+    """Describe the agent ASG, following pagination"""
+
+    paginator = autoscaling_client.get_paginator("describe_auto_scaling_groups")
+    for page in paginator.paginate(AutoScalingGroupNames=[asg_name]):
+        for asg in page["AutoScalingGroups"]:
+            return {
+                "asg_name": asg["AutoScalingGroupName"],
+                "desired_capacity": asg["DesiredCapacity"],
+                "min_size": asg.get("MinSize"),
+                "max_size": asg.get("MaxSize"),
+                "on_demand_percentage": asg.get("MixedInstancesPolicy", {}).get(
+                    "InstancesDistribution", {}
+                ).get("OnDemandPercentageAboveBaseCapacity", 100 if "MixedInstancesPolicy" not in asg else 0),
+                "instance_ids": [inst["InstanceId"] for inst in asg["Instances"]]
+            }
+    return None
+
+def count_shutdowns_today(cloudwatch_client, now):
+    """Sum of MasterInstanceStopped datapoints since midnight UTC"""
+
+    response = cloudwatch_client.get_metric_statistics(
+        Namespace="Jenkins/CostOptimization",
+        MetricName="MasterInstanceStopped",
+        StartTime=now.replace(hour=0, minute=0, second=0, microsecond=0),
+        EndTime=now,
+        Period=3600,
+        Statistics=["Sum"]
+    )
+    return sum(point["Sum"] for point in response["Datapoints"])
+
+def collect_fleet_snapshot(ec2_client, autoscaling_client, cloudwatch_client,
+                           jenkins_instance_id, asg_name, now=None):
+    """Collect master, agent and metric state concurrently into one snapshot
+
+    Returns a dict with master (summarized instance or None), asg (group
+    summary or None), agent_instances (summarized instances), metrics and
+    errors. A failing CloudWatch call is recorded in errors instead of failing
+    the whole snapshot; EC2 and Auto Scaling failures are raised.
+    """
+
+    now = now or datetime.utcnow()
+    snapshot = {
+        "collected_at": now.isoformat(),
+        "master": None,
+        "asg": None,
+        "agent_instances": [],
+        "metrics": {"shutdowns_today": 0},
+        "errors": []
+    }
+
+    with ThreadPoolExecutor(max_workers=COLLECTOR_MAX_WORKERS) as pool:
+        master_future = pool.submit(describe_instances_by_id, ec2_client, [jenkins_instance_id])
+        asg_future = pool.submit(describe_asg, autoscaling_client, asg_name) if asg_name else None
+        shutdowns_future = pool.submit(count_shutdowns_today, cloudwatch_client, now)
+
+        # Agent shards can only start once the ASG membership is known
+        agent_futures = []
+        if asg_future:
+            snapshot["asg"] = asg_future.result()
+            if snapshot["asg"]:
+                agent_futures = [
+                    pool.submit(describe_instances_by_id, ec2_client, shard)
+                    for shard in chunked(snapshot["asg"]["instance_ids"], INSTANCE_ID_CHUNK_SIZE)
+                ]
+
+        masters = master_future.result()
+        snapshot["master"] = masters[0] if masters else None
+
+        for future in agent_futures:
+            snapshot["agent_instances"].extend(future.result())
+
+        try:
+            snapshot["metrics"]["shutdowns_today"] = shutdowns_future.result()
+        except Exception as e:
+            print(f"Error getting CloudWatch metrics: {e}")
+            snapshot["errors"].append(f"cloudwatch: {e}")
+
+    return snapshot
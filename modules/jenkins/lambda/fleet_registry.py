@@ -0,0 +1,163 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_clients import get_client
+
+# Per-fleet work (ASG scaling, reports) runs on a bounded thread pool so one
+# invocation can cover many environments without hammering the APIs
+FLEET_MAX_CONCURRENCY = int(os.environ.get("FLEET_MAX_CONCURRENCY", "8"))
+
+# A fleet is one Jenkins master plus its agent ASG:
+#   {"name": "dev", "jenkins_instance_id": "i-...", "asg_name": "...-agents-asg"}
+# Sources, first match wins:
+#   1. "fleets" in the invocation event
+#   2. FLEET_REGISTRY: inline JSON list
+#   3. FLEET_REGISTRY_S3_URI: s3://bucket/key holding the same JSON list
+#   4. FLEET_DISCOVERY=tags: every instance tagged Type=jenkins-master, paired
+#      with the "<name>-agents-asg" group named after its Name tag
+#   5. JENKINS_INSTANCE_ID / ASG_NAME: the single fleet this function was
+#      deployed with
+# Sources 2-4 add to the deployment's own fleet rather than replace it.
+
+def load_fleet_registry(event, ec2_client, autoscaling_client):
+    """Return the list of fleets this invocation should act on"""
+
+    if event.get("fleets"):
+        return normalize_fleets(event["fleets"])
+
+    if os.environ.get("FLEET_REGISTRY"):
+        return with_local_fleet(normalize_fleets(json.loads(os.environ["FLEET_REGISTRY"])))
+
+    if os.environ.get("FLEET_REGISTRY_S3_URI"):
+        bucket, _, key = os.environ["FLEET_REGISTRY_S3_URI"][len("s3://"):].partition("/")
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+        return with_local_fleet(normalize_fleets(json.loads(body.decode("utf-8"))))
+
+    if os.environ.get("FLEET_DISCOVERY") == "tags":
+        return with_local_fleet(discover_fleets_by_tags(ec2_client, autoscaling_client))
+
+    return with_local_fleet([])
+
+def env_fleet():
+    """The fleet this function was deployed with, None without JENKINS_INSTANCE_ID"""
+
+    if not os.environ.get("JENKINS_INSTANCE_ID"):
+        return None
+    return {
+        "name": os.environ.get("ENVIRONMENT", "default"),
+        "jenkins_instance_id": os.environ["JENKINS_INSTANCE_ID"],
+        "asg_name": os.environ.get("ASG_NAME")
+    }
+
+def with_local_fleet(fleets):
+    """Add the deployment's own fleet to fleets unless its master is listed already"""
+
+    local = env_fleet()
+    if local is None or any(f["jenkins_instance_id"] == local["jenkins_instance_id"] for f in fleets):
+        return fleets
+
+    if any(f["name"] == local["name"] for f in fleets):
+        local["name"] = f"{local['name']}-{local['jenkins_instance_id']}"
+    return fleets + [local]
+
+def local_fleet(fleets):
+    """The fleet whose master is this deployment's Jenkins
+
+    Actions that read the local Jenkins (autoscaling, drains) must only touch
+    this fleet. Without JENKINS_INSTANCE_ID a lone fleet is taken as local.
+    """
+
+    local = env_fleet()
+    if local is None:
+        return fleets[0] if len(fleets) == 1 else None
+
+    for fleet in fleets:
+        if fleet["jenkins_instance_id"] == local["jenkins_instance_id"]:
+            return dict(fleet, asg_name=fleet["asg_name"] or local["asg_name"])
+    return local
+
+def normalize_fleets(fleets):
+    """Validate registry entries and fill in defaults
+
+    Results are keyed by fleet name, so names must be unique.
+    """
+
+    normalized = []
+    names = set()
+    for index, fleet in enumerate(fleets):
+        if not fleet.get("jenkins_instance_id"):
+            raise ValueError(f"Fleet entry {index} has no jenkins_instance_id")
+        name = fleet.get("name") or fleet["jenkins_instance_id"]
+        if name in names:
+            raise ValueError(f"Fleet entry {index} reuses the fleet name {name}")
+        names.add(name)
+        normalized.append({
+            "name": name,
+            "jenkins_instance_id": fleet["jenkins_instance_id"],
+            "asg_name": fleet.get("asg_name")
+        })
+    return normalized
+
+def discover_fleets_by_tags(ec2_client, autoscaling_client):
+    """Find every Jenkins master by tag and pair it with its agent ASG"""
+
+    asg_names = set()
+    paginator = autoscaling_client.get_paginator("describe_auto_scaling_groups")
+    for page in paginator.paginate(Filters=[{"Name": "tag:Component", "Values": ["Jenkins"]}]):
+        asg_names.update(asg["AutoScalingGroupName"] for asg in page["AutoScalingGroups"])
+
+    fleets = []
+    paginator = ec2_client.get_paginator("describe_instances")
+    for page in paginator.paginate(
+        Filters=[
+            {"Name": "tag:Type", "Values": ["jenkins-master"]},
+            {"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]}
+        ]
+    ):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+                name = tags.get("Name", instance["InstanceId"])
+                jenkins_name = name[:-len("-master")] if name.endswith("-master") else name
+                asg_name = f"{jenkins_name}-agents-asg"
+
+                fleets.append({
+                    "name": tags.get("Environment") or jenkins_name,
+                    "jenkins_instance_id": instance["InstanceId"],
+                    "asg_name": asg_name if asg_name in asg_names else None
+                })
+
+    # Several masters may share an Environment tag; tell them apart by ID
+    counts = {}
+    for fleet in fleets:
+        counts[fleet["name"]] = counts.get(fleet["name"], 0) + 1
+    for fleet in fleets:
+        if counts[fleet["name"]] > 1:
+            fleet["name"] = f"{fleet['name']}-{fleet['jenkins_instance_id']}"
+
+    return fleets
+
+def run_per_fleet(fleets, action):
+    """Run action(fleet) for every fleet concurrently, keyed by fleet name
+
+    A failing fleet is reported as {"error": ...} instead of failing the rest.
+    """
+
+    results = {}
+    if not fleets:
+        return results
+
+    names = [fleet["name"] for fleet in fleets]
+    if len(set(names)) != len(names):
+        raise ValueError("Fleet names must be unique, results are keyed by name")
+
+    with ThreadPoolExecutor(max_workers=min(FLEET_MAX_CONCURRENCY, len(fleets))) as pool:
+        futures = [(fleet["name"], pool.submit(action, fleet)) for fleet in fleets]
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f"Error in fleet {name}: {e}")
+                results[name] = {"error": str(e)}
+    return results
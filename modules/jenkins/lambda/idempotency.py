@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from aws_clients import get_client
+
+# S3, EventBridge and Lambda retries all deliver at least once. Every trigger
+# is fingerprinted and claimed before any EC2 or Jenkins work; a second claim
+# of the same fingerprint is a duplicate and is dropped.
+#
+# A claim starts "in_progress" with a short lease so a crashed invocation does
+# not block its own retry for long. Once the build is queued in Jenkins (or
+# parked as a pending trigger) it becomes "completed" until the TTL expires.
+# A failed trigger releases its claim so the retry can go ahead.
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE")
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "dynamodb" if IDEMPOTENCY_TABLE else "memory")
+IDEMPOTENCY_SQLITE_PATH = os.environ.get("IDEMPOTENCY_SQLITE_PATH", "/tmp/jenkins-trigger-idempotency.db")
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "120"))
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+def trigger_fingerprint(trigger_source, build_params, event_id=None):
+    """Stable identity of a trigger, or None when it cannot be identified
+
+    The same commit built by the same job with the same parameters is one
+    build whichever source delivered it. Otherwise the S3 object version
+    (bucket/key/etag) or the delivering event's ID is used.
+    """
+
+    job = build_params.get("job_name", "github-pipeline")
+    parameters = json.dumps(build_params.get("build_parameters") or {}, sort_keys=True)
+
+    if build_params.get("commit_sha"):
+        parts = ["commit", job, build_params.get("repository", ""), build_params.get("branch", ""),
+                 build_params["commit_sha"], parameters]
+    elif build_params.get("source_key") and build_params.get("source_etag"):
+        parts = ["s3", build_params.get("source_bucket", ""), build_params["source_key"],
+                 build_params["source_etag"], str(build_params.get("manifest_index", 0)), job]
+    elif event_id:
+        parts = ["event", trigger_source, event_id, job, parameters]
+    else:
+        return None
+
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class InMemoryIdempotencyStore:
+    """Per-container store for local runs and tests"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def claim(self, fingerprint, lease_seconds=None):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry and entry["expires_at"] > now:
+                return False
+            self.entries[fingerprint] = {
+                "status": IN_PROGRESS,
+                "expires_at": now + (lease_seconds or IDEMPOTENCY_LEASE_SECONDS)
+            }
+            return True
+
+    def complete(self, fingerprint, ttl_seconds=None):
+        with self.lock:
+            self.entries[fingerprint] = {
+                "status": COMPLETED,
+                "expires_at": time.time() + (ttl_seconds or IDEMPOTENCY_TTL_SECONDS)
+            }
+
+    def release(self, fingerprint):
+        with self.lock:
+            self.entries.pop(fingerprint, None)
+
+class SQLiteIdempotencyStore:
+    """File-backed store for local runs that need to survive restarts"""
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency "
+                "(fingerprint TEXT PRIMARY KEY, status TEXT, expires_at REAL)"
+            )
+
+    def claim(self, fingerprint, lease_seconds=None):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO idempotency VALUES (?, ?, ?)",
+                (fingerprint, IN_PROGRESS, now + (lease_seconds or IDEMPOTENCY_LEASE_SECONDS))
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, fingerprint, ttl_seconds=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?)",
+                (fingerprint, COMPLETED, time.time() + (ttl_seconds or IDEMPOTENCY_TTL_SECONDS))
+            )
+
+    def release(self, fingerprint):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM idempotency WHERE fingerprint = ?", (fingerprint,))
+
+class DynamoDBIdempotencyStore:
+    """Shared store backed by a DynamoDB table with TTL on expires_at"""
+
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def claim(self, fingerprint, lease_seconds=None):
+        now = int(time.time())
+        try:
+            # DynamoDB TTL deletes lazily, so expired items are treated as absent
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "fingerprint": {"S": fingerprint},
+                    "status": {"S": IN_PROGRESS},
+                    "expires_at": {"N": str(now + (lease_seconds or IDEMPOTENCY_LEASE_SECONDS))}
+                },
+                ConditionExpression="attribute_not_exists(fingerprint) OR expires_at <= :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}}
+            )
+            return True
+        except Exception as e:
+            if "ConditionalCheckFailed" in type(e).__name__ or "ConditionalCheckFailed" in str(e):
+                return False
+            raise
+
+    def complete(self, fingerprint, ttl_seconds=None):
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                "fingerprint": {"S": fingerprint},
+                "status": {"S": COMPLETED},
+                "expires_at": {"N": str(int(time.time()) + (ttl_seconds or IDEMPOTENCY_TTL_SECONDS))}
+            }
+        )
+
+    def release(self, fingerprint):
+        self.dynamodb_client.delete_item(
+            TableName=self.table_name,
+            Key={"fingerprint": {"S": fingerprint}}
+        )
+
+_store = None
+
+def get_idempotency_store():
+    """Return the configured store, or None when deduplication is off"""
+
+    global _store
+    if _store is None and IDEMPOTENCY_BACKEND != "off":
+        if IDEMPOTENCY_BACKEND == "dynamodb":
+            _store = DynamoDBIdempotencyStore(get_client("dynamodb"), IDEMPOTENCY_TABLE)
+        elif IDEMPOTENCY_BACKEND == "sqlite":
+            _store = SQLiteIdempotencyStore(IDEMPOTENCY_SQLITE_PATH)
+        else:
+            _store = InMemoryIdempotencyStore()
+    return _store
@@ -0,0 +1,97 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from fleet_collector import chunked
+
+# The master counts as idle while Jenkins has nothing queued or running and
+# neither the master nor any agent used more than IDLE_CPU_THRESHOLD percent
+# CPU. After IDLE_SHUTDOWN_MINUTES of that it is stopped. The time idleness
+# was first seen is kept in S3 so it survives between scheduled checks.
+IDLE_SHUTDOWN_MINUTES = int(os.environ.get("IDLE_SHUTDOWN_MINUTES", "60"))
+IDLE_CPU_THRESHOLD = float(os.environ.get("IDLE_CPU_THRESHOLD", "10"))
+IDLE_STATE_PREFIX = "optimizer/idle-state/"
+
+# GetMetricData accepts up to 500 queries per call
+METRIC_QUERIES_PER_CALL = 500
+CPU_PERIOD_SECONDS = 300
+
+def max_cpu_utilization(cloudwatch_client, instance_ids, start, end):
+    """Highest 5-minute average CPUUtilization of each instance between start and end
+
+    All instances are fetched with batched GetMetricData calls. Instances
+    without datapoints (stopped, or just launched) are left out.
+    """
+
+    result = {}
+    for shard in chunked(list(instance_ids), METRIC_QUERIES_PER_CALL):
+        queries = [
+            {
+                "Id": f"cpu{index}",
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": "AWS/EC2",
+                        "MetricName": "CPUUtilization",
+                        "Dimensions": [{"Name": "InstanceId", "Value": instance_id}]
+                    },
+                    "Period": CPU_PERIOD_SECONDS,
+                    "Stat": "Average"
+                },
+                "ReturnData": True
+            }
+            for index, instance_id in enumerate(shard)
+        ]
+
+        paginator = cloudwatch_client.get_paginator("get_metric_data")
+        for page in paginator.paginate(MetricDataQueries=queries, StartTime=start, EndTime=end):
+            for series in page["MetricDataResults"]:
+                if not series["Values"]:
+                    continue
+                instance_id = shard[int(series["Id"][3:])]
+                result[instance_id] = max(result.get(instance_id, 0.0), max(series["Values"]))
+    return result
+
+def idle_state_key(jenkins_instance_id):
+    """S3 key holding when a master was first seen idle"""
+
+    return f"{IDLE_STATE_PREFIX}{jenkins_instance_id}.json"
+
+def load_idle_since(s3_client, bucket, jenkins_instance_id):
+    """When the master was first seen idle, or None"""
+
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=idle_state_key(jenkins_instance_id))["Body"].read()
+        return datetime.fromisoformat(json.loads(body.decode("utf-8"))["idle_since"])
+    except Exception:
+        return None
+
+def save_idle_since(s3_client, bucket, jenkins_instance_id, idle_since):
+    """Record when the master was first seen idle"""
+
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=idle_state_key(jenkins_instance_id),
+        Body=json.dumps({"idle_since": idle_since.isoformat()}),
+        ContentType="application/json"
+    )
+
+def clear_idle_since(s3_client, bucket, jenkins_instance_id):
+    """Forget the idle start, e.g. after activity or a shutdown"""
+
+    try:
+        s3_client.delete_object(Bucket=bucket, Key=idle_state_key(jenkins_instance_id))
+    except Exception as e:
+        print(f"Error clearing idle state: {e}")
+
+def idle_window_start(now, launch_time, idle_since=None, idle_minutes=None):
+    """Start of the period the master has been idle for
+
+    Without a recorded start (no bucket) the whole check window is assumed,
+    since CPU stayed low throughout it. Never earlier than the last launch.
+    """
+
+    idle_minutes = IDLE_SHUTDOWN_MINUTES if idle_minutes is None else idle_minutes
+    start = idle_since or now - timedelta(minutes=idle_minutes)
+    if launch_time and launch_time > start:
+        start = launch_time
+    return start
@@ -0,0 +1,342 @@
+import base64
+import json
+import os
+import random
+import re
+import time
+import urllib3
+from urllib.parse import urlsplit
+
+from tracing import count, span
+
+# Disable SSL warnings for internal Jenkins
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# State below lives at module level so it survives across warm invocations
+# of the same Lambda container: one keep-alive pool, one auth header per user
+# and one CSRF crumb per Jenkins URL.
+CRUMB_TTL_SECONDS = int(os.environ.get("JENKINS_CRUMB_TTL_SECONDS", "900"))
+RECENTLY_OK_SECONDS = int(os.environ.get("JENKINS_RECENTLY_OK_SECONDS", "30"))
+
+CRUMB_PATH = "/crumbIssuer/api/xml?xpath=concat(//crumbRequestField,\":\",//crumb)"
+
+# Tiny tree-filtered payload instead of the full root JSON; Jenkins answers 503
+# here until it has finished loading
+READINESS_PATH = "/api/json?tree=mode,quietingDown"
+
+# Follow-through polls ask only for the fields they need
+QUEUE_ITEM_TREE = "id,cancelled,why,executable[number,url]"
+BUILD_STATUS_TREE = "number,url,building,result,duration,estimatedDuration"
+
+READY = "ready"
+TIMEOUT = "timeout"
+AUTH_FAILED = "auth_failed"
+
+# Queue item and build states reported by the follow-through helpers
+QUEUED = "queued"
+STARTED = "started"
+CANCELLED = "cancelled"
+RUNNING = "running"
+COMPLETED = "completed"
+NOT_FOUND = "not_found"
+
+_http = None
+_auth_headers = {}
+_crumbs = {}
+_last_ok = {}
+
+def get_http():
+    """Return the shared connection pool, creating it on first use"""
+
+    global _http
+    if _http is None:
+        _http = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=10,
+            retries=False,
+            timeout=urllib3.Timeout(connect=3.0, read=10.0)
+        )
+    return _http
+
+def get_auth_headers(username, password):
+    """Return cached basic auth headers for the given credentials"""
+
+    key = (username, password)
+    if key not in _auth_headers:
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        _auth_headers[key] = {"Authorization": f"Basic {token}"}
+    return dict(_auth_headers[key])
+
+def get_crumb_headers(jenkins_url, username, password, force_refresh=False):
+    """Return auth headers plus a cached CSRF crumb
+
+    Jenkins binds crumbs to the web session, so the session cookie issued with
+    the crumb is cached and replayed alongside it.
+    """
+
+    cached = _crumbs.get(jenkins_url)
+    if cached and not force_refresh and cached["expires_at"] > time.time():
+        return dict(cached["headers"])
+
+    headers = get_auth_headers(username, password)
+    with span("crumb_fetch"):
+        count("jenkins.requests")
+        response = get_http().request("GET", f"{jenkins_url}{CRUMB_PATH}", headers=headers)
+    mark_response(jenkins_url, response.status)
+
+    if response.status == 200:
+        crumb_field, crumb_value = response.data.decode().split(":", 1)
+        headers[crumb_field] = crumb_value
+
+        session_cookies = re.findall(r"(JSESSIONID[^=]*=[^;,\s]+)", response.headers.get("Set-Cookie", ""))
+        if session_cookies:
+            headers["Cookie"] = "; ".join(session_cookies)
+    else:
+        # CSRF protection disabled or crumb issuer unavailable; POST without crumb
+        print(f"Crumb issuer returned {response.status}, continuing without crumb")
+
+    _crumbs[jenkins_url] = {"headers": headers, "expires_at": time.time() + CRUMB_TTL_SECONDS}
+    return dict(headers)
+
+def invalidate_crumb(jenkins_url):
+    """Drop the cached crumb so the next request fetches a fresh one"""
+
+    _crumbs.pop(jenkins_url, None)
+
+def mark_response(jenkins_url, status):
+    """Remember when Jenkins last answered a request successfully"""
+
+    if status < 400:
+        _last_ok[jenkins_url] = time.time()
+
+def recently_ok(jenkins_url, max_age=None):
+    """Whether Jenkins answered within the last max_age seconds"""
+
+    if max_age is None:
+        max_age = RECENTLY_OK_SECONDS
+    return time.time() - _last_ok.get(jenkins_url, 0) <= max_age
+
+def jenkins_request(method, jenkins_url, path, username, password,
+                    body=None, headers=None, timeout=None, with_crumb=False):
+    """Send a request to Jenkins over the shared pool
+
+    Requests made with_crumb carry the cached CSRF crumb; a 403 invalidates it
+    and the request is retried once with a fresh crumb.
+    """
+
+    http = get_http()
+
+    for attempt in range(2 if with_crumb else 1):
+        if with_crumb:
+            request_headers = get_crumb_headers(jenkins_url, username, password, force_refresh=attempt > 0)
+        else:
+            request_headers = get_auth_headers(username, password)
+        if headers:
+            request_headers.update(headers)
+
+        kwargs = {"headers": request_headers, "body": body}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        count("jenkins.requests")
+        response = http.request(method, f"{jenkins_url}{path}", **kwargs)
+        mark_response(jenkins_url, response.status)
+
+        if response.status == 403 and with_crumb and attempt == 0:
+            print("Jenkins rejected the cached crumb, refreshing")
+            count("retries.jenkins.crumb")
+            invalidate_crumb(jenkins_url)
+            continue
+
+        return response
+
+    return response
+
+def get_json(jenkins_url, path, username, password, timeout=None):
+    """GET a Jenkins JSON API path and decode the response"""
+
+    response = jenkins_request("GET", jenkins_url, path, username, password, timeout=timeout)
+    if response.status != 200:
+        raise Exception(f"Jenkins API {path} returned {response.status}")
+    return json.loads(response.data.decode("utf-8"))
+
+def probe_jenkins_readiness(jenkins_url, username, password, deadline=None,
+                            initial_delay=0.25, max_delay=8.0):
+    """Poll Jenkins until it is ready, the deadline passes or credentials are rejected
+
+    deadline is an absolute time.time() value; without one a single probe is
+    made. Waits between probes grow exponentially from initial_delay with
+    jitter, and per-request timeouts are clipped to the time left. Returns a
+    dict with status (READY, TIMEOUT or AUTH_FAILED), attempts,
+    waited_seconds and last_error.
+    """
+
+    started = time.time()
+    delay = initial_delay
+    attempts = 0
+    last_error = None
+
+    while True:
+        attempts += 1
+        remaining = None if deadline is None else max(0.1, deadline - time.time())
+        timeout = urllib3.Timeout(
+            connect=min(2.0, remaining or 2.0),
+            read=min(5.0, remaining or 5.0)
+        )
+
+        try:
+            response = jenkins_request("GET", jenkins_url, READINESS_PATH, username, password, timeout=timeout)
+            if response.status == 200:
+                return readiness_result(READY, attempts, started, None)
+            if response.status in (401, 403):
+                return readiness_result(AUTH_FAILED, attempts, started, f"HTTP {response.status}")
+            last_error = f"HTTP {response.status}"
+        except Exception as e:
+            last_error = str(e)
+
+        if deadline is None:
+            break
+
+        # Equal jitter: half the backoff is fixed, half random
+        backoff = min(max_delay, delay)
+        sleep_for = backoff / 2 + random.uniform(0, backoff / 2)
+        if time.time() + sleep_for >= deadline:
+            break
+
+        time.sleep(sleep_for)
+        delay *= 2
+
+    return readiness_result(TIMEOUT, attempts, started, last_error)
+
+def readiness_result(status, attempts, started, last_error):
+    """Build the structured readiness probe result"""
+
+    if attempts > 1:
+        count("retries.jenkins.readiness", attempts - 1)
+    return {
+        "status": status,
+        "attempts": attempts,
+        "waited_seconds": round(time.time() - started, 3),
+        "last_error": last_error
+    }
+
+def api_path(jenkins_url, url):
+    """Path of an absolute Jenkins URL relative to jenkins_url
+
+    Location headers and executable URLs use Jenkins' configured root URL,
+    which may not be the address the Lambda reaches Jenkins on.
+    """
+
+    path = urlsplit(url).path
+    base = urlsplit(jenkins_url).path.rstrip("/")
+    if base and path.startswith(base + "/"):
+        path = path[len(base):]
+    return path.rstrip("/")
+
+def poll_jenkins_json(jenkins_url, path, username, password, is_done, deadline,
+                      initial_delay=0.5, max_delay=10.0, on_update=None):
+    """Poll a tree-filtered Jenkins JSON path until is_done(data) or the deadline
+
+    Waits grow exponentially with equal jitter, like the readiness probe.
+    on_update is called with each response that differs from the previous
+    one. Returns (data, polls); data is None when the path answered 404.
+    """
+
+    delay = initial_delay
+    polls = 0
+    previous = None
+
+    while True:
+        polls += 1
+        remaining = max(0.1, deadline - time.time())
+        timeout = urllib3.Timeout(connect=min(2.0, remaining), read=min(5.0, remaining))
+        response = jenkins_request("GET", jenkins_url, path, username, password, timeout=timeout)
+        if response.status == 404:
+            return None, polls
+        if response.status != 200:
+            raise Exception(f"Jenkins API {path} returned {response.status}")
+
+        data = json.loads(response.data.decode("utf-8"))
+        if on_update and data != previous:
+            on_update(data)
+        previous = data
+        if is_done(data):
+            return data, polls
+
+        backoff = min(max_delay, delay)
+        sleep_for = backoff / 2 + random.uniform(0, backoff / 2)
+        if time.time() + sleep_for >= deadline:
+            return data, polls
+
+        count("retries.jenkins.follow")
+        time.sleep(sleep_for)
+        delay *= 2
+
+def resolve_queue_item(jenkins_url, queue_location, username, password, deadline):
+    """Follow a queue item until Jenkins assigns it a build number
+
+    Returns a dict with status (STARTED, QUEUED, CANCELLED or NOT_FOUND),
+    queue_id, build_number, build_url, why and polls. Jenkins forgets queue
+    items a few minutes after they leave the queue, hence NOT_FOUND.
+    """
+
+    path = f"{api_path(jenkins_url, queue_location)}/api/json?tree={QUEUE_ITEM_TREE}"
+    with span("queue_follow"):
+        item, polls = poll_jenkins_json(
+            jenkins_url, path, username, password,
+            lambda data: data.get("cancelled") or data.get("executable"),
+            deadline
+        )
+
+    result = {
+        "status": QUEUED,
+        "queue_id": None,
+        "build_number": None,
+        "build_url": None,
+        "why": None,
+        "polls": polls
+    }
+    if item is None:
+        result["status"] = NOT_FOUND
+        return result
+
+    result["queue_id"] = item.get("id")
+    result["why"] = item.get("why")
+    if item.get("cancelled"):
+        result["status"] = CANCELLED
+    elif item.get("executable"):
+        result["status"] = STARTED
+        result["build_number"] = item["executable"].get("number")
+        result["build_url"] = item["executable"].get("url")
+    return result
+
+def follow_build(jenkins_url, build_url, username, password, deadline, on_update=None):
+    """Poll a build until it finishes or the deadline passes
+
+    on_update receives every status change, so callers can stream progress.
+    Returns a dict with status (COMPLETED, RUNNING or NOT_FOUND),
+    build_number, result, duration_ms and polls.
+    """
+
+    path = f"{api_path(jenkins_url, build_url)}/api/json?tree={BUILD_STATUS_TREE}"
+    with span("build_follow"):
+        build, polls = poll_jenkins_json(
+            jenkins_url, path, username, password,
+            lambda data: not data.get("building") and data.get("result") is not None,
+            deadline,
+            initial_delay=2.0,
+            max_delay=30.0,
+            on_update=on_update
+        )
+
+    if build is None:
+        return {"status": NOT_FOUND, "build_number": None, "result": None, "duration_ms": None, "polls": polls}
+
+    finished = not build.get("building") and build.get("result") is not None
+    return {
+        "status": COMPLETED if finished else RUNNING,
+        "build_number": build.get("number"),
+        "result": build.get("result"),
+        "duration_ms": build.get("duration") if finished else None,
+        "polls": polls
+    }
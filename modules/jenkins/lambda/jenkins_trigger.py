@@ -1,12 +1,74 @@
 import json
 import os
-import urllib3
-import base64
-import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-# Disable SSL warnings for internal Jenkins
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from aws_clients import get_client
+from build_rules import event_changed_files, get_build_rules, is_branch_deletion, is_github_push, route_build
+from event_sources import (
+    SQS, BatchRetryError, batch_event_source, batch_response, stream_records, supports_partial_batch
+)
+from idempotency import get_idempotency_store, trigger_fingerprint
+from jenkins_api import (
+    AUTH_FAILED, COMPLETED, READY, STARTED, follow_build, get_crumb_headers, jenkins_request,
+    probe_jenkins_readiness, recently_ok, resolve_queue_item
+)
+from metrics import get_metric_buffer
+from tracing import finish_trace, span, start_trace
+from trigger_files import TriggerFileError, expand_job_request, s3_records_to_builds
+
+# Triggers received while the master is booting are parked here until it is ready
+PENDING_TRIGGER_PREFIX = "pending-triggers/"
+MAX_DRAIN_ATTEMPTS = int(os.environ.get("MAX_DRAIN_ATTEMPTS", "10"))
+
+# Re-scheduled drains wait on the pending drain queue, doubling from the base
+# delay up to the SQS maximum. One drain chain runs per master boot, and each
+# pending trigger is claimed before it is fired, so concurrent drains never
+# queue the same build twice.
+PENDING_DRAIN_QUEUE_URL = os.environ.get("PENDING_DRAIN_QUEUE_URL")
+PENDING_DRAIN_BASE_DELAY_SECONDS = int(os.environ.get("PENDING_DRAIN_BASE_DELAY_SECONDS", "15"))
+PENDING_DRAIN_MAX_DELAY_SECONDS = 900
+PENDING_DRAIN_LEASE_SECONDS = 900
+PENDING_CLAIM_LEASE_SECONDS = 300
+
+# Optional SQS buffer in front of Jenkins; triggers for the same
+# (job_name, repository, branch) inside the window collapse to the newest one
+TRIGGER_QUEUE_URL = os.environ.get("TRIGGER_QUEUE_URL")
+TRIGGER_COALESCE_WINDOW_SECONDS = int(os.environ.get("TRIGGER_COALESCE_WINDOW_SECONDS", "60"))
+
+# Discovered master/ASG identities and last-known state, kept across warm invocations
+RESOURCE_CACHE_TTL_SECONDS = int(os.environ.get("RESOURCE_CACHE_TTL_SECONDS", "3600"))
+MASTER_STATE_TTL_SECONDS = int(os.environ.get("MASTER_STATE_TTL_SECONDS", "120"))
+ASG_CAPACITY_TTL_SECONDS = int(os.environ.get("ASG_CAPACITY_TTL_SECONDS", "60"))
+_resource_cache = {}
+
+# Builds of one invocation are POSTed concurrently over the shared pool
+# (urllib3 keeps at most 10 connections per host)
+TRIGGER_FANOUT_MAX_WORKERS = int(os.environ.get("TRIGGER_FANOUT_MAX_WORKERS", "8"))
+MAX_AGENTS = int(os.environ.get("MAX_AGENTS", "5"))
+
+# Optional follow-through once a build is in the Jenkins queue:
+#   off          - report the queue location only
+#   build_number - poll the queue item until Jenkins assigns a build number
+#   completion   - also poll the build until it finishes
+#   async        - leave all polling to a follow-up invocation
+# Whatever is not settled inside the invocation is handed to a follow-up
+# invocation; the latest status is kept under build-status/ in S3.
+BUILD_FOLLOW_MODE = os.environ.get("BUILD_FOLLOW_MODE", "off")
+BUILD_FOLLOW_TIMEOUT_SECONDS = int(os.environ.get("BUILD_FOLLOW_TIMEOUT_SECONDS", "20"))
+MAX_FOLLOW_ATTEMPTS = int(os.environ.get("MAX_FOLLOW_ATTEMPTS", "20"))
+BUILD_STATUS_PREFIX = "build-status/"
+FOLLOW_MODES = ("off", "build_number", "completion", "async")
+
+# Push triggers filtered by the build rules (see build_rules.py)
+PUSH_TRIGGER_TYPES = ("github_webhook", "codecommit_push")
+
+# Latency and outcome metrics, buffered and flushed once per invocation
+metrics = get_metric_buffer("Jenkins/BuildTrigger")
+
+# Idempotency fingerprints claimed by the current invocation
+_claims = []
 
 def handler(event, context):
     """
@@ -14,6 +76,23 @@ def handler(event, context):
     Supports multiple trigger sources: S3, EventBridge, API Gateway, etc.
     """
     
+    started = time.time()
+    start_trace("jenkins_trigger", get_request_id(context))
+    response = None
+    try:
+        response = handle_trigger_event(event, context)
+        return response
+    finally:
+        # Stream batches return a partial batch response rather than a status code
+        outcome = str(response.get("statusCode", "batch")) if response else "error"
+        metrics.timing("TriggerLatency", time.time() - started, {"Outcome": outcome})
+        settle_trigger_claims(succeeded=outcome != "error" and not outcome.startswith("5"))
+        metrics.flush()
+        finish_trace(outcome=outcome)
+
+def handle_trigger_event(event, context):
+    """Route one invocation to the drain, batch or single-trigger path"""
+    
     print(f"Received event: {json.dumps(event, default=str)}")
     
     # Get environment variables
@@ -28,54 +107,199 @@ def handler(event, context):
             "body": json.dumps("Missing required environment variables")
         }
     
-    # Initialize AWS clients
-    ec2_client = boto3.client("ec2")
-    autoscaling_client = boto3.client("autoscaling")
-    s3_client = boto3.client("s3")
+    # Container-wide clients, built on first use
+    ec2_client = get_client("ec2")
+    autoscaling_client = get_client("autoscaling")
+    s3_client = get_client("s3")
     
     try:
-        # Determine trigger source and extract build parameters
-        trigger_source, build_params = parse_event(event)
+        # Follow-up stage: resolve or watch a build queued by an earlier invocation
+        if is_build_follow_event(event):
+            with span("build_follow"):
+                return continue_build_follow(
+                    event, context, s3_client, jenkins_url, jenkins_user, jenkins_password, s3_bucket
+                )
+        
+        # Follow-up stage: the master finished booting (or a drain was re-scheduled)
+        drain_request = pending_drain_request(event)
+        if drain_request is not None:
+            with span("drain_pending_triggers"):
+                return drain_pending_triggers(
+                    drain_request, context, ec2_client, s3_client,
+                    jenkins_url, jenkins_user, jenkins_password, s3_bucket
+                )
+        
+        # Batches delivered by an SQS, Kinesis or Kafka event source mapping
+        if batch_event_source(event):
+            with span("process_trigger_batch"):
+                return process_trigger_batch(
+                    event, context, ec2_client, autoscaling_client, s3_client,
+                    jenkins_url, jenkins_user, jenkins_password, s3_bucket
+                )
+        
+        # Determine trigger source and extract build parameters; S3 batches
+        # and trigger manifests can carry many builds
+        with span("parse_event"):
+            parsed, rejected = parse_events(event)
+        
+        # Pushes the build rules filtered out need no master or agents
+        if not parsed and rejected and all(r.get("skipped") for r in rejected):
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "No build needed for this change", "skipped": rejected})
+            }
+        
+        if not parsed:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": "No valid build triggers in event", "rejected": rejected})
+            }
+        
+        # Drop duplicate deliveries before any EC2 or Jenkins work
+        event_id = event.get("id") or event.get("requestContext", {}).get("requestId")
+        claimed = []
+        for trigger_source, build_params in parsed:
+            is_new, fingerprint = claim_trigger(trigger_source, build_params, event_id)
+            if is_new:
+                claimed.append((trigger_source, build_params, fingerprint))
+        
+        if not claimed:
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Duplicate trigger ignored", "duplicates": len(parsed)})
+            }
+        
+        if len(claimed) > 1 or len(parsed) > 1:
+            with span("dispatch_triggers"):
+                return dispatch_trigger_list(
+                    claimed, rejected, context, ec2_client, autoscaling_client, s3_client,
+                    jenkins_url, jenkins_user, jenkins_password, s3_bucket
+                )
+        
+        trigger_source, build_params, _ = claimed[0]
         print(f"Trigger source: {trigger_source}")
         print(f"Build parameters: {build_params}")
         
-        # Ensure Jenkins master is running
-        jenkins_instance_id = ensure_jenkins_master_running(ec2_client)
+        # Hand the trigger to the buffer queue; it is coalesced and dispatched in batches
+        if TRIGGER_QUEUE_URL:
+            with span("queue_send"):
+                message_id = get_trigger_queue().send(make_trigger(trigger_source, build_params))
+            return {
+                "statusCode": 202,
+                "body": json.dumps({
+                    "message": "Build trigger queued",
+                    "trigger_source": trigger_source,
+                    "message_id": message_id,
+                    "job_name": build_params.get("job_name", "github-pipeline")
+                })
+            }
+        
+        # Without a bucket there is nowhere to persist the trigger, so fall back
+        # to waiting for the master inside this invocation
+        with span("master_start"):
+            if not s3_bucket:
+                jenkins_instance_id = ensure_jenkins_master_running(ec2_client)
+                instance_state = "running" if jenkins_instance_id else None
+            else:
+                # Start the master without waiting for it to boot
+                jenkins_instance_id, instance_state = start_jenkins_master(ec2_client)
+        
         if not jenkins_instance_id:
             return {
                 "statusCode": 500,
                 "body": json.dumps("Failed to start Jenkins master")
             }
         
-        # Scale up Jenkins agents if needed
-        scale_jenkins_agents(autoscaling_client, build_params.get("agent_count", 1))
+        # Scale up Jenkins agents if needed so they boot alongside the master
+        with span("agent_scale"):
+            scale_jenkins_agents(autoscaling_client, build_params.get("agent_count", 1))
+        
+        # Warm path: the master is up and Jenkins answers, trigger straight away
+        readiness = None
+        if instance_state == "running":
+            # With a bucket to park the trigger in, a single probe is enough
+            with span("readiness"):
+                readiness = wait_for_jenkins_ready(
+                    jenkins_url, jenkins_user, jenkins_password,
+                    deadline=None if s3_bucket else readiness_deadline(context)
+                )
+            if readiness["status"] == AUTH_FAILED:
+                return {
+                    "statusCode": 500,
+                    "body": json.dumps("Jenkins rejected the configured credentials")
+                }
+        
+        jenkins_ready = readiness is not None and readiness["status"] == READY
+        if not jenkins_ready and instance_state == "running" and s3_bucket:
+            # The cached state may be stale if the master was stopped since
+            with span("master_start"):
+                jenkins_instance_id, instance_state = start_jenkins_master(ec2_client, use_cache=False)
+        
+        if jenkins_ready:
+            # Trigger Jenkins build
+            with span("build_post"):
+                build_result = trigger_jenkins_build(
+                    jenkins_url, jenkins_user, jenkins_password, build_params
+                )
+            
+            # Resolve the build number (and optionally its result) for the caller
+            follow_build_trigger(
+                context, s3_client, s3_bucket, jenkins_url, jenkins_user, jenkins_password,
+                build_params, build_result
+            )
+            
+            # Log build trigger to S3
+            with span("s3_log"):
+                log_build_trigger(s3_client, s3_bucket, trigger_source, build_params, build_result)
+            
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": "Jenkins build triggered successfully",
+                    "trigger_source": trigger_source,
+                    "build_number": build_result.get("build_number"),
+                    "build_url": build_result.get("build_url"),
+                    "build_status": build_result.get("build_status"),
+                    "build_outcome": build_result.get("build_outcome"),
+                    "status_key": build_result.get("status_key"),
+                    "job_name": build_params.get("job_name", "github-pipeline"),
+                    "jenkins_instance_id": jenkins_instance_id
+                })
+            }
         
-        # Wait for Jenkins to be ready
-        if not wait_for_jenkins_ready(jenkins_url, jenkins_user, jenkins_password):
+        if not s3_bucket:
             return {
                 "statusCode": 500,
                 "body": json.dumps("Jenkins master is not ready")
             }
         
-        # Trigger Jenkins build
-        build_result = trigger_jenkins_build(
-            jenkins_url, jenkins_user, jenkins_password, build_params
-        )
+        # Cold path: persist the trigger and let the follow-up stage fire it
+        with span("persist_pending"):
+            pending_key = persist_pending_trigger(
+                s3_client, s3_bucket, trigger_source, build_params, get_request_id(context)
+            )
         
-        # Log build trigger to S3
-        log_build_trigger(s3_client, s3_bucket, trigger_source, build_params, build_result)
+        # A stopped master emits an EC2 state-change event once it is running.
+        # A master that is already running (Jenkins still booting) or stopping
+        # will not, so re-schedule the drain ourselves.
+        if instance_state in ("running", "stopping"):
+            with span("schedule_drain"):
+                request_pending_drain(context, jenkins_instance_id)
         
         return {
-            "statusCode": 200,
+            "statusCode": 202,
             "body": json.dumps({
-                "message": "Jenkins build triggered successfully",
+                "message": "Jenkins master is starting, build queued",
                 "trigger_source": trigger_source,
-                "build_number": build_result.get("build_number"),
+                "pending_trigger": pending_key,
                 "job_name": build_params.get("job_name", "github-pipeline"),
-                "jenkins_instance_id": jenkins_instance_id
+                "jenkins_instance_id": jenkins_instance_id,
+                "instance_state": instance_state
             })
         }
         
+    except BatchRetryError:
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         return {
@@ -86,32 +310,12 @@ def handler(event, context):
 def parse_event(event):
     """Parse the incoming event to determine trigger source and build parameters"""
     
-    # S3 Event (file upload trigger)
-    if "Records" in event and event["Records"][0].get("eventSource") == "aws:s3":
-        s3_record = event["Records"][0]["s3"]
-        bucket = s3_record["bucket"]["name"]
-        key = s3_record["object"]["key"]
-        
-        # Extract build parameters from S3 object key or metadata
-        build_params = {
-            "job_name": "github-pipeline",
-            "trigger_type": "s3_upload",
-            "source_bucket": bucket,
-            "source_key": key,
-            "agent_count": 1
-        }
-        
-        # If it's a trigger file, parse additional parameters
-        if key.startswith("triggers/") and key.endswith(".trigger"):
-            try:
-                s3_client = boto3.client("s3")
-                response = s3_client.get_object(Bucket=bucket, Key=key)
-                trigger_data = json.loads(response["Body"].read().decode("utf-8"))
-                build_params.update(trigger_data)
-            except Exception as e:
-                print(f"Error parsing trigger file: {e}")
-        
-        return "s3_event", build_params
+    # S3 Event (file upload trigger); see parse_events for multi-build events
+    if is_s3_event(event):
+        builds, rejected = s3_records_to_builds(get_client("s3"), event["Records"])
+        if not builds:
+            raise ValueError(f"No valid build triggers in S3 event: {rejected}")
+        return "s3_event", builds[0]
     
     # EventBridge Event (GitHub webhook or scheduled)
     elif "source" in event:
@@ -121,6 +325,7 @@ def parse_event(event):
                 "trigger_type": "codecommit_push",
                 "repository": event["detail"].get("repositoryName", ""),
                 "branch": event["detail"].get("referenceName", "main"),
+                "commit_sha": event["detail"].get("commitId", ""),
                 "agent_count": 1
             }
         else:
@@ -141,6 +346,10 @@ def parse_event(event):
             except:
                 pass
         
+        # GitHub webhooks delivered through the /trigger endpoint
+        if is_github_push(body):
+            return "github_webhook", github_push_params(body)
+        
         build_params = {
             "job_name": body.get("job_name", "github-pipeline"),
             "trigger_type": "api_gateway",
@@ -149,22 +358,14 @@ def parse_event(event):
             "agent_count": body.get("agent_count", 1),
             "build_parameters": body.get("build_parameters", {})
         }
+        if body.get("follow"):
+            build_params["follow"] = body["follow"]
         
         return "api_gateway", build_params
     
     # GitHub Webhook (if configured to call Lambda directly)
     elif "repository" in event and "pusher" in event:
-        build_params = {
-            "job_name": "github-pipeline",
-            "trigger_type": "github_webhook",
-            "repository": event["repository"]["name"],
-            "branch": event["ref"].replace("refs/heads/", ""),
-            "commit_sha": event["head_commit"]["id"],
-            "pusher": event["pusher"]["name"],
-            "agent_count": 1
-        }
-        
-        return "github_webhook", build_params
+        return "github_webhook", github_push_params(event)
     
     # Default/Manual trigger
     else:
@@ -174,36 +375,227 @@ def parse_event(event):
             "agent_count": event.get("agent_count", 1),
             "build_parameters": event.get("build_parameters", {})
         }
+        if event.get("follow"):
+            build_params["follow"] = event["follow"]
         
         return "manual", build_params
 
-def ensure_jenkins_master_running(ec2_client):
-    """Ensure Jenkins master instance is running"""
+def github_push_params(payload):
+    """Build parameters for a GitHub push webhook payload"""
     
-    try:
-        # Find Jenkins master instance
-        response = ec2_client.describe_instances(
+    # Branch deletions carry no head commit
+    head_commit = payload.get("head_commit") or {}
+    return {
+        "job_name": "github-pipeline",
+        "trigger_type": "github_webhook",
+        "repository": payload["repository"]["name"],
+        "branch": payload["ref"].replace("refs/heads/", ""),
+        "commit_sha": head_commit.get("id", payload.get("after", "")),
+        "pusher": payload["pusher"]["name"],
+        "agent_count": 1
+    }
+
+def is_s3_event(event):
+    """Check whether the event is an S3 object notification"""
+    
+    records = event.get("Records") or []
+    return bool(records) and records[0].get("eventSource") == "aws:s3"
+
+def parse_events(event):
+    """Parse an event into every (trigger_source, build_params) it carries
+    
+    S3 events are expanded record by record, trigger manifests build by
+    build. Returns (triggers, rejected) where rejected lists trigger files that
+    failed validation.
+    """
+    
+    if is_s3_event(event):
+        builds, rejected = s3_records_to_builds(get_client("s3"), event["Records"])
+        return route_triggers(event, [("s3_event", build_params) for build_params in builds], rejected)
+    
+    fanout = fanout_request(event)
+    if fanout:
+        trigger_source, request = fanout
+        try:
+            builds = expand_job_request(request)
+        except TriggerFileError as e:
+            return [], [{"error": str(e)}]
+        
+        triggers = []
+        for build in builds:
+            build_params = {"trigger_type": trigger_source, "agent_count": 1}
+            build_params.update(build)
+            if request.get("follow"):
+                build_params["follow"] = request["follow"]
+            triggers.append((trigger_source, build_params))
+        return route_triggers(event, triggers, [])
+    
+    return route_triggers(event, [parse_event(event)], [])
+
+def route_triggers(event, triggers, rejected):
+    """Apply the build rules to pushes, dropping those that need no build
+    
+    Pushes and triggers listing changed_files are mapped to the jobs their
+    branch and paths select, before any EC2 call. Dropped pushes are added
+    to rejected with the reason they were skipped.
+    """
+    
+    rules = get_build_rules()
+    routed = []
+    for trigger_source, build_params in triggers:
+        if not rules or not (
+            "changed_files" in build_params or build_params.get("trigger_type") in PUSH_TRIGGER_TYPES
+        ):
+            build_params.pop("changed_files", None)
+            routed.append((trigger_source, build_params))
+            continue
+        
+        if is_branch_deletion(event):
+            builds, reason = [], "branch deleted"
+        else:
+            changed_files = None
+            if rules["needs_changes"]:
+                with span("changed_files"):
+                    changed_files = event_changed_files(event, build_params)
+            builds, reason = route_build(rules, build_params, changed_files)
+        
+        for build in builds:
+            build.pop("changed_files", None)
+            routed.append((trigger_source, build))
+        
+        if not builds:
+            print(f"No build needed for {trigger_source} push to {build_params.get('branch')}: {reason}")
+            metrics.put("BuildsSkipped", 1, dimensions={"TriggerSource": trigger_source})
+            rejected.append({
+                "skipped": reason,
+                "trigger_source": trigger_source,
+                "repository": build_params.get("repository", ""),
+                "branch": build_params.get("branch", ""),
+                "commit_sha": build_params.get("commit_sha", "")
+            })
+    
+    return routed, rejected
+
+def fanout_request(event):
+    """Return (trigger_source, request) for an API or manual request naming many jobs"""
+    
+    if "httpMethod" in event:
+        try:
+            body = json.loads(event.get("body") or "{}")
+        except ValueError:
+            return None
+        if isinstance(body, dict) and "jobs" in body:
+            return "api_gateway", body
+        return None
+    
+    if "jobs" in event and "source" not in event and "Records" not in event:
+        return "manual", event
+    return None
+
+def cache_get(key):
+    """Return a cached value if it has not expired"""
+    
+    entry = _resource_cache.get(key)
+    if entry and entry["expires_at"] > time.time():
+        return entry["value"]
+    _resource_cache.pop(key, None)
+    return None
+
+def cache_put(key, value, ttl):
+    """Cache a value for ttl seconds across warm invocations"""
+    
+    _resource_cache[key] = {"value": value, "expires_at": time.time() + ttl}
+    return value
+
+def cache_invalidate(key):
+    """Evict a cached value"""
+    
+    _resource_cache.pop(key, None)
+
+def resolve_jenkins_master_id(ec2_client):
+    """Resolve the Jenkins master instance, returning (instance_id, state)
+    
+    JENKINS_INSTANCE_ID from the environment wins; otherwise the master is
+    looked up by its Type tag with a paginated, filtered describe. The ID is
+    memoized for RESOURCE_CACHE_TTL_SECONDS.
+    """
+    
+    instance_id = os.environ.get("JENKINS_INSTANCE_ID") or cache_get("jenkins_master_id")
+    
+    if instance_id:
+        response = ec2_client.describe_instances(InstanceIds=[instance_id])
+        instances = [i for r in response["Reservations"] for i in r["Instances"]]
+    else:
+        paginator = ec2_client.get_paginator("describe_instances")
+        instances = []
+        for page in paginator.paginate(
             Filters=[
                 {"Name": "tag:Type", "Values": ["jenkins-master"]},
-                {"Name": "instance-state-name", "Values": ["running", "stopped"]}
+                {"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]}
             ]
-        )
+        ):
+            instances.extend(i for r in page["Reservations"] for i in r["Instances"])
+    
+    if not instances:
+        cache_invalidate("jenkins_master_id")
+        return None, None
+    
+    instance = instances[0]
+    cache_put("jenkins_master_id", instance["InstanceId"], RESOURCE_CACHE_TTL_SECONDS)
+    return instance["InstanceId"], instance["State"]["Name"]
+
+def start_jenkins_master(ec2_client, use_cache=True):
+    """Start the Jenkins master if it is stopped, without waiting for it to boot
+    
+    Returns a tuple of (instance_id, state) where state is the state observed
+    before any start request was issued. instance_id is None if no master exists.
+    A master recently seen running (or whose Jenkins answered recently) is
+    returned from cache without any EC2 call.
+    """
+    
+    if use_cache:
+        instance_id = cache_get("jenkins_master_running")
+        if instance_id or (cache_get("jenkins_master_id") and recently_ok(os.environ.get("JENKINS_URL", ""))):
+            return instance_id or cache_get("jenkins_master_id"), "running"
+    
+    try:
+        # Find Jenkins master instance
+        instance_id, instance_state = resolve_jenkins_master_id(ec2_client)
         
-        if not response["Reservations"]:
+        if not instance_id:
             print("No Jenkins master instance found")
-            return None
+            return None, None
         
-        instance = response["Reservations"][0]["Instances"][0]
-        instance_id = instance["InstanceId"]
-        instance_state = instance["State"]["Name"]
+        if instance_state == "running":
+            cache_put("jenkins_master_running", instance_id, MASTER_STATE_TTL_SECONDS)
+        else:
+            cache_invalidate("jenkins_master_running")
         
         if instance_state == "stopped":
             print(f"Starting Jenkins master instance: {instance_id}")
             ec2_client.start_instances(InstanceIds=[instance_id])
-            
+        else:
+            print(f"Jenkins master instance {instance_id} is {instance_state}")
+        
+        return instance_id, instance_state
+        
+    except Exception as e:
+        print(f"Error managing Jenkins master instance: {e}")
+        return None, None
+
+def ensure_jenkins_master_running(ec2_client):
+    """Ensure Jenkins master instance is running"""
+    
+    instance_id, instance_state = start_jenkins_master(ec2_client)
+    if not instance_id:
+        return None
+    
+    try:
+        if instance_state != "running":
             # Wait for instance to be running
             waiter = ec2_client.get_waiter("instance_running")
-            waiter.wait(InstanceIds=[instance_id], WaiterConfig={"Delay": 15, "MaxAttempts": 20})
+            with metrics.timer("MasterBootWait"):
+                waiter.wait(InstanceIds=[instance_id], WaiterConfig={"Delay": 15, "MaxAttempts": 20})
             
         print(f"Jenkins master instance {instance_id} is running")
         return instance_id
@@ -212,29 +604,63 @@ def ensure_jenkins_master_running(ec2_client):
         print(f"Error managing Jenkins master instance: {e}")
         return None
 
+def resolve_agent_asg(autoscaling_client):
+    """Resolve the Jenkins agents Auto Scaling Group, returning (name, desired_capacity)
+    
+    ASG_NAME from the environment wins; otherwise groups tagged
+    Component=Jenkins are paginated and matched on their jenkins-agent Name
+    tag, falling back to a paginated scan of every group. The name is memoized
+    for RESOURCE_CACHE_TTL_SECONDS.
+    """
+    
+    asg_name = os.environ.get("ASG_NAME") or cache_get("agent_asg_name")
+    paginator = autoscaling_client.get_paginator("describe_auto_scaling_groups")
+    
+    if asg_name:
+        pages = paginator.paginate(AutoScalingGroupNames=[asg_name])
+    else:
+        pages = paginator.paginate(Filters=[{"Name": "tag:Component", "Values": ["Jenkins"]}])
+    
+    jenkins_asg = find_agent_asg(pages, asg_name)
+    if not jenkins_asg and not asg_name:
+        jenkins_asg = find_agent_asg(paginator.paginate(), None)
+    
+    if not jenkins_asg:
+        cache_invalidate("agent_asg_name")
+        return None, None
+    
+    cache_put("agent_asg_name", jenkins_asg["AutoScalingGroupName"], RESOURCE_CACHE_TTL_SECONDS)
+    return jenkins_asg["AutoScalingGroupName"], jenkins_asg["DesiredCapacity"]
+
+def find_agent_asg(pages, asg_name):
+    """Pick the Jenkins agents group out of paginated describe results"""
+    
+    for page in pages:
+        for asg in page["AutoScalingGroups"]:
+            if asg_name and asg["AutoScalingGroupName"] == asg_name:
+                return asg
+            for tag in asg.get("Tags", []):
+                if tag["Key"] == "Name" and "jenkins-agent" in tag["Value"]:
+                    return asg
+    return None
+
 def scale_jenkins_agents(autoscaling_client, desired_count):
     """Scale Jenkins agents based on build requirements"""
     
+    # Skip the describe entirely while the known capacity already covers the request
+    cached_capacity = cache_get("agent_asg_capacity")
+    if cached_capacity is not None and desired_count <= cached_capacity:
+        print(f"Jenkins agents already at desired capacity: {cached_capacity}")
+        return
+    
     try:
         # Find Jenkins agents Auto Scaling Group
-        response = autoscaling_client.describe_auto_scaling_groups()
-        
-        jenkins_asg = None
-        for asg in response["AutoScalingGroups"]:
-            for tag in asg.get("Tags", []):
-                if tag["Key"] == "Name" and "jenkins-agent" in tag["Value"]:
-                    jenkins_asg = asg
-                    break
-            if jenkins_asg:
-                break
+        asg_name, current_capacity = resolve_agent_asg(autoscaling_client)
         
-        if not jenkins_asg:
+        if not asg_name:
             print("Jenkins agents Auto Scaling Group not found")
             return
         
-        asg_name = jenkins_asg["AutoScalingGroupName"]
-        current_capacity = jenkins_asg["DesiredCapacity"]
-        
         # Scale up if needed (but don't scale down automatically)
         if desired_count > current_capacity:
             print(f"Scaling Jenkins agents from {current_capacity} to {desired_count}")
@@ -243,54 +669,41 @@ def scale_jenkins_agents(autoscaling_client, desired_count):
                 DesiredCapacity=desired_count,
                 HonorCooldown=False
             )
+            current_capacity = desired_count
         else:
             print(f"Jenkins agents already at desired capacity: {current_capacity}")
+        
+        cache_put("agent_asg_capacity", current_capacity, ASG_CAPACITY_TTL_SECONDS)
             
     except Exception as e:
         print(f"Error scaling Jenkins agents: {e}")
 
-def wait_for_jenkins_ready(jenkins_url, username, password, max_attempts=30):
-    """Wait for Jenkins to be ready to accept requests"""
+def wait_for_jenkins_ready(jenkins_url, username, password, deadline=None):
+    """Wait for Jenkins to be ready to accept requests
+    
+    deadline is an absolute time.time() value; None makes a single probe.
+    Returns the structured result of jenkins_api.probe_jenkins_readiness.
+    """
     
-    http = urllib3.PoolManager()
-    auth_header = base64.b64encode(f"{username}:{password}".encode()).decode()
-    headers = {"Authorization": f"Basic {auth_header}"}
+    # Any successful Jenkins call in the last few seconds on this warm container
+    # is proof enough; skip the probe round-trip
+    if recently_ok(jenkins_url):
+        return {"status": READY, "attempts": 0, "waited_seconds": 0.0, "last_error": None}
     
-    for attempt in range(max_attempts):
-        try:
-            response = http.request("GET", f"{jenkins_url}/api/json", headers=headers, timeout=10)
-            if response.status == 200:
-                print("Jenkins is ready")
-                return True
-        except Exception as e:
-            print(f"Attempt {attempt + 1}: Jenkins not ready - {e}")
-        
-        if attempt < max_attempts - 1:
-            import time
-            time.sleep(10)
+    readiness = probe_jenkins_readiness(jenkins_url, username, password, deadline=deadline)
+    metrics.timing("ReadinessWait", readiness["waited_seconds"], {"Status": readiness["status"]})
+    metrics.put("ReadinessProbes", readiness["attempts"])
     
-    print("Jenkins failed to become ready")
-    return False
+    if readiness["status"] == READY:
+        print(f"Jenkins is ready after {readiness['attempts']} probes ({readiness['waited_seconds']}s)")
+    else:
+        print(f"Jenkins not ready ({readiness['status']}) after {readiness['attempts']} probes: {readiness['last_error']}")
+    
+    return readiness
 
 def trigger_jenkins_build(jenkins_url, username, password, build_params):
     """Trigger a Jenkins build with the specified parameters"""
     
-    http = urllib3.PoolManager()
-    auth_header = base64.b64encode(f"{username}:{password}".encode()).decode()
-    
-    # Get CSRF crumb
-    crumb_response = http.request(
-        "GET",
-        f"{jenkins_url}/crumbIssuer/api/xml?xpath=concat(//crumbRequestField,\":\",//crumb)",
-        headers={"Authorization": f"Basic {auth_header}"}
-    )
-    
-    headers = {"Authorization": f"Basic {auth_header}"}
-    if crumb_response.status == 200:
-        crumb = crumb_response.data.decode()
-        crumb_field, crumb_value = crumb.split(":")
-        headers[crumb_field] = crumb_value
-    
     job_name = build_params.get("job_name", "github-pipeline")
     
     # Prepare build parameters
@@ -307,23 +720,30 @@ def trigger_jenkins_build(jenkins_url, username, password, build_params):
         jenkins_params.update(build_params["build_parameters"])
     
     # Trigger build with parameters
+    started = time.time()
     if jenkins_params:
         # Build with parameters
         params_data = "&".join([f"{k}={v}" for k, v in jenkins_params.items()])
         build_url = f"{jenkins_url}/job/{job_name}/buildWithParameters"
         
-        response = http.request(
-            "POST",
-            build_url,
+        response = jenkins_request(
+            "POST", jenkins_url, f"/job/{job_name}/buildWithParameters", username, password,
             body=params_data,
-            headers={**headers, "Content-Type": "application/x-www-form-urlencoded"}
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            with_crumb=True
         )
     else:
         # Simple build trigger
         build_url = f"{jenkins_url}/job/{job_name}/build"
-        response = http.request("POST", build_url, headers=headers)
+        response = jenkins_request(
+            "POST", jenkins_url, f"/job/{job_name}/build", username, password, with_crumb=True
+        )
+    
+    metrics.timing("BuildPostLatency", time.time() - started)
     
     if response.status in [200, 201]:
+        metrics.put("BuildsTriggered", 1)
+        
         # Get queue item location from response headers
         queue_location = response.headers.get("Location", "")
         print(f"Build triggered successfully. Queue location: {queue_location}")
@@ -335,6 +755,7 @@ def trigger_jenkins_build(jenkins_url, username, password, build_params):
             "parameters": jenkins_params
         }
     else:
+        metrics.put("BuildTriggerFailures", 1)
         raise Exception(f"Failed to trigger build. Status: {response.status}, Response: {response.data.decode()}")
 
 def log_build_trigger(s3_client, bucket, trigger_source, build_params, build_result):
@@ -371,6 +792,950 @@ def log_build_trigger(s3_client, bucket, trigger_source, build_params, build_res
     except Exception as e:
         print(f"Error logging build trigger: {e}")
 
+def get_request_id(context):
+    """Return the Lambda request ID for the current invocation"""
+    
+    return getattr(context, "aws_request_id", None) or os.environ.get("AWS_LAMBDA_REQUEST_ID", "unknown")
+
+def readiness_deadline(context, reserve_seconds=15, default_seconds=300):
+    """Absolute deadline for readiness polling that leaves time to trigger and log"""
+    
+    if not hasattr(context, "get_remaining_time_in_millis"):
+        return time.time() + default_seconds
+    
+    remaining = context.get_remaining_time_in_millis() / 1000.0 - reserve_seconds
+    return time.time() + max(0.0, remaining)
+
+def pending_drain_request(event):
+    """Return the drain request an event carries, None if it is not one
+    
+    Drains are requested directly, by the EC2 state-change rule once the
+    master is running, or by a delayed message on the pending drain queue.
+    """
+    
+    if event.get("action") == "drain_pending_triggers":
+        return event
+    
+    # EventBridge notification that the Jenkins master reached the running state
+    if (
+        event.get("source") == "aws.ec2"
+        and event.get("detail-type") == "EC2 Instance State-change Notification"
+        and event.get("detail", {}).get("state") == "running"
+    ):
+        return {"attempt": 0, "instance_id": event["detail"].get("instance-id")}
+    
+    records = event.get("Records") or []
+    if len(records) == 1 and records[0].get("eventSource") == "aws:sqs":
+        try:
+            body = json.loads(records[0].get("body") or "{}")
+        except ValueError:
+            return None
+        if isinstance(body, dict) and body.get("action") == "drain_pending_triggers":
+            return body
+    
+    return None
+
+def persist_pending_trigger(s3_client, bucket, trigger_source, build_params, request_id):
+    """Store a trigger in S3 until the Jenkins master is ready to accept it"""
+    
+    now = datetime.utcnow()
+    pending_key = f"{PENDING_TRIGGER_PREFIX}{now.strftime('%Y%m%dT%H%M%S%f')}-{request_id}.json"
+    
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=pending_key,
+        Body=json.dumps({
+            "received_at": now.isoformat(),
+            "trigger_source": trigger_source,
+            "build_params": build_params,
+            "lambda_request_id": request_id
+        }),
+        ContentType="application/json"
+    )
+    
+    print(f"Pending trigger stored: s3://{bucket}/{pending_key}")
+    return pending_key
+
+def list_pending_triggers(s3_client, bucket):
+    """List persisted pending trigger keys, oldest first"""
+    
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=PENDING_TRIGGER_PREFIX):
+        for obj in page.get("Contents", []):
+            keys.append(obj["Key"])
+    
+    # Keys start with a sortable timestamp
+    return sorted(keys)
+
+def pending_drain_delay(attempt):
+    """Seconds to wait before drain attempt number attempt"""
+    
+    return min(PENDING_DRAIN_MAX_DELAY_SECONDS, PENDING_DRAIN_BASE_DELAY_SECONDS * 2 ** max(0, attempt - 1))
+
+def schedule_pending_drain(context, attempt, instance_id=None):
+    """Schedule a later drain of pending triggers, backing off with each attempt
+    
+    Without a pending drain queue (local runs) the function re-invokes
+    itself straight away.
+    """
+    
+    if attempt > MAX_DRAIN_ATTEMPTS:
+        print(f"Giving up scheduling drains after {MAX_DRAIN_ATTEMPTS} attempts, triggers stay pending")
+        release_pending_drain(instance_id)
+        return False
+    
+    payload = json.dumps({"action": "drain_pending_triggers", "attempt": attempt, "instance_id": instance_id})
+    
+    if PENDING_DRAIN_QUEUE_URL:
+        delay = pending_drain_delay(attempt)
+        get_client("sqs").send_message(
+            QueueUrl=PENDING_DRAIN_QUEUE_URL,
+            MessageBody=payload,
+            DelaySeconds=delay
+        )
+        print(f"Scheduled pending trigger drain (attempt {attempt}) in {delay}s")
+        return True
+    
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if not function_name:
+        print("Cannot schedule pending trigger drain: unknown function name")
+        return False
+    
+    lambda_client = get_client("lambda")
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=payload
+    )
+    
+    print(f"Scheduled pending trigger drain (attempt {attempt})")
+    return True
+
+def request_pending_drain(context, instance_id):
+    """Start the drain chain for this master boot unless one is already running"""
+    
+    key = f"pending-drain:{instance_id}"
+    store = get_idempotency_store()
+    if store is None:
+        # Without a shared store, at least one drain per container and boot
+        if cache_get(key):
+            return False
+        cache_put(key, True, PENDING_DRAIN_LEASE_SECONDS)
+    else:
+        try:
+            if not store.claim(key, lease_seconds=PENDING_DRAIN_LEASE_SECONDS):
+                print(f"Pending trigger drain already scheduled for {instance_id}")
+                return False
+        except Exception as e:
+            print(f"Idempotency store unavailable, scheduling drain anyway: {e}")
+    
+    return schedule_pending_drain(context, attempt=1, instance_id=instance_id)
+
+def release_pending_drain(instance_id):
+    """End this boot's drain chain so the next trigger can start a new one"""
+    
+    if not instance_id:
+        return
+    key = f"pending-drain:{instance_id}"
+    cache_invalidate(key)
+    store = get_idempotency_store()
+    if store is None:
+        return
+    try:
+        store.release(key)
+    except Exception as e:
+        print(f"Error releasing pending drain claim: {e}")
+
+def claim_pending_trigger(pending_key):
+    """Claim a pending trigger so only one drain fires it"""
+    
+    store = get_idempotency_store()
+    if store is None:
+        return True
+    try:
+        return store.claim(f"pending-trigger:{pending_key}", lease_seconds=PENDING_CLAIM_LEASE_SECONDS)
+    except Exception as e:
+        print(f"Idempotency store unavailable, firing {pending_key} unclaimed: {e}")
+        return True
+
+def release_pending_trigger(pending_key):
+    """Give a pending trigger back to the next drain"""
+    
+    store = get_idempotency_store()
+    if store is None:
+        return
+    try:
+        store.release(f"pending-trigger:{pending_key}")
+    except Exception as e:
+        print(f"Error releasing pending trigger claim: {e}")
+
+def drain_pending_triggers(event, context, ec2_client, s3_client,
+                           jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Fire every persisted pending trigger once Jenkins is ready"""
+    
+    if not s3_bucket:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("S3_BUCKET is required to drain pending triggers")
+        }
+    
+    attempt = int(event.get("attempt") or 0)
+    
+    pending_keys = list_pending_triggers(s3_client, s3_bucket)
+    if not pending_keys:
+        print("No pending triggers to drain")
+        release_pending_drain(event.get("instance_id"))
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"message": "No pending triggers", "triggered": []})
+        }
+    
+    print(f"Draining {len(pending_keys)} pending triggers (attempt {attempt})")
+    
+    # The master may have been stopped again since the trigger was persisted
+    jenkins_instance_id, instance_state = start_jenkins_master(ec2_client, use_cache=False)
+    if not jenkins_instance_id:
+        return {
+            "statusCode": 500,
+            "body": json.dumps("Failed to start Jenkins master")
+        }
+    
+    # A stopped master was just started; its state-change event drains once it runs
+    if instance_state == "stopped":
+        return {
+            "statusCode": 202,
+            "body": json.dumps({
+                "message": "Jenkins master is starting, pending triggers kept",
+                "pending_triggers": len(pending_keys),
+                "jenkins_instance_id": jenkins_instance_id
+            })
+        }
+    
+    with span("readiness"):
+        jenkins_ready = instance_state == "running" and wait_for_jenkins_ready(
+            jenkins_url, jenkins_user, jenkins_password,
+            deadline=readiness_deadline(context)
+        )["status"] == READY
+    
+    if not jenkins_ready:
+        # Leave the triggers in place; they are retried by the next drain
+        rescheduled = schedule_pending_drain(context, attempt + 1, jenkins_instance_id)
+        return {
+            "statusCode": 202,
+            "body": json.dumps({
+                "message": "Jenkins master is not ready, pending triggers kept",
+                "pending_triggers": len(pending_keys),
+                "rescheduled": rescheduled
+            })
+        }
+    
+    pending_triggers = []
+    for pending_key in pending_keys:
+        # Another drain is already firing this trigger
+        if not claim_pending_trigger(pending_key):
+            continue
+        try:
+            response = s3_client.get_object(Bucket=s3_bucket, Key=pending_key)
+            pending = json.loads(response["Body"].read().decode("utf-8"))
+            pending["pending_keys"] = [pending_key]
+            
+            # How long the trigger waited for the master to boot and Jenkins to come up
+            waited = datetime.utcnow() - datetime.fromisoformat(pending["received_at"])
+            metrics.timing("PendingTriggerWait", waited.total_seconds())
+            pending_triggers.append(pending)
+        except Exception as e:
+            print(f"Error reading pending trigger {pending_key}: {e}")
+            release_pending_trigger(pending_key)
+    
+    with span("build_post"):
+        results = fire_triggers(
+            coalesce_triggers(pending_triggers, TRIGGER_COALESCE_WINDOW_SECONDS),
+            jenkins_url, jenkins_user, jenkins_password
+        )
+    with span("s3_log"):
+        log_build_triggers(s3_client, s3_bucket, results, get_request_id(context))
+    
+    triggered = []
+    failed = []
+    for result in results:
+        if result["success"]:
+            # Only remove pending triggers once their build is in the Jenkins queue;
+            # the claim is left to expire so a drain that listed them earlier skips them
+            for pending_key in result["trigger"]["pending_keys"]:
+                s3_client.delete_object(Bucket=s3_bucket, Key=pending_key)
+            triggered.append({
+                "pending_triggers": result["trigger"]["pending_keys"],
+                "job_name": result["trigger"]["build_params"].get("job_name", "github-pipeline"),
+                "queue_location": result["build_result"].get("queue_location")
+            })
+        else:
+            for pending_key in result["trigger"]["pending_keys"]:
+                release_pending_trigger(pending_key)
+            failed.append({
+                "pending_triggers": result["trigger"]["pending_keys"],
+                "error": result["error"]
+            })
+    
+    release_pending_drain(jenkins_instance_id)
+    
+    return {
+        "statusCode": 200 if not failed else 207,
+        "body": json.dumps({
+            "message": f"Drained {len(triggered)} pending triggers",
+            "jenkins_instance_id": jenkins_instance_id,
+            "triggered": triggered,
+            "failed": failed
+        })
+    }
+
+def get_follow_mode(build_params):
+    """Follow-through mode for a trigger: its own "follow" field or BUILD_FOLLOW_MODE"""
+    
+    mode = build_params.get("follow") or BUILD_FOLLOW_MODE
+    return mode if mode in FOLLOW_MODES else "off"
+
+def build_status_key(job_name, queue_location):
+    """S3 key of the status record for a queue item, e.g. build-status/api/queue-42.json"""
+    
+    queue_id = queue_location.rstrip("/").rsplit("/", 1)[-1]
+    return f"{BUILD_STATUS_PREFIX}{job_name}/queue-{queue_id}.json"
+
+def follow_build_trigger(context, s3_client, bucket, jenkins_url, username, password,
+                         build_params, build_result, deadline=None):
+    """Resolve a queued build to its build number and, if asked, its result
+    
+    Polls within BUILD_FOLLOW_TIMEOUT_SECONDS (or deadline) and updates
+    build_result in place. Anything still unsettled is handed to a follow-up
+    invocation when there is a bucket to report the status in.
+    """
+    
+    mode = get_follow_mode(build_params)
+    queue_location = build_result.get("queue_location")
+    if mode == "off" or not queue_location:
+        return build_result
+    
+    job_name = build_params.get("job_name", "github-pipeline")
+    follow = {
+        "job_name": job_name,
+        "mode": mode,
+        "queue_location": queue_location,
+        "status": "queued",
+        "build_number": None,
+        "build_url": None,
+        "result": None
+    }
+    
+    if mode != "async":
+        if deadline is None:
+            deadline = min(time.time() + BUILD_FOLLOW_TIMEOUT_SECONDS, readiness_deadline(context, reserve_seconds=10))
+        try:
+            advance_build_follow(follow, jenkins_url, username, password, deadline)
+        except Exception as e:
+            print(f"Error following {job_name} build: {e}")
+    
+    settled = follow_settled(follow)
+    if bucket:
+        follow["status_key"] = build_status_key(job_name, queue_location)
+        write_build_status(s3_client, bucket, follow)
+        if not settled:
+            schedule_build_follow(context, follow, attempt=1)
+    
+    build_result.update({
+        "build_number": follow["build_number"],
+        "build_url": follow["build_url"],
+        "build_status": follow["status"],
+        "build_outcome": follow["result"],
+        "status_key": follow.get("status_key")
+    })
+    return build_result
+
+def advance_build_follow(follow, jenkins_url, username, password, deadline):
+    """Poll Jenkins until the follow is settled for its mode or the deadline passes"""
+    
+    if not follow["build_url"]:
+        started = time.time()
+        resolution = resolve_queue_item(jenkins_url, follow["queue_location"], username, password, deadline)
+        follow["status"] = resolution["status"]
+        follow["build_number"] = resolution["build_number"]
+        follow["build_url"] = resolution["build_url"]
+        if resolution["status"] == STARTED:
+            metrics.timing("BuildStartWait", time.time() - started)
+            print(f"{follow['job_name']} started as build #{follow['build_number']}")
+        elif resolution["why"]:
+            print(f"{follow['job_name']} still queued: {resolution['why']}")
+    
+    if follow["mode"] == "build_number" or not follow["build_url"]:
+        return follow
+    
+    def report(build):
+        # Status changes go to the log as they happen
+        state = "running" if build.get("building") else build.get("result")
+        print(f"{follow['job_name']} #{build.get('number')}: {state}")
+    
+    status = follow_build(jenkins_url, follow["build_url"], username, password, deadline, on_update=report)
+    follow["status"] = status["status"]
+    follow["result"] = status["result"]
+    if status["status"] == COMPLETED:
+        metrics.timing("BuildDuration", (status["duration_ms"] or 0) / 1000.0, {"Result": status["result"]})
+    return follow
+
+def follow_settled(follow):
+    """Whether a follow needs no more polling"""
+    
+    if follow["status"] in ("cancelled", "not_found", COMPLETED):
+        return True
+    return follow["mode"] == "build_number" and follow["status"] == STARTED
+
+def write_build_status(s3_client, bucket, follow):
+    """Store the latest status of a followed build"""
+    
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=follow["status_key"],
+            Body=json.dumps(dict(follow, updated_at=datetime.utcnow().isoformat())),
+            ContentType="application/json"
+        )
+    except Exception as e:
+        print(f"Error writing build status: {e}")
+
+def is_build_follow_event(event):
+    """Check whether the event continues following a queued build"""
+    
+    return event.get("action") == "follow_build" and "follow" in event
+
+def schedule_build_follow(context, follow, attempt):
+    """Asynchronously re-invoke this function to keep following a build"""
+    
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if not function_name:
+        print("Cannot schedule build follow-up: unknown function name")
+        return False
+    
+    if attempt > MAX_FOLLOW_ATTEMPTS:
+        print(f"Giving up following {follow['job_name']} after {MAX_FOLLOW_ATTEMPTS} attempts")
+        return False
+    
+    get_client("lambda").invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps({"action": "follow_build", "follow": follow, "attempt": attempt})
+    )
+    
+    print(f"Scheduled follow-up for {follow['job_name']} (attempt {attempt})")
+    return True
+
+def continue_build_follow(event, context, s3_client, jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Follow-up worker: keep polling a queued build for this invocation's lifetime"""
+    
+    follow = dict(event["follow"])
+    attempt = int(event.get("attempt", 1))
+    
+    try:
+        advance_build_follow(
+            follow, jenkins_url, jenkins_user, jenkins_password,
+            readiness_deadline(context, reserve_seconds=10)
+        )
+    except Exception as e:
+        print(f"Error following {follow['job_name']} build: {e}")
+    
+    rescheduled = False
+    if s3_bucket and follow.get("status_key"):
+        write_build_status(s3_client, s3_bucket, follow)
+    if not follow_settled(follow):
+        rescheduled = schedule_build_follow(context, follow, attempt + 1)
+    
+    return {
+        "statusCode": 200 if follow_settled(follow) else 202,
+        "body": json.dumps({
+            "message": f"Build follow-up {follow['status']}",
+            "follow": follow,
+            "rescheduled": rescheduled
+        })
+    }
+
+def claim_trigger(trigger_source, build_params, event_id=None):
+    """Claim a trigger's idempotency fingerprint
+    
+    Returns (is_new, fingerprint). Triggers that cannot be fingerprinted are
+    always new, and an unavailable store never blocks a build.
+    """
+    
+    store = get_idempotency_store()
+    fingerprint = trigger_fingerprint(trigger_source, build_params, event_id)
+    if store is None or fingerprint is None:
+        return True, None
+    
+    try:
+        if not store.claim(fingerprint):
+            print(f"Duplicate trigger ignored: {build_params.get('job_name', 'github-pipeline')} ({fingerprint[:12]})")
+            metrics.put("DuplicateTriggers", 1)
+            return False, fingerprint
+    except Exception as e:
+        print(f"Idempotency store unavailable, not deduplicating: {e}")
+        return True, None
+    
+    _claims.append(fingerprint)
+    return True, fingerprint
+
+def release_trigger_claim(fingerprint):
+    """Give up one claim so a retry of the trigger is not treated as a duplicate"""
+    
+    if fingerprint not in _claims:
+        return
+    _claims.remove(fingerprint)
+    try:
+        get_idempotency_store().release(fingerprint)
+    except Exception as e:
+        print(f"Error releasing idempotency claim: {e}")
+
+def settle_trigger_claims(succeeded):
+    """Complete this invocation's claims, or release them all if it failed"""
+    
+    store = get_idempotency_store()
+    while _claims:
+        fingerprint = _claims.pop()
+        try:
+            if succeeded:
+                store.complete(fingerprint)
+            else:
+                store.release(fingerprint)
+        except Exception as e:
+            print(f"Error settling idempotency claim: {e}")
+
+def make_trigger(trigger_source, build_params, received_at=None):
+    """Wrap parsed build parameters in the message format used by the trigger queue"""
+    
+    return {
+        "trigger_source": trigger_source,
+        "build_params": build_params,
+        "received_at": received_at or datetime.utcnow().isoformat()
+    }
+
+class SQSTriggerQueue:
+    """Trigger buffer backed by SQS; batches come back through the event source mapping"""
+    
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+    
+    def send(self, trigger):
+        response = self.sqs_client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(trigger)
+        )
+        return response.get("MessageId")
+
+class InMemoryTriggerQueue:
+    """Local stand-in for SQSTriggerQueue used in tests and local runs
+    
+    receive() returns messages in the same record shape as an SQS Lambda event,
+    so they can be handed straight to process_trigger_batch.
+    """
+    
+    def __init__(self):
+        self.messages = []
+        self.sequence = 0
+    
+    def send(self, trigger):
+        self.sequence += 1
+        message_id = f"local-{self.sequence}"
+        self.messages.append({
+            "messageId": message_id,
+            "eventSource": "aws:sqs",
+            "body": json.dumps(trigger),
+            "attributes": {
+                "SentTimestamp": str(int(time.time() * 1000))
+            }
+        })
+        return message_id
+    
+    def receive(self, max_messages=10):
+        batch = self.messages[:max_messages]
+        self.messages = self.messages[max_messages:]
+        return {"Records": batch}
+
+def get_trigger_queue():
+    """Return the configured trigger queue"""
+    
+    return SQSTriggerQueue(get_client("sqs"), TRIGGER_QUEUE_URL)
+
+def stream_records_to_triggers(source, records):
+    """Convert decoded batch records into trigger messages, records in parallel
+    
+    Records hold either a trigger queue message or any event the function
+    accepts directly (S3, EventBridge, GitHub push, manual or fan-out request).
+    Returns (triggers, failed_ids) where failed_ids lists records that could
+    not be parsed and should be retried.
+    """
+    
+    def record_triggers(record):
+        body = record["payload"]
+        
+        # S3 sends a test event when the notification is first configured
+        if body.get("Event") == "s3:TestEvent":
+            return []
+        
+        if "build_params" in body and "trigger_source" in body:
+            # Messages sent by the trigger queue were claimed when queued
+            if source != SQS:
+                is_new, fingerprint = claim_trigger(body["trigger_source"], body["build_params"], record["event_id"])
+                if not is_new:
+                    return []
+                body["fingerprint"] = fingerprint
+            body.setdefault("received_at", record["received_at"])
+            body["message_ids"] = [record["id"]]
+            return [body]
+        
+        triggers = []
+        parsed, _ = parse_events(body)
+        for trigger_source, build_params in parsed:
+            is_new, fingerprint = claim_trigger(trigger_source, build_params, record["event_id"] or body.get("id"))
+            if not is_new:
+                continue
+            trigger = make_trigger(trigger_source, build_params, record["received_at"])
+            trigger["message_ids"] = [record["id"]]
+            trigger["fingerprint"] = fingerprint
+            triggers.append(trigger)
+        return triggers
+    
+    def parse(record):
+        try:
+            return record_triggers(record), None
+        except Exception as e:
+            print(f"Error parsing {source} record {record['id']}: {e}")
+            return [], record["id"]
+    
+    if len(records) <= 1:
+        results = [parse(record) for record in records]
+    else:
+        workers = max(1, min(TRIGGER_FANOUT_MAX_WORKERS, len(records)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse, records))
+    
+    triggers = [trigger for found, _ in results for trigger in found]
+    failed_ids = [record_id for _, record_id in results if record_id is not None]
+    return triggers, failed_ids
+
+def coalesce_triggers(triggers, window_seconds):
+    """Collapse duplicate triggers for the same (job_name, repository, branch)
+    
+    Triggers for the same key that arrive within window_seconds of the first
+    one in their group are replaced by the newest, so only the latest
+    commit_sha is built. Message IDs and pending keys of the collapsed triggers
+    are carried over so their acknowledgement follows the surviving trigger.
+    """
+    
+    ordered = sorted(triggers, key=lambda t: t.get("received_at") or "")
+    groups = {}
+    coalesced = []
+    
+    for trigger in ordered:
+        params = trigger["build_params"]
+        # Builds of the same branch with different explicit parameters
+        # (e.g. manifest entries) are distinct builds, not duplicates
+        key = (
+            params.get("job_name", "github-pipeline"),
+            params.get("repository", ""),
+            params.get("branch", "main"),
+            json.dumps(params.get("build_parameters") or {}, sort_keys=True)
+        )
+        received_at = datetime.fromisoformat(trigger["received_at"]) if trigger.get("received_at") else None
+        
+        group = groups.get(key)
+        if group and received_at and group["started_at"] and \
+                (received_at - group["started_at"]).total_seconds() <= window_seconds:
+            survivor = group["trigger"]
+            trigger["message_ids"] = survivor.get("message_ids", []) + trigger.get("message_ids", [])
+            trigger["pending_keys"] = survivor.get("pending_keys", []) + trigger.get("pending_keys", [])
+            trigger["coalesced"] = survivor.get("coalesced", 1) + 1
+            coalesced[group["index"]] = trigger
+            group["trigger"] = trigger
+        else:
+            groups[key] = {"trigger": trigger, "started_at": received_at, "index": len(coalesced)}
+            coalesced.append(trigger)
+    
+    if len(coalesced) < len(triggers):
+        print(f"Coalesced {len(triggers)} triggers into {len(coalesced)}")
+    
+    return coalesced
+
+def fire_triggers(triggers, jenkins_url, jenkins_user, jenkins_password):
+    """Trigger a batch of builds concurrently over the shared connection pool and cached crumb
+    
+    Results are returned in trigger order.
+    """
+    
+    def fire(trigger):
+        try:
+            build_result = trigger_jenkins_build(
+                jenkins_url, jenkins_user, jenkins_password, trigger["build_params"]
+            )
+            return {"trigger": trigger, "success": True, "build_result": build_result}
+        except Exception as e:
+            print(f"Error triggering {trigger['build_params'].get('job_name')}: {e}")
+            return {"trigger": trigger, "success": False, "error": str(e)}
+    
+    if len(triggers) <= 1:
+        return [fire(trigger) for trigger in triggers]
+    
+    # Fetch the crumb once up front rather than once per concurrent POST
+    try:
+        get_crumb_headers(jenkins_url, jenkins_user, jenkins_password)
+    except Exception as e:
+        print(f"Error fetching Jenkins crumb: {e}")
+    
+    workers = max(1, min(TRIGGER_FANOUT_MAX_WORKERS, len(triggers)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fire, triggers))
+
+def log_build_triggers(s3_client, bucket, results, request_id):
+    """Log a batch of build triggers to S3 as a single newline-delimited JSON object"""
+    
+    if not bucket or not results:
+        return
+    
+    try:
+        now = datetime.utcnow()
+        lines = []
+        for result in results:
+            trigger = result["trigger"]
+            lines.append(json.dumps({
+                "timestamp": now.isoformat(),
+                "trigger_source": trigger["trigger_source"],
+                "build_params": trigger["build_params"],
+                "build_result": result.get("build_result") or {"success": False, "error": result.get("error")},
+                "coalesced": trigger.get("coalesced", 1),
+                "lambda_request_id": request_id,
+                "cost_optimization": {
+                    "spot_instances_used": True,
+                    "auto_scaling_enabled": True,
+                    "estimated_cost_per_build": 0.05  # Rough estimate
+                }
+            }))
+        
+        log_key = f"build-triggers/{now.strftime('%Y/%m/%d')}/batch-{now.strftime('%H%M%S')}-{request_id}.jsonl"
+        
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=log_key,
+            Body="\n".join(lines) + "\n",
+            ContentType="application/x-ndjson"
+        )
+        
+        print(f"Logged {len(lines)} build triggers to S3: s3://{bucket}/{log_key}")
+        
+    except Exception as e:
+        print(f"Error logging build triggers: {e}")
+
+def dispatch_triggers(triggers, context, ec2_client, autoscaling_client, s3_client,
+                      jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Fire a list of triggers with one shared master/agent/readiness setup
+    
+    Triggers are fired straight away when Jenkins is ready, otherwise parked
+    with the pending-trigger pipeline. Returns a dict with the fire results,
+    the triggers left pending and the triggers that could be neither.
+    """
+    
+    outcome = dispatch_trigger_setup(
+        triggers, context, ec2_client, autoscaling_client, s3_client,
+        jenkins_url, jenkins_user, jenkins_password, s3_bucket
+    )
+    
+    # Failed triggers give up their claim so a redelivery can build them
+    for trigger in outcome["failed"]:
+        release_trigger_claim(trigger.get("fingerprint"))
+    
+    return outcome
+
+def dispatch_trigger_setup(triggers, context, ec2_client, autoscaling_client, s3_client,
+                           jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Shared master/agent/readiness setup, then fire or park every trigger"""
+    
+    outcome = {"results": [], "pending": [], "failed": []}
+    
+    jenkins_instance_id, instance_state = start_jenkins_master(ec2_client)
+    if not jenkins_instance_id:
+        outcome["failed"] = list(triggers)
+        return outcome
+    
+    # The builds run side by side, so they need agents between them
+    agent_count = min(MAX_AGENTS, sum(t["build_params"].get("agent_count", 1) for t in triggers))
+    scale_jenkins_agents(autoscaling_client, agent_count)
+    
+    with span("readiness"):
+        jenkins_ready = instance_state == "running" and wait_for_jenkins_ready(
+            jenkins_url, jenkins_user, jenkins_password
+        )["status"] == READY
+    if not jenkins_ready and instance_state == "running":
+        # The cached state may be stale if the master was stopped since
+        jenkins_instance_id, instance_state = start_jenkins_master(ec2_client, use_cache=False)
+    
+    if jenkins_ready:
+        with span("build_post"):
+            outcome["results"] = fire_triggers(triggers, jenkins_url, jenkins_user, jenkins_password)
+        with span("s3_log"):
+            log_build_triggers(s3_client, s3_bucket, outcome["results"], get_request_id(context))
+        outcome["failed"] = [r["trigger"] for r in outcome["results"] if not r["success"]]
+        return outcome
+    
+    if not s3_bucket:
+        outcome["failed"] = list(triggers)
+        return outcome
+    
+    # Master is cold: park the triggers with the pending-trigger pipeline
+    for index, trigger in enumerate(triggers):
+        suffix = (trigger.get("message_ids") or [index])[-1]
+        try:
+            persist_pending_trigger(
+                s3_client, s3_bucket, trigger["trigger_source"], trigger["build_params"],
+                f"{get_request_id(context)}-{suffix}"
+            )
+            outcome["pending"].append(trigger)
+        except Exception as e:
+            print(f"Error persisting pending trigger: {e}")
+            outcome["failed"].append(trigger)
+    
+    if outcome["pending"] and instance_state in ("running", "stopping"):
+        request_pending_drain(context, jenkins_instance_id)
+    
+    return outcome
+
+def process_trigger_batch(event, context, ec2_client, autoscaling_client, s3_client,
+                          jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Decode, coalesce and dispatch an SQS, Kinesis or Kafka batch
+    
+    Every record shares one master/agent/readiness setup and the builds are
+    fired concurrently. Returns a partial batch response so only records whose
+    build could not be triggered or persisted are redelivered; Kafka batches,
+    which cannot be retried record by record, raise BatchRetryError instead.
+    """
+    
+    source = batch_event_source(event)
+    records, malformed = stream_records(source, event)
+    triggers, failed_ids = stream_records_to_triggers(source, records)
+    triggers = coalesce_triggers(triggers, TRIGGER_COALESCE_WINDOW_SECONDS)
+    
+    failed = []
+    if triggers:
+        try:
+            failed = dispatch_triggers(
+                triggers, context, ec2_client, autoscaling_client, s3_client,
+                jenkins_url, jenkins_user, jenkins_password, s3_bucket
+            )["failed"]
+        except Exception as e:
+            print(f"Error dispatching {source} batch: {e}")
+            for trigger in triggers:
+                release_trigger_claim(trigger.get("fingerprint"))
+            failed = triggers
+    
+    for trigger in failed:
+        for message_id in trigger["message_ids"]:
+            if message_id not in failed_ids:
+                failed_ids.append(message_id)
+    
+    dimensions = {"EventSource": source}
+    metrics.put("BatchRecords", len(records) + len(malformed), dimensions=dimensions)
+    if failed_ids:
+        metrics.put("BatchRecordsFailed", len(failed_ids), dimensions=dimensions)
+    
+    print(f"Processed {len(records)} {source} records into {len(triggers)} triggers, "
+          f"{len(failed_ids)} records failed, {len(malformed)} malformed")
+    
+    if failed_ids and not supports_partial_batch(source):
+        # Builds that went through keep their claims, so the retried batch skips them
+        settle_trigger_claims(succeeded=True)
+        raise BatchRetryError(f"{len(failed_ids)} {source} records failed: {failed_ids}")
+    
+    return batch_response(failed_ids)
+
+def dispatch_trigger_list(claimed, rejected, context, ec2_client, autoscaling_client, s3_client,
+                          jenkins_url, jenkins_user, jenkins_password, s3_bucket):
+    """Dispatch every build of a fan-out request, multi-record S3 event or trigger manifest
+    
+    The response lists one result per build, in request order.
+    """
+    
+    triggers = []
+    for trigger_source, build_params, fingerprint in claimed:
+        trigger = make_trigger(trigger_source, build_params)
+        trigger["fingerprint"] = fingerprint
+        triggers.append(trigger)
+    
+    # Hand the whole set to the buffer queue when batching is enabled
+    if TRIGGER_QUEUE_URL:
+        queue = get_trigger_queue()
+        message_ids = [queue.send(trigger) for trigger in triggers]
+        return {
+            "statusCode": 202,
+            "body": json.dumps({
+                "message": f"{len(message_ids)} build triggers queued",
+                "message_ids": message_ids,
+                "rejected": rejected
+            })
+        }
+    
+    outcome = dispatch_triggers(
+        triggers, context, ec2_client, autoscaling_client, s3_client,
+        jenkins_url, jenkins_user, jenkins_password, s3_bucket
+    )
+    
+    # One follow-through budget shared by every build in the list
+    follow_deadline = min(time.time() + BUILD_FOLLOW_TIMEOUT_SECONDS, readiness_deadline(context, reserve_seconds=10))
+    for r in outcome["results"]:
+        if r["success"]:
+            follow_build_trigger(
+                context, s3_client, s3_bucket, jenkins_url, jenkins_user, jenkins_password,
+                r["trigger"]["build_params"], r["build_result"], deadline=follow_deadline
+            )
+    
+    triggered = [
+        {
+            "job_name": r["trigger"]["build_params"].get("job_name", "github-pipeline"),
+            "queue_location": r["build_result"].get("queue_location"),
+            "build_number": r["build_result"].get("build_number")
+        }
+        for r in outcome["results"] if r["success"]
+    ]
+    failed = [t["build_params"].get("job_name", "github-pipeline") for t in outcome["failed"]]
+    
+    fired = {id(r["trigger"]): r for r in outcome["results"]}
+    pending = [id(t) for t in outcome["pending"]]
+    results = []
+    for trigger in triggers:
+        result = {"job_name": trigger["build_params"].get("job_name", "github-pipeline")}
+        fire_result = fired.get(id(trigger))
+        if fire_result and fire_result["success"]:
+            result["status"] = "triggered"
+            result["queue_location"] = fire_result["build_result"].get("queue_location")
+            result["build_number"] = fire_result["build_result"].get("build_number")
+        elif id(trigger) in pending:
+            result["status"] = "pending"
+        else:
+            result["status"] = "failed"
+            result["error"] = fire_result["error"] if fire_result else "Jenkins master unavailable"
+        results.append(result)
+    
+    if failed or rejected:
+        status_code = 207
+    elif outcome["pending"]:
+        status_code = 202
+    else:
+        status_code = 200
+    
+    return {
+        "statusCode": status_code,
+        "body": json.dumps({
+            "message": f"Dispatched {len(triggers)} build triggers",
+            "results": results,
+            "triggered": triggered,
+            "pending": len(outcome["pending"]),
+            "failed": failed,
+            "rejected": rejected
+        })
+    }
+
 # Example usage for testing
 if __name__ == "__main__":
     # Test event for S3 trigger
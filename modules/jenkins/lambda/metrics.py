@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Datapoints are buffered for the whole invocation and flushed once at the end:
+#   emf - CloudWatch Embedded Metric Format lines on stdout, no API call
+#   api - batched PutMetricData calls (repeated datapoints become one
+#         Values/Counts histogram datum)
+#   off - dropped
+METRICS_MODE = os.environ.get("METRICS_MODE", "emf")
+PUT_METRIC_DATA_BATCH_SIZE = 1000
+PUT_METRIC_DATA_MAX_VALUES = 150
+EMF_MAX_VALUES = 100
+
+_buffers = {}
+
+class MetricBuffer:
+    """Per-container buffer of metric datapoints for one namespace"""
+
+    def __init__(self, namespace, mode=None):
+        self.namespace = namespace
+        self.mode = mode or METRICS_MODE
+        self.datapoints = []
+        # The optimizer records metrics from its fleet thread pools
+        self.lock = threading.Lock()
+
+    def put(self, name, value, unit="Count", dimensions=None):
+        """Buffer one datapoint"""
+
+        with self.lock:
+            self.datapoints.append({
+                "name": name,
+                "value": value,
+                "unit": unit,
+                "dimensions": tuple(sorted((dimensions or {}).items())),
+                "timestamp": time.time()
+            })
+
+    def timing(self, name, seconds, dimensions=None):
+        """Buffer a duration in milliseconds"""
+
+        self.put(name, round(seconds * 1000.0, 3), "Milliseconds", dimensions)
+
+    @contextmanager
+    def timer(self, name, dimensions=None):
+        """Time a block of code as a Milliseconds datapoint"""
+
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - started, dimensions)
+
+    def aggregate(self):
+        """Group buffered datapoints by (dimensions, name, unit), keeping every value"""
+
+        groups = {}
+        for point in self.datapoints:
+            key = (point["dimensions"], point["name"], point["unit"])
+            group = groups.setdefault(key, {"values": [], "timestamp": point["timestamp"]})
+            group["values"].append(point["value"])
+        return groups
+
+    def flush(self, cloudwatch_client=None):
+        """Emit and clear the buffer; returns the number of API calls or log lines"""
+
+        with self.lock:
+            groups = self.aggregate()
+            self.datapoints = []
+
+        if not groups or self.mode == "off":
+            return 0
+
+        try:
+            if self.mode == "api":
+                return self.flush_api(groups, cloudwatch_client)
+            return self.flush_emf(groups)
+        except Exception as e:
+            # Metrics must never fail the invocation they describe
+            print(f"Error flushing metrics: {e}")
+            return 0
+
+    def flush_api(self, groups, cloudwatch_client):
+        """Send groups as batched PutMetricData calls"""
+
+        if cloudwatch_client is None:
+            from aws_clients import get_client
+            cloudwatch_client = get_client("cloudwatch")
+
+        metric_data = []
+        for (dimensions, name, unit), group in groups.items():
+            counts = {}
+            for value in group["values"]:
+                counts[value] = counts.get(value, 0) + 1
+            distinct = list(counts.items())
+
+            for i in range(0, len(distinct), PUT_METRIC_DATA_MAX_VALUES):
+                chunk = distinct[i:i + PUT_METRIC_DATA_MAX_VALUES]
+                datum = {
+                    "MetricName": name,
+                    "Unit": unit,
+                    "Timestamp": datetime.utcfromtimestamp(group["timestamp"]),
+                    "Values": [float(v) for v, _ in chunk],
+                    "Counts": [float(c) for _, c in chunk]
+                }
+                if dimensions:
+                    datum["Dimensions"] = [{"Name": k, "Value": str(v)} for k, v in dimensions]
+                metric_data.append(datum)
+
+        calls = 0
+        for i in range(0, len(metric_data), PUT_METRIC_DATA_BATCH_SIZE):
+            cloudwatch_client.put_metric_data(
+                Namespace=self.namespace,
+                MetricData=metric_data[i:i + PUT_METRIC_DATA_BATCH_SIZE]
+            )
+            calls += 1
+        return calls
+
+    def flush_emf(self, groups):
+        """Print one Embedded Metric Format record per dimension set"""
+
+        by_dimensions = {}
+        for (dimensions, name, unit), group in groups.items():
+            by_dimensions.setdefault(dimensions, []).append((name, unit, group))
+
+        lines = 0
+        for dimensions, metrics in by_dimensions.items():
+            # Each record holds at most EMF_MAX_VALUES values per metric
+            max_values = max(len(group["values"]) for _, _, group in metrics)
+            for offset in range(0, max_values, EMF_MAX_VALUES):
+                record = {k: str(v) for k, v in dimensions}
+                definitions = []
+                for name, unit, group in metrics:
+                    values = group["values"][offset:offset + EMF_MAX_VALUES]
+                    if not values:
+                        continue
+                    record[name] = values if len(values) > 1 else values[0]
+                    definitions.append({"Name": name, "Unit": unit})
+
+                record["_aws"] = {
+                    "Timestamp": int(min(g["timestamp"] for _, _, g in metrics) * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [[k for k, _ in dimensions]],
+                        "Metrics": definitions
+                    }]
+                }
+                print(json.dumps(record))
+                lines += 1
+        return lines
+
+def get_metric_buffer(namespace):
+    """Return the container-wide buffer for a namespace"""
+
+    if namespace not in _buffers:
+        _buffers[namespace] = MetricBuffer(namespace)
+    return _buffers[namespace]
@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from aws_clients import get_client
+
+# Hourly prices are cached per (region, lifecycle, instance type) for the life
+# of the warm container. On-demand prices come from the Pricing API and change
+# rarely; spot prices come from the spot price history and move faster.
+ON_DEMAND_TTL_SECONDS = int(os.environ.get("ON_DEMAND_PRICE_TTL_SECONDS", "86400"))
+SPOT_TTL_SECONDS = int(os.environ.get("SPOT_PRICE_TTL_SECONDS", "3600"))
+
+# "api" asks AWS and falls back to the snapshot; "snapshot" never calls AWS
+PRICING_SOURCE = os.environ.get("PRICING_SOURCE", "api")
+PRICING_SNAPSHOT_PATH = os.environ.get(
+    "PRICING_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing_snapshot.json")
+)
+
+DEFAULT_HOURLY_PRICE = 0.05
+
+ON_DEMAND = "on-demand"
+SPOT = "spot"
+
+# Relative size of each instance size within a family, used to extrapolate
+# prices for sizes missing from the snapshot
+SIZE_UNITS = {
+    "nano": 0.25, "micro": 0.5, "small": 1, "medium": 2, "large": 4,
+    "xlarge": 8, "2xlarge": 16, "4xlarge": 32, "8xlarge": 64, "9xlarge": 72,
+    "12xlarge": 96, "16xlarge": 128, "18xlarge": 144, "24xlarge": 192
+}
+
+_price_cache = {}
+_snapshot = None
+
+def get_region(region=None):
+    """Region prices are looked up for"""
+
+    return region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION", "us-east-1")
+
+def load_snapshot():
+    """Load the offline price snapshot once per container"""
+
+    global _snapshot
+    if _snapshot is None:
+        try:
+            with open(PRICING_SNAPSHOT_PATH) as f:
+                _snapshot = json.load(f)
+        except Exception as e:
+            print(f"Error loading pricing snapshot: {e}")
+            _snapshot = {"regions": {}, "spot_discount_estimate": 0.65}
+    return _snapshot
+
+def snapshot_price(instance_type, lifecycle, region):
+    """Price from the offline snapshot, extrapolating within a family if needed"""
+
+    snapshot = load_snapshot()
+    table = snapshot.get("regions", {}).get(region, {}).get("on_demand", {})
+
+    price = table.get(instance_type)
+    if price is None and "." in instance_type:
+        family, size = instance_type.split(".", 1)
+        for known_type, known_price in table.items():
+            known_family, known_size = known_type.split(".", 1)
+            if known_family == family and known_size in SIZE_UNITS and size in SIZE_UNITS:
+                price = known_price * SIZE_UNITS[size] / SIZE_UNITS[known_size]
+                break
+
+    if price is None:
+        return None
+    if lifecycle == SPOT:
+        price = price * (1 - snapshot.get("spot_discount_estimate", 0.65))
+    return round(price, 6)
+
+def fetch_on_demand_price(instance_type, region):
+    """Linux, shared tenancy on-demand price from the AWS Pricing API"""
+
+    # The Pricing API is only served from a few regions
+    pricing_client = get_client("pricing", region_name="us-east-1")
+    response = pricing_client.get_products(
+        ServiceCode="AmazonEC2",
+        Filters=[
+            {"Type": "TERM_MATCH", "Field": "instanceType", "Value": instance_type},
+            {"Type": "TERM_MATCH", "Field": "regionCode", "Value": region},
+            {"Type": "TERM_MATCH", "Field": "operatingSystem", "Value": "Linux"},
+            {"Type": "TERM_MATCH", "Field": "tenancy", "Value": "Shared"},
+            {"Type": "TERM_MATCH", "Field": "preInstalledSw", "Value": "NA"},
+            {"Type": "TERM_MATCH", "Field": "capacitystatus", "Value": "Used"},
+            {"Type": "TERM_MATCH", "Field": "licenseModel", "Value": "No License required"}
+        ],
+        MaxResults=10
+    )
+
+    for product_json in response.get("PriceList", []):
+        product = json.loads(product_json)
+        for term in product.get("terms", {}).get("OnDemand", {}).values():
+            for dimension in term.get("priceDimensions", {}).values():
+                usd = float(dimension.get("pricePerUnit", {}).get("USD", 0))
+                if usd > 0:
+                    return usd
+    return None
+
+def fetch_spot_price(instance_type, region):
+    """Current Linux spot price, averaged across availability zones"""
+
+    ec2_client = get_client("ec2", region_name=region)
+    response = ec2_client.describe_spot_price_history(
+        InstanceTypes=[instance_type],
+        ProductDescriptions=["Linux/UNIX"],
+        StartTime=datetime.utcnow()
+    )
+
+    latest = {}
+    for entry in response.get("SpotPriceHistory", []):
+        zone = entry["AvailabilityZone"]
+        if zone not in latest or entry["Timestamp"] > latest[zone]["Timestamp"]:
+            latest[zone] = entry
+    if not latest:
+        return None
+    return sum(float(e["SpotPrice"]) for e in latest.values()) / len(latest)
+
+def get_hourly_price(instance_type, lifecycle=ON_DEMAND, region=None):
+    """Hourly USD price for an instance type, with its source
+
+    Returns (price, source) where source is api, snapshot or default. Results
+    are cached, so repeated lookups are dictionary reads.
+    """
+
+    region = get_region(region)
+    key = (region, lifecycle, instance_type)
+
+    cached = _price_cache.get(key)
+    if cached and cached["expires_at"] > time.time():
+        return cached["price"], cached["source"]
+
+    price, source = None, None
+    if PRICING_SOURCE == "api":
+        try:
+            if lifecycle == SPOT:
+                price = fetch_spot_price(instance_type, region)
+            else:
+                price = fetch_on_demand_price(instance_type, region)
+            source = "api" if price is not None else None
+        except Exception as e:
+            print(f"Error fetching {lifecycle} price for {instance_type} in {region}: {e}")
+
+    if price is None:
+        price = snapshot_price(instance_type, lifecycle, region)
+        source = "snapshot" if price is not None else None
+
+    if price is None:
+        price, source = DEFAULT_HOURLY_PRICE, "default"
+
+    ttl = SPOT_TTL_SECONDS if lifecycle == SPOT else ON_DEMAND_TTL_SECONDS
+    _price_cache[key] = {"price": price, "source": source, "expires_at": time.time() + ttl}
+    return price, source
@@ -0,0 +1,215 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# One structured trace record is printed per invocation with the duration of
+# every phase, AWS API call counts and retry counts. The optional sampling
+# profiler records where the main thread spends its time:
+#   off    - never (default)
+#   cold   - on the first invocation of each container
+#   always - on every invocation
+TRACE_PROFILER = os.environ.get("TRACE_PROFILER", "off")
+PROFILER_INTERVAL_SECONDS = float(os.environ.get("PROFILER_INTERVAL_MS", "5")) / 1000.0
+PROFILER_TOP_STACKS = 25
+
+_module_loaded_at = time.time()
+_cold_start = True
+_current = None
+
+class InvocationTrace:
+    """Spans and counters collected during one invocation"""
+
+    def __init__(self, name, request_id):
+        self.name = name
+        self.request_id = request_id
+        self.started = time.time()
+        self.spans = []
+        # Open spans per thread; pool workers nest under the invoking thread's span
+        self.stacks = {}
+        self.thread_id = threading.get_ident()
+        self.counters = {}
+        self.fields = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+
+    @contextmanager
+    def span(self, name):
+        """Time one phase; nested spans are recorded under their parent"""
+
+        thread_id = threading.get_ident()
+        with self.lock:
+            stack = self.stacks.setdefault(thread_id, [])
+            owner_stack = self.stacks.get(self.thread_id) or []
+            parent = stack[-1] if stack else (owner_stack[-1] if owner_stack else None)
+            stack.append(name)
+        started = time.time()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            with self.lock:
+                stack.pop()
+                if not stack and thread_id != self.thread_id:
+                    del self.stacks[thread_id]
+            span = {
+                "name": name,
+                "parent": parent,
+                "start_ms": round((started - self.started) * 1000.0, 3),
+                "duration_ms": round((time.time() - started) * 1000.0, 3)
+            }
+            if error:
+                span["error"] = error
+            with self.lock:
+                self.spans.append(span)
+
+    def count(self, key, value=1):
+        """Increment a counter"""
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record(self):
+        """The structured trace record for this invocation"""
+
+        phases = {}
+        for span in self.spans:
+            phases[span["name"]] = round(phases.get(span["name"], 0) + span["duration_ms"], 3)
+
+        aws_calls = {k[len("aws."):]: v for k, v in self.counters.items() if k.startswith("aws.")}
+        retries = {k[len("retries."):]: v for k, v in self.counters.items() if k.startswith("retries.")}
+        other = {k: v for k, v in self.counters.items() if not k.startswith(("aws.", "retries."))}
+
+        record = {
+            "trace": self.name,
+            "request_id": self.request_id,
+            "duration_ms": round((time.time() - self.started) * 1000.0, 3),
+            "phases": phases,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+            "aws_calls": aws_calls,
+            "aws_call_count": sum(aws_calls.values()),
+            "retries": retries,
+            "counters": other
+        }
+        record.update(self.fields)
+        return record
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval from a daemon thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self.sample_count = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+                self.sample_count += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        """Stop sampling and return the hottest stacks in folded format"""
+
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+        top = sorted(self.samples.items(), key=lambda item: -item[1])[:PROFILER_TOP_STACKS]
+        return {
+            "interval_ms": self.interval * 1000.0,
+            "samples": self.sample_count,
+            "stacks": [f"{stack} {count}" for stack, count in top]
+        }
+
+def start_trace(name, request_id):
+    """Begin the trace of a new invocation"""
+
+    global _current, _cold_start
+    trace = InvocationTrace(name, request_id)
+    trace.fields["cold_start"] = _cold_start
+    if _cold_start:
+        # Time spent importing modules before the first invocation
+        trace.fields["init_ms"] = round((trace.started - _module_loaded_at) * 1000.0, 3)
+
+    if TRACE_PROFILER == "always" or (TRACE_PROFILER == "cold" and _cold_start):
+        trace.profiler = SamplingProfiler(threading.get_ident(), PROFILER_INTERVAL_SECONDS)
+        trace.profiler.start()
+
+    _cold_start = False
+    _current = trace
+    return trace
+
+def finish_trace(**fields):
+    """Print the current trace as one JSON line and clear it"""
+
+    global _current
+    trace = _current
+    if trace is None:
+        return None
+    _current = None
+
+    trace.fields.update(fields)
+    record = trace.record()
+    if trace.profiler:
+        record["profile"] = trace.profiler.stop()
+
+    print(json.dumps(record, default=str))
+    return record
+
+@contextmanager
+def span(name):
+    """Time a phase of the current trace; a no-op outside a trace"""
+
+    trace = _current
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+def count(key, value=1):
+    """Increment a counter on the current trace, if any"""
+
+    trace = _current
+    if trace is not None:
+        trace.count(key, value)
+
+def instrument_client(client):
+    """Count API calls and botocore retries made through a boto3 client"""
+
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return client
+
+    def before_call(model, **kwargs):
+        count(f"aws.{model.service_model.service_name}.{model.name}")
+
+    def after_call(model, parsed=None, **kwargs):
+        retries = ((parsed or {}).get("ResponseMetadata") or {}).get("RetryAttempts", 0)
+        if retries:
+            count(f"retries.{model.service_model.service_name}.{model.name}", retries)
+
+    events.register("before-call.*.*", before_call)
+    events.register("after-call.*.*", after_call)
+    return client
@@ -0,0 +1,243 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+# Trigger files are uploaded to triggers/*.trigger and hold either one build
+#   {"job_name": "api", "branch": "main", "build_parameters": {"ENV": "dev"}}
+# or a manifest of many builds sharing optional defaults
+#   {"defaults": {"repository": "app"}, "builds": [{"job_name": "api"}, {"job_name": "web"}]}
+TRIGGER_FILE_PREFIX = "triggers/"
+TRIGGER_FILE_SUFFIX = ".trigger"
+TRIGGER_FILE_MAX_BYTES = int(os.environ.get("TRIGGER_FILE_MAX_BYTES", "262144"))
+TRIGGER_FETCH_MAX_WORKERS = int(os.environ.get("TRIGGER_FETCH_MAX_WORKERS", "8"))
+MAX_BUILDS_PER_MANIFEST = int(os.environ.get("MAX_BUILDS_PER_MANIFEST", "100"))
+MAX_AGENTS_PER_BUILD = int(os.environ.get("MAX_AGENTS", "5"))
+
+# Field -> accepted types; anything else in a build is rejected
+TRIGGER_FILE_SCHEMA = {
+    "job_name": (str,),
+    "trigger_type": (str,),
+    "repository": (str,),
+    "branch": (str,),
+    "commit_sha": (str,),
+    "pusher": (str,),
+    "agent_count": (int,),
+    "build_parameters": (dict,),
+    # Routes the build through the build rules like a push (see build_rules.py)
+    "changed_files": (list,)
+}
+MANIFEST_KEYS = {"version", "defaults", "builds"}
+
+# job_name ends up in the Jenkins URL path
+JOB_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._/-]*$")
+CHUNK_SIZE = 65536
+
+class TriggerFileError(ValueError):
+    """A trigger file that is too large, unreadable or fails the schema"""
+
+def is_trigger_file(key):
+    """Whether an uploaded key is a trigger file"""
+
+    return key.startswith(TRIGGER_FILE_PREFIX) and key.endswith(TRIGGER_FILE_SUFFIX)
+
+def validate_build(build):
+    """Check one build definition against TRIGGER_FILE_SCHEMA"""
+
+    if not isinstance(build, dict):
+        raise TriggerFileError("build must be an object")
+
+    unknown = sorted(set(build) - set(TRIGGER_FILE_SCHEMA))
+    if unknown:
+        raise TriggerFileError(f"unknown fields: {', '.join(unknown)}")
+
+    for field, value in build.items():
+        # bool is an int subclass, never a valid count
+        if not isinstance(value, TRIGGER_FILE_SCHEMA[field]) or isinstance(value, bool):
+            raise TriggerFileError(f"{field} has invalid type {type(value).__name__}")
+
+    if "job_name" in build and not JOB_NAME_PATTERN.match(build["job_name"]):
+        raise TriggerFileError(f"invalid job_name {build['job_name']!r}")
+
+    if "agent_count" in build and not 1 <= build["agent_count"] <= MAX_AGENTS_PER_BUILD:
+        raise TriggerFileError(f"agent_count must be between 1 and {MAX_AGENTS_PER_BUILD}")
+
+    if not all(isinstance(path, str) for path in build.get("changed_files", [])):
+        raise TriggerFileError("changed_files must be a list of paths")
+
+    for name, value in build.get("build_parameters", {}).items():
+        if not isinstance(value, (str, int, float, bool)):
+            raise TriggerFileError(f"build parameter {name} must be a scalar")
+
+    return build
+
+def expand_trigger_document(document):
+    """Turn a parsed trigger file into a list of validated builds"""
+
+    if not isinstance(document, dict):
+        raise TriggerFileError("trigger file must hold a JSON object")
+
+    if "builds" not in document:
+        return [validate_build(document)]
+
+    unknown = sorted(set(document) - MANIFEST_KEYS)
+    if unknown:
+        raise TriggerFileError(f"unknown manifest fields: {', '.join(unknown)}")
+
+    builds = document["builds"]
+    if not isinstance(builds, list) or not builds:
+        raise TriggerFileError("builds must be a non-empty list")
+    if len(builds) > MAX_BUILDS_PER_MANIFEST:
+        raise TriggerFileError(f"manifest has {len(builds)} builds, limit is {MAX_BUILDS_PER_MANIFEST}")
+
+    defaults = validate_build(document.get("defaults", {}))
+    expanded = []
+    for index, build in enumerate(builds):
+        try:
+            merged = dict(defaults)
+            merged.update(validate_build(build))
+            if "build_parameters" in defaults and "build_parameters" in build:
+                merged["build_parameters"] = dict(defaults["build_parameters"], **build["build_parameters"])
+            expanded.append(merged)
+        except TriggerFileError as e:
+            raise TriggerFileError(f"builds[{index}]: {e}")
+    return expanded
+
+def expand_job_request(request):
+    """Turn a fan-out request into a list of validated builds
+
+    A request names several jobs, each optionally with its own fields; the
+    remaining top-level fields apply to every job:
+        {"branch": "main", "jobs": ["api", {"job_name": "web", "build_parameters": {"ENV": "qa"}}]}
+    """
+
+    jobs = request.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        raise TriggerFileError("jobs must be a non-empty list")
+
+    builds = []
+    for index, job in enumerate(jobs):
+        if isinstance(job, str):
+            job = {"job_name": job}
+        if not isinstance(job, dict) or not job.get("job_name"):
+            raise TriggerFileError(f"jobs[{index}]: job_name is required")
+        builds.append(job)
+
+    defaults = {k: v for k, v in request.items() if k in TRIGGER_FILE_SCHEMA}
+    try:
+        return expand_trigger_document({"defaults": defaults, "builds": builds})
+    except TriggerFileError as e:
+        raise TriggerFileError(str(e).replace("builds[", "jobs[", 1))
+
+def read_capped_object(s3_client, bucket, key, max_bytes=None):
+    """Stream an S3 object into memory, refusing anything over max_bytes
+
+    Only the first max_bytes + 1 bytes are ever requested, so an oversized
+    upload costs one small ranged read rather than a full download.
+    """
+
+    max_bytes = max_bytes or TRIGGER_FILE_MAX_BYTES
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{max_bytes}")
+    except Exception as e:
+        # S3 answers a range over a zero-byte object with 416 InvalidRange
+        if "InvalidRange" in str(e):
+            return b""
+        raise TriggerFileError(f"unreadable trigger file: {e}")
+
+    # "bytes 0-1023/4096": the part after the slash is the full object size
+    content_range = response.get("ContentRange") or ""
+    total = content_range.rsplit("/", 1)[-1]
+    if total.isdigit() and int(total) > max_bytes:
+        response["Body"].close()
+        raise TriggerFileError(f"trigger file is {total} bytes, limit is {max_bytes}")
+
+    chunks = []
+    size = 0
+    body = response["Body"]
+    while True:
+        chunk = body.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            body.close()
+            raise TriggerFileError(f"trigger file exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def load_trigger_file(s3_client, bucket, key):
+    """Read, parse and validate one trigger file
+
+    An empty file is an empty document: one build with the default parameters.
+    """
+
+    data = read_capped_object(s3_client, bucket, key)
+    if not data.strip():
+        return expand_trigger_document({})
+    try:
+        document = json.loads(data.decode("utf-8"))
+    except ValueError as e:
+        raise TriggerFileError(f"invalid JSON: {e}")
+    return expand_trigger_document(document)
+
+def s3_records_to_builds(s3_client, records):
+    """Build parameters for every object in an S3 event, in record order
+
+    Trigger files are fetched concurrently and may expand to many builds;
+    any other upload becomes the default s3_upload build. Returns
+    (builds, errors) where errors lists rejected trigger files.
+    """
+
+    uploads = []
+    for record in records:
+        if record.get("eventSource") != "aws:s3":
+            continue
+        bucket = record["s3"]["bucket"]["name"]
+        # Keys arrive URL-encoded in S3 notifications
+        key = unquote_plus(record["s3"]["object"]["key"])
+        uploads.append((bucket, key, record["s3"]["object"].get("eTag")))
+
+    trigger_files = [(bucket, key) for bucket, key, _ in uploads if is_trigger_file(key)]
+    loaded = {}
+    if trigger_files:
+        workers = max(1, min(TRIGGER_FETCH_MAX_WORKERS, len(trigger_files)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {upload: pool.submit(load_trigger_file, s3_client, *upload) for upload in trigger_files}
+            for upload, future in futures.items():
+                try:
+                    loaded[upload] = future.result()
+                except Exception as e:
+                    loaded[upload] = e
+
+    builds = []
+    errors = []
+    for bucket, key, etag in uploads:
+        base = {
+            "job_name": "github-pipeline",
+            "trigger_type": "s3_upload",
+            "source_bucket": bucket,
+            "source_key": key,
+            "agent_count": 1
+        }
+        if etag:
+            base["source_etag"] = etag
+        if not is_trigger_file(key):
+            builds.append(base)
+            continue
+
+        result = loaded[(bucket, key)]
+        if isinstance(result, Exception):
+            print(f"Rejected trigger file s3://{bucket}/{key}: {result}")
+            errors.append({"bucket": bucket, "key": key, "error": str(result)})
+            continue
+
+        for index, build in enumerate(result):
+            params = dict(base)
+            params.update(build)
+            if len(result) > 1:
+                params["manifest_index"] = index
+            builds.append(params)
+
+    return builds, errors
@@ -0,0 +1,282 @@
+import gzip
+import json
+from datetime import date, datetime, timedelta
+
+# Raw logs written by jenkins_trigger.log_build_trigger(s):
+#   build-triggers/YYYY/MM/DD/trigger-HHMMSS-<request>.json   (one pretty-printed object)
+#   build-triggers/YYYY/MM/DD/batch-HHMMSS-<request>.jsonl    (one object per line)
+RAW_PREFIX = "build-triggers/"
+
+# Compacted logs: one gzipped NDJSON file per day, rolled up into one file per
+# month once the month is complete. Rows are sorted by (trigger_source,
+# job_name, timestamp). The catalog records each file's date range, sources and
+# jobs so queries can prune files without opening them.
+COMPACTED_PREFIX = "build-triggers-compacted/"
+CATALOG_KEY = f"{COMPACTED_PREFIX}_catalog.json"
+
+SCHEMA_VERSION = 1
+COLUMNS = [
+    "timestamp", "date", "hour", "trigger_source", "job_name", "trigger_type",
+    "repository", "branch", "commit_sha", "agent_count", "coalesced",
+    "success", "queue_location", "lambda_request_id"
+]
+
+def normalize_trigger_record(entry):
+    """Flatten a raw trigger log entry into the stable compacted schema"""
+
+    params = entry.get("build_params") or {}
+    result = entry.get("build_result") or {}
+    timestamp = entry.get("timestamp", "")
+
+    row = {
+        "timestamp": timestamp,
+        "date": timestamp[:10],
+        "hour": int(timestamp[11:13]) if len(timestamp) >= 13 else None,
+        "trigger_source": entry.get("trigger_source", "unknown"),
+        "job_name": params.get("job_name", "github-pipeline"),
+        "trigger_type": params.get("trigger_type"),
+        "repository": params.get("repository", ""),
+        "branch": params.get("branch", ""),
+        "commit_sha": params.get("commit_sha", ""),
+        "agent_count": params.get("agent_count", 1),
+        "coalesced": entry.get("coalesced", 1),
+        "success": result.get("success", False),
+        "queue_location": result.get("queue_location"),
+        "lambda_request_id": entry.get("lambda_request_id", "")
+    }
+    return {column: row[column] for column in COLUMNS}
+
+def raw_day_prefix(day):
+    """S3 prefix holding the raw trigger logs of one day"""
+
+    return f"{RAW_PREFIX}{day.strftime('%Y/%m/%d')}/"
+
+def parse_raw_log(key, body):
+    """Entries of one raw trigger log: one object, or one per line for batch logs"""
+
+    if key.endswith(".jsonl"):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    return [json.loads(body)]
+
+def read_raw_day(s3_client, bucket, day):
+    """Read and normalize every raw trigger log of one day
+
+    Returns (rows, keys) so the caller can delete the raw objects afterwards.
+    """
+
+    rows = []
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=raw_day_prefix(day)):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+            try:
+                entries = parse_raw_log(key, body)
+            except ValueError as e:
+                print(f"Skipping unreadable trigger log {key}: {e}")
+                continue
+
+            rows.extend(normalize_trigger_record(entry) for entry in entries)
+            keys.append(key)
+
+    return rows, keys
+
+def load_catalog(s3_client, bucket):
+    """Load the compacted file catalog, or an empty one"""
+
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=CATALOG_KEY)["Body"].read()
+        return json.loads(body.decode("utf-8"))
+    except Exception as e:
+        if "NoSuchKey" not in str(e):
+            print(f"Error loading trigger log catalog: {e}")
+        return {"schema_version": SCHEMA_VERSION, "files": []}
+
+def save_catalog(s3_client, bucket, catalog):
+    """Persist the compacted file catalog"""
+
+    catalog["files"].sort(key=lambda f: f["start_date"])
+    catalog["updated_at"] = datetime.utcnow().isoformat()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=CATALOG_KEY,
+        Body=json.dumps(catalog),
+        ContentType="application/json"
+    )
+
+def write_compacted_file(s3_client, bucket, key, rows, start_date, end_date):
+    """Write rows as a sorted, gzipped NDJSON file and return its catalog entry"""
+
+    rows = sorted(rows, key=lambda r: (r["trigger_source"], r["job_name"], r["timestamp"]))
+    body = gzip.compress("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"))
+
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        ContentType="application/x-ndjson",
+        ContentEncoding="gzip"
+    )
+
+    return {
+        "key": key,
+        "start_date": start_date,
+        "end_date": end_date,
+        "rows": len(rows),
+        "bytes": len(body),
+        "trigger_sources": sorted({r["trigger_source"] for r in rows}),
+        "job_names": sorted({r["job_name"] for r in rows}),
+        "schema_version": SCHEMA_VERSION
+    }
+
+def read_compacted_file(s3_client, bucket, key):
+    """Read the rows of one compacted file"""
+
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return [json.loads(line) for line in gzip.decompress(body).decode("utf-8").splitlines() if line]
+
+def compact_trigger_day(s3_client, bucket, day, catalog, delete_source=True):
+    """Compact one day of raw trigger logs into a single partition file"""
+
+    rows, keys = read_raw_day(s3_client, bucket, day)
+    if not rows:
+        return None
+
+    day_str = day.isoformat()
+    key = f"{COMPACTED_PREFIX}dt={day_str}/triggers.jsonl.gz"
+
+    # Re-compacting a day (late raw logs) merges with what is already there
+    existing = [f for f in catalog["files"] if f["key"] == key]
+    if existing:
+        rows = read_compacted_file(s3_client, bucket, key) + rows
+        catalog["files"] = [f for f in catalog["files"] if f["key"] != key]
+
+    entry = write_compacted_file(s3_client, bucket, key, rows, day_str, day_str)
+    catalog["files"].append(entry)
+
+    if delete_source:
+        # DeleteObjects takes at most 1000 keys per call
+        for i in range(0, len(keys), 1000):
+            s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True}
+            )
+
+    print(f"Compacted {len(keys)} trigger logs for {day_str} into s3://{bucket}/{key}")
+    return entry
+
+def rollup_month(s3_client, bucket, year, month, catalog):
+    """Merge the daily files of a complete month into one monthly file"""
+
+    prefix = f"{year:04d}-{month:02d}-"
+    daily = [
+        f for f in catalog["files"]
+        if f["start_date"] == f["end_date"] and f["start_date"].startswith(prefix)
+    ]
+    if not daily:
+        return None
+
+    key = f"{COMPACTED_PREFIX}month={year:04d}-{month:02d}/triggers.jsonl.gz"
+    monthly = [f for f in catalog["files"] if f["key"] == key]
+
+    rows = []
+    for f in monthly + daily:
+        rows.extend(read_compacted_file(s3_client, bucket, f["key"]))
+
+    last_day = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).isoformat()
+    entry = write_compacted_file(s3_client, bucket, key, rows, f"{prefix}01", last_day)
+
+    merged_keys = {f["key"] for f in monthly + daily}
+    catalog["files"] = [f for f in catalog["files"] if f["key"] not in merged_keys] + [entry]
+
+    s3_client.delete_objects(
+        Bucket=bucket,
+        Delete={"Objects": [{"Key": f["key"]} for f in daily], "Quiet": True}
+    )
+
+    print(f"Rolled up {len(daily)} daily trigger files into s3://{bucket}/{key}")
+    return entry
+
+def compact_trigger_logs(s3_client, bucket, now=None, lookback_days=7, days=None, delete_source=True):
+    """Compact complete days of raw trigger logs and roll up complete months
+
+    By default every day in the lookback window before today is compacted;
+    pass days to compact specific dates. Today is never compacted because it
+    is still being written.
+    """
+
+    now = now or datetime.utcnow()
+    today = now.date()
+    if days is None:
+        days = [today - timedelta(days=offset) for offset in range(lookback_days, 0, -1)]
+    days = [d for d in days if d < today]
+
+    catalog = load_catalog(s3_client, bucket)
+    compacted = []
+    for day in days:
+        entry = compact_trigger_day(s3_client, bucket, day, catalog, delete_source=delete_source)
+        if entry:
+            compacted.append(entry["key"])
+
+    # Months strictly before the current one are complete
+    rolled_up = []
+    months = {tuple(map(int, f["start_date"][:7].split("-"))) for f in catalog["files"]
+              if f["start_date"] == f["end_date"]}
+    for year, month in sorted(months):
+        if (year, month) < (today.year, today.month):
+            entry = rollup_month(s3_client, bucket, year, month, catalog)
+            if entry:
+                rolled_up.append(entry["key"])
+
+    if compacted or rolled_up:
+        save_catalog(s3_client, bucket, catalog)
+
+    return {"compacted": compacted, "rolled_up": rolled_up, "catalog_files": len(catalog["files"])}
+
+def query_trigger_logs(s3_client, bucket, start_date, end_date,
+                       trigger_source=None, job_name=None, include_raw=True):
+    """Return trigger rows between two dates (inclusive), optionally filtered
+
+    Compacted files are pruned on the catalog's date range, trigger sources
+    and job names before being read. Days not yet compacted are read from the
+    raw logs when include_raw is set.
+    """
+
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+
+    catalog = load_catalog(s3_client, bucket)
+    start_str, end_str = start_date.isoformat(), end_date.isoformat()
+
+    rows = []
+    covered = set()
+    for f in catalog["files"]:
+        if f["end_date"] < start_str or f["start_date"] > end_str:
+            continue
+
+        file_start = date.fromisoformat(f["start_date"])
+        for offset in range((date.fromisoformat(f["end_date"]) - file_start).days + 1):
+            covered.add(file_start + timedelta(days=offset))
+
+        if trigger_source and trigger_source not in f["trigger_sources"]:
+            continue
+        if job_name and job_name not in f["job_names"]:
+            continue
+        rows.extend(read_compacted_file(s3_client, bucket, f["key"]))
+
+    if include_raw:
+        day = start_date
+        while day <= end_date:
+            if day not in covered:
+                rows.extend(read_raw_day(s3_client, bucket, day)[0])
+            day += timedelta(days=1)
+
+    return [
+        row for row in rows
+        if start_str <= row["date"] <= end_str
+        and (not trigger_source or row["trigger_source"] == trigger_source)
+        and (not job_name or row["job_name"] == job_name)
+    ]
@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+
+# Daily utilization and cost aggregates, one row per fleet and UTC day:
+#   master_hours, agent_hours (spot / on-demand), builds_triggered,
+#   trigger_failures, shutdowns, actual_cost and counterfactual_cost
+# (an always-on master with on-demand agents for the same agent hours).
+#
+# Complete days are aggregated once from CloudWatch with batched
+# GetMetricData calls and stored with a checkpoint, so a report only fetches
+# the days since the last run. Rows live in one small JSON document per fleet
+# in S3, or in SQLite for local runs.
+UTILIZATION_PREFIX = "reports/utilization/"
+REPORT_STORE = os.environ.get("REPORT_STORE", "s3" if os.environ.get("S3_BUCKET") else "sqlite")
+REPORT_SQLITE_PATH = os.environ.get("REPORT_SQLITE_PATH", "/tmp/jenkins-utilization.db")
+# 5-minute EC2 metrics are kept for 63 days
+REPORT_BACKFILL_DAYS = int(os.environ.get("REPORT_BACKFILL_DAYS", "60"))
+
+SCHEMA_VERSION = 1
+MASTER_PERIOD_SECONDS = 300
+AGENT_PERIOD_SECONDS = 3600
+DAY_SECONDS = 86400
+
+def metric_queries(jenkins_instance_id, asg_name):
+    """GetMetricData queries for one fleet, keyed by their query ID"""
+
+    def query(query_id, namespace, name, dimensions, period, stat):
+        return {
+            "Id": query_id,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": namespace,
+                    "MetricName": name,
+                    "Dimensions": [{"Name": k, "Value": v} for k, v in dimensions.items()]
+                },
+                "Period": period,
+                "Stat": stat
+            },
+            "ReturnData": True
+        }
+
+    # Every 5-minute CPU datapoint is 5 minutes the master was running
+    queries = [
+        query("master", "AWS/EC2", "CPUUtilization", {"InstanceId": jenkins_instance_id},
+              MASTER_PERIOD_SECONDS, "SampleCount"),
+        query("builds", "Jenkins/BuildTrigger", "BuildsTriggered", {}, DAY_SECONDS, "Sum"),
+        query("failures", "Jenkins/BuildTrigger", "BuildTriggerFailures", {}, DAY_SECONDS, "Sum"),
+        query("shutdowns", "Jenkins/CostOptimization", "MasterInstanceStopped", {}, DAY_SECONDS, "Sum")
+    ]
+    if asg_name:
+        # Hourly average of in-service agents is agent-hours per hour
+        queries.append(query("agents", "AWS/AutoScaling", "GroupInServiceInstances",
+                             {"AutoScalingGroupName": asg_name}, AGENT_PERIOD_SECONDS, "Average"))
+    return queries
+
+def fetch_daily_metrics(cloudwatch_client, jenkins_instance_id, asg_name, start_day, end_day):
+    """Raw per-day metric totals for the days start_day..end_day (inclusive)
+
+    All metrics and days come back from one paginated GetMetricData request.
+    """
+
+    days = {}
+    day = start_day
+    while day <= end_day:
+        days[day.isoformat()] = {"master_hours": 0.0, "agent_hours": 0.0, "builds_triggered": 0,
+                                 "trigger_failures": 0, "shutdowns": 0}
+        day += timedelta(days=1)
+
+    paginator = cloudwatch_client.get_paginator("get_metric_data")
+    pages = paginator.paginate(
+        MetricDataQueries=metric_queries(jenkins_instance_id, asg_name),
+        StartTime=datetime.combine(start_day, time.min),
+        EndTime=datetime.combine(end_day + timedelta(days=1), time.min),
+        ScanBy="TimestampAscending"
+    )
+    for page in pages:
+        for series in page["MetricDataResults"]:
+            for timestamp, value in zip(series["Timestamps"], series["Values"]):
+                totals = days.get(timestamp.date().isoformat())
+                if totals is None:
+                    continue
+                if series["Id"] == "master":
+                    totals["master_hours"] += MASTER_PERIOD_SECONDS / 3600.0
+                elif series["Id"] == "agents":
+                    totals["agent_hours"] += value * AGENT_PERIOD_SECONDS / 3600.0
+                elif series["Id"] == "builds":
+                    totals["builds_triggered"] += int(value)
+                elif series["Id"] == "failures":
+                    totals["trigger_failures"] += int(value)
+                elif series["Id"] == "shutdowns":
+                    totals["shutdowns"] += int(value)
+    return days
+
+def cost_row(totals, prices):
+    """Turn one day's metric totals into a stored row with actual and counterfactual cost
+
+    prices holds master_on_demand, agent_spot and agent_on_demand hourly
+    prices plus agent_on_demand_share (0-1) of the agent group.
+    """
+
+    master_hours = min(24.0, totals["master_hours"])
+    agent_hours = totals["agent_hours"]
+    on_demand_agent_hours = agent_hours * prices["agent_on_demand_share"]
+    spot_agent_hours = agent_hours - on_demand_agent_hours
+
+    actual = (master_hours * prices["master_on_demand"]
+              + spot_agent_hours * prices["agent_spot"]
+              + on_demand_agent_hours * prices["agent_on_demand"])
+    counterfactual = 24.0 * prices["master_on_demand"] + agent_hours * prices["agent_on_demand"]
+
+    return {
+        "master_hours": round(master_hours, 3),
+        "spot_agent_hours": round(spot_agent_hours, 3),
+        "on_demand_agent_hours": round(on_demand_agent_hours, 3),
+        "builds_triggered": totals["builds_triggered"],
+        "trigger_failures": totals["trigger_failures"],
+        "shutdowns": totals["shutdowns"],
+        "actual_cost": round(actual, 4),
+        "counterfactual_cost": round(counterfactual, 4)
+    }
+
+class S3UtilizationStore:
+    """One JSON document per fleet under reports/utilization/"""
+
+    def __init__(self, s3_client, bucket):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def load(self, fleet_key):
+        try:
+            body = self.s3_client.get_object(
+                Bucket=self.bucket, Key=f"{UTILIZATION_PREFIX}{fleet_key}.json"
+            )["Body"].read()
+            return json.loads(body.decode("utf-8"))
+        except Exception as e:
+            if "NoSuchKey" not in str(e):
+                print(f"Error loading utilization history: {e}")
+            return None
+
+    def save(self, fleet_key, document):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=f"{UTILIZATION_PREFIX}{fleet_key}.json",
+            Body=json.dumps(document, separators=(",", ":")),
+            ContentType="application/json"
+        )
+
+class SQLiteUtilizationStore:
+    """Local stand-in for the S3 store"""
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS utilization (fleet TEXT PRIMARY KEY, document TEXT)"
+            )
+
+    def load(self, fleet_key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT document FROM utilization WHERE fleet = ?", (fleet_key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, fleet_key, document):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO utilization VALUES (?, ?)", (fleet_key, json.dumps(document))
+            )
+
+def get_utilization_store(s3_client=None, bucket=None):
+    """Return the configured utilization store"""
+
+    if REPORT_STORE == "s3" and s3_client and bucket:
+        return S3UtilizationStore(s3_client, bucket)
+    return SQLiteUtilizationStore(REPORT_SQLITE_PATH)
+
+def update_utilization(cloudwatch_client, store, fleet_key, jenkins_instance_id, asg_name,
+                       prices, now=None):
+    """Aggregate every complete day since the checkpoint and store the rows
+
+    Returns the fleet's document: {"checkpoint": last aggregated day,
+    "days": {date: row}}. Days already stored are never fetched again.
+    """
+
+    now = now or datetime.utcnow()
+    yesterday = now.date() - timedelta(days=1)
+    document = store.load(fleet_key) or {"schema_version": SCHEMA_VERSION, "checkpoint": None, "days": {}}
+
+    if document["checkpoint"]:
+        start_day = date.fromisoformat(document["checkpoint"]) + timedelta(days=1)
+    else:
+        start_day = now.date() - timedelta(days=REPORT_BACKFILL_DAYS)
+    if start_day > yesterday:
+        return document
+
+    raw = fetch_daily_metrics(cloudwatch_client, jenkins_instance_id, asg_name, start_day, yesterday)
+    if not document["checkpoint"]:
+        # A backfill starts at the first day the fleet existed; empty days
+        # before it would count as an always-off master
+        active = [day for day, totals in sorted(raw.items())
+                  if totals["master_hours"] or totals["agent_hours"] or totals["builds_triggered"]]
+        raw = {day: totals for day, totals in raw.items() if active and day >= active[0]}
+    for day, totals in raw.items():
+        document["days"][day] = cost_row(totals, prices)
+
+    document["checkpoint"] = yesterday.isoformat()
+    document["updated_at"] = now.isoformat()
+    store.save(fleet_key, document)
+    print(f"Aggregated utilization for {len(raw)} days ({start_day} to {yesterday})")
+    return document
+
+def summarize_utilization(document, start_day=None, end_day=None):
+    """Daily rows, monthly totals and overall totals between two dates"""
+
+    start_str = start_day.isoformat() if start_day else ""
+    end_str = end_day.isoformat() if end_day else "9999-12-31"
+    rows = [dict(row, date=day) for day, row in sorted(document["days"].items())
+            if start_str <= day <= end_str]
+
+    def total(selected):
+        summed = {
+            key: round(sum(row[key] for row in selected), 4)
+            for key in ("master_hours", "spot_agent_hours", "on_demand_agent_hours",
+                        "builds_triggered", "trigger_failures", "shutdowns",
+                        "actual_cost", "counterfactual_cost")
+        }
+        summed["savings"] = round(summed["counterfactual_cost"] - summed["actual_cost"], 4)
+        summed["cost_per_build"] = (
+            round(summed["actual_cost"] / summed["builds_triggered"], 4) if summed["builds_triggered"] else None
+        )
+        summed["days"] = len(selected)
+        return summed
+
+    months = {}
+    for row in rows:
+        months.setdefault(row["date"][:7], []).append(row)
+    monthly = {month: total(selected) for month, selected in months.items()}
+
+    # Month-over-month change in actual cost
+    previous = None
+    for month in sorted(monthly):
+        if previous is not None and monthly[previous]["actual_cost"]:
+            change = monthly[month]["actual_cost"] / monthly[previous]["actual_cost"] - 1
+            monthly[month]["actual_cost_change"] = round(change, 4)
+        previous = month
+
+    return {
+        "checkpoint": document["checkpoint"],
+        "days": rows,
+        "months": monthly,
+        "totals": total(rows)
+    }
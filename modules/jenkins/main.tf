@@ -380,6 +380,13 @@ resource "aws_autoscaling_group" "jenkins_agents" {
   max_size         = var.max_jenkins_agents
   desired_capacity = 0
 
+  # Launch a replacement as soon as EC2 signals a spot agent is at risk
+  capacity_rebalance = true
+
+  # In-service agent counts feed the utilization report's agent hours
+  enabled_metrics     = ["GroupInServiceInstances"]
+  metrics_granularity = "1Minute"
+
   mixed_instances_policy {
     launch_template {
       launch_template_specification {
@@ -432,8 +439,40 @@ resource "aws_lambda_function" "jenkins_trigger" {
     variables = {
       JENKINS_URL      = "http://${aws_instance.jenkins_master.private_ip}:8080"
       JENKINS_USER     = "admin"
-      JENKINS_PASSWORD = var.jenkins_admin_password
-      S3_BUCKET        = aws_s3_bucket.jenkins_artifacts.bucket
+      JENKINS_PASSWORD   = var.jenkins_admin_password
+      S3_BUCKET          = aws_s3_bucket.jenkins_artifacts.bucket
+      MAX_DRAIN_ATTEMPTS = var.max_pending_drain_attempts
+
+      # Delayed re-checks while the master boots
+      PENDING_DRAIN_QUEUE_URL          = aws_sqs_queue.pending_drain.url
+      PENDING_DRAIN_BASE_DELAY_SECONDS = var.pending_drain_base_delay_seconds
+
+      # Explicit identities skip tag-based discovery
+      JENKINS_INSTANCE_ID = aws_instance.jenkins_master.id
+      ASG_NAME            = aws_autoscaling_group.jenkins_agents.name
+
+      TRIGGER_QUEUE_URL               = var.enable_trigger_batching ? aws_sqs_queue.trigger_queue[0].url : ""
+      TRIGGER_COALESCE_WINDOW_SECONDS = var.trigger_coalesce_window_seconds
+
+      METRICS_MODE   = var.metrics_mode
+      TRACE_PROFILER = var.trigger_trace_profiler
+
+      # Trigger file validation
+      MAX_AGENTS = var.max_jenkins_agents
+
+      # Duplicate trigger suppression
+      IDEMPOTENCY_BACKEND     = var.enable_trigger_idempotency ? "dynamodb" : "off"
+      IDEMPOTENCY_TABLE       = var.enable_trigger_idempotency ? aws_dynamodb_table.trigger_idempotency[0].name : ""
+      IDEMPOTENCY_TTL_SECONDS = var.trigger_idempotency_ttl_seconds
+
+      # Queue item follow-through
+      BUILD_FOLLOW_MODE            = var.build_follow_mode
+      BUILD_FOLLOW_TIMEOUT_SECONDS = var.build_follow_timeout_seconds
+
+      # Change-aware build filtering
+      BUILD_RULES            = var.build_rules == null ? "" : jsonencode(var.build_rules)
+      BUILD_RULES_S3_URI     = var.build_rules_s3_uri
+      GITHUB_TOKEN_PARAMETER = aws_ssm_parameter.github_token.name
     }
   }
 
@@ -450,6 +489,38 @@ data "archive_file" "jenkins_trigger" {
     })
     filename = "index.py"
   }
+  source {
+    content  = file("${path.module}/lambda/trigger_files.py")
+    filename = "trigger_files.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/event_sources.py")
+    filename = "event_sources.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/idempotency.py")
+    filename = "idempotency.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/build_rules.py")
+    filename = "build_rules.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/jenkins_api.py")
+    filename = "jenkins_api.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/metrics.py")
+    filename = "metrics.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/tracing.py")
+    filename = "tracing.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/aws_clients.py")
+    filename = "aws_clients.py"
+  }
 }
 
 # IAM Role for Lambda
@@ -479,7 +550,7 @@ resource "aws_iam_policy" "lambda_jenkins_trigger" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Effect = "Allow"
         Action = [
@@ -489,6 +560,13 @@ resource "aws_iam_policy" "lambda_jenkins_trigger" {
         ]
         Resource = "arn:aws:logs:${var.aws_region}:*:*"
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "cloudwatch:PutMetricData"
+        ]
+        Resource = "*"
+      },
       {
         Effect = "Allow"
         Action = [
@@ -501,23 +579,112 @@ resource "aws_iam_policy" "lambda_jenkins_trigger" {
       {
         Effect = "Allow"
         Action = [
-          "autoscaling:SetDesiredCapacity",
-          "autoscaling:DescribeAutoScalingGroups"
+          "autoscaling:SetDesiredCapacity"
         ]
         Resource = aws_autoscaling_group.jenkins_agents.arn
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "autoscaling:DescribeAutoScalingGroups"
+        ]
+        Resource = "*"
+      },
       {
         Effect = "Allow"
         Action = [
           "s3:GetObject",
-          "s3:PutObject"
+          "s3:PutObject",
+          "s3:DeleteObject",
+          "s3:ListBucket"
         ]
         Resource = [
           aws_s3_bucket.jenkins_artifacts.arn,
           "${aws_s3_bucket.jenkins_artifacts.arn}/*"
         ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:${var.aws_region}:*:function:${local.jenkins_name}-trigger"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = [
+          "arn:aws:sqs:${var.aws_region}:*:${local.jenkins_name}-triggers",
+          aws_sqs_queue.pending_drain.arn
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:DeleteItem"
+        ]
+        Resource = "arn:aws:dynamodb:${var.aws_region}:*:table/${local.jenkins_name}-trigger-idempotency"
+      },
+      {
+        # Changed file lookups for build rules
+        Effect = "Allow"
+        Action = [
+          "codecommit:GetDifferences"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "ssm:GetParameter"
+        ]
+        Resource = aws_ssm_parameter.github_token.arn
       }
-    ]
+      ], var.trigger_kinesis_stream_arn != "" ? [
+      {
+        # Build requests read from the Kinesis stream
+        Effect = "Allow"
+        Action = [
+          "kinesis:DescribeStream",
+          "kinesis:DescribeStreamSummary",
+          "kinesis:GetRecords",
+          "kinesis:GetShardIterator",
+          "kinesis:ListShards",
+          "kinesis:ListStreams"
+        ]
+        Resource = var.trigger_kinesis_stream_arn
+      }
+      ] : [], var.trigger_msk_cluster_arn != "" ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "kafka:DescribeCluster",
+          "kafka:DescribeClusterV2",
+          "kafka:GetBootstrapBrokers"
+        ]
+        Resource = var.trigger_msk_cluster_arn
+      }
+      ] : [], var.trigger_msk_cluster_arn != "" || var.trigger_kafka_bootstrap_servers != "" ? [
+      {
+        # Kafka pollers reach the brokers through network interfaces in the VPC
+        Effect = "Allow"
+        Action = [
+          "ec2:CreateNetworkInterface",
+          "ec2:DeleteNetworkInterface",
+          "ec2:DescribeNetworkInterfaces",
+          "ec2:DescribeSecurityGroups",
+          "ec2:DescribeSubnets",
+          "ec2:DescribeVpcs"
+        ]
+        Resource = "*"
+      }
+    ] : [])
   })
 
   tags = local.common_tags
@@ -529,17 +696,31 @@ resource "aws_iam_role_policy_attachment" "lambda_jenkins_trigger" {
 }
 
 # S3 Event Notification for triggering builds
+# With trigger batching enabled the notification goes to the buffer queue instead
 resource "aws_s3_bucket_notification" "jenkins_trigger" {
   bucket = aws_s3_bucket.jenkins_artifacts.id
 
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.jenkins_trigger.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_prefix       = "triggers/"
-    filter_suffix       = ".trigger"
+  dynamic "lambda_function" {
+    for_each = var.enable_trigger_batching ? [] : [1]
+    content {
+      lambda_function_arn = aws_lambda_function.jenkins_trigger.arn
+      events              = ["s3:ObjectCreated:*"]
+      filter_prefix       = "triggers/"
+      filter_suffix       = ".trigger"
+    }
+  }
+
+  dynamic "queue" {
+    for_each = var.enable_trigger_batching ? [1] : []
+    content {
+      queue_arn     = aws_sqs_queue.trigger_queue[0].arn
+      events        = ["s3:ObjectCreated:*"]
+      filter_prefix = "triggers/"
+      filter_suffix = ".trigger"
+    }
   }
 
-  depends_on = [aws_lambda_permission.s3_invoke]
+  depends_on = [aws_lambda_permission.s3_invoke, aws_sqs_queue_policy.trigger_queue]
 }
 
 resource "aws_lambda_permission" "s3_invoke" {
@@ -569,7 +750,7 @@ resource "aws_cloudwatch_event_rule" "github_push" {
 resource "aws_cloudwatch_event_target" "jenkins_trigger" {
   rule      = aws_cloudwatch_event_rule.github_push.name
   target_id = "JenkinsTriggerTarget"
-  arn       = aws_lambda_function.jenkins_trigger.arn
+  arn       = var.enable_trigger_batching ? aws_sqs_queue.trigger_queue[0].arn : aws_lambda_function.jenkins_trigger.arn
 }
 
 resource "aws_lambda_permission" "eventbridge_invoke" {
@@ -580,6 +761,195 @@ resource "aws_lambda_permission" "eventbridge_invoke" {
   source_arn    = aws_cloudwatch_event_rule.github_push.arn
 }
 
+# Idempotency store: duplicate trigger deliveries are dropped before any
+# EC2 or Jenkins work; entries expire through DynamoDB TTL
+resource "aws_dynamodb_table" "trigger_idempotency" {
+  count        = var.enable_trigger_idempotency ? 1 : 0
+  name         = "${local.jenkins_name}-trigger-idempotency"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "fingerprint"
+
+  attribute {
+    name = "fingerprint"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  server_side_encryption {
+    enabled = true
+  }
+
+  tags = local.common_tags
+}
+
+# Trigger buffer queue: bursts of pushes are coalesced and dispatched in batches
+resource "aws_sqs_queue" "trigger_queue_dlq" {
+  count                     = var.enable_trigger_batching ? 1 : 0
+  name                      = "${local.jenkins_name}-triggers-dlq"
+  message_retention_seconds = 1209600
+  sqs_managed_sse_enabled   = true
+
+  tags = local.common_tags
+}
+
+resource "aws_sqs_queue" "trigger_queue" {
+  count                      = var.enable_trigger_batching ? 1 : 0
+  name                       = "${local.jenkins_name}-triggers"
+  visibility_timeout_seconds = 360 # 6x the trigger Lambda timeout
+  message_retention_seconds  = 86400
+  sqs_managed_sse_enabled    = true
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.trigger_queue_dlq[0].arn
+    maxReceiveCount     = 5
+  })
+
+  tags = local.common_tags
+}
+
+resource "aws_sqs_queue_policy" "trigger_queue" {
+  count     = var.enable_trigger_batching ? 1 : 0
+  queue_url = aws_sqs_queue.trigger_queue[0].id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "s3.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.trigger_queue[0].arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = aws_s3_bucket.jenkins_artifacts.arn }
+        }
+      },
+      {
+        Effect    = "Allow"
+        Principal = { Service = "events.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.trigger_queue[0].arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = aws_cloudwatch_event_rule.github_push.arn }
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "trigger_queue" {
+  count                              = var.enable_trigger_batching ? 1 : 0
+  event_source_arn                   = aws_sqs_queue.trigger_queue[0].arn
+  function_name                      = aws_lambda_function.jenkins_trigger.arn
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = var.trigger_coalesce_window_seconds
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
+# Build requests published to a Kinesis stream or Kafka topic, consumed in
+# batches; every record holds one request in any shape the trigger accepts
+resource "aws_lambda_event_source_mapping" "trigger_kinesis" {
+  count                              = var.trigger_kinesis_stream_arn != "" ? 1 : 0
+  event_source_arn                   = var.trigger_kinesis_stream_arn
+  function_name                      = aws_lambda_function.jenkins_trigger.arn
+  starting_position                  = "LATEST"
+  batch_size                         = var.trigger_stream_batch_size
+  maximum_batching_window_in_seconds = var.trigger_coalesce_window_seconds
+  maximum_retry_attempts             = 5
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
+# Kafka mappings retry a failed batch whole; built records are skipped as duplicates
+resource "aws_lambda_event_source_mapping" "trigger_msk" {
+  count                              = var.trigger_msk_cluster_arn != "" ? 1 : 0
+  event_source_arn                   = var.trigger_msk_cluster_arn
+  function_name                      = aws_lambda_function.jenkins_trigger.arn
+  topics                             = [var.trigger_kafka_topic]
+  starting_position                  = "LATEST"
+  batch_size                         = var.trigger_stream_batch_size
+  maximum_batching_window_in_seconds = var.trigger_coalesce_window_seconds
+}
+
+# The Kafka deployed by modules/kafka, reached from the private subnets
+resource "aws_lambda_event_source_mapping" "trigger_kafka" {
+  count                              = var.trigger_kafka_bootstrap_servers != "" ? 1 : 0
+  function_name                      = aws_lambda_function.jenkins_trigger.arn
+  topics                             = [var.trigger_kafka_topic]
+  starting_position                  = "LATEST"
+  batch_size                         = var.trigger_stream_batch_size
+  maximum_batching_window_in_seconds = var.trigger_coalesce_window_seconds
+
+  self_managed_event_source {
+    endpoints = {
+      KAFKA_BOOTSTRAP_SERVERS = var.trigger_kafka_bootstrap_servers
+    }
+  }
+
+  dynamic "source_access_configuration" {
+    for_each = var.private_subnets
+    content {
+      type = "VPC_SUBNET"
+      uri  = "subnet:${source_access_configuration.value}"
+    }
+  }
+
+  source_access_configuration {
+    type = "VPC_SECURITY_GROUP"
+    uri  = "security_group:${aws_security_group.jenkins_agents.id}"
+  }
+}
+
+# Delayed drains of pending triggers: each re-check waits on this queue,
+# backing off while the master boots or finishes stopping
+resource "aws_sqs_queue" "pending_drain" {
+  name                       = "${local.jenkins_name}-pending-drain"
+  visibility_timeout_seconds = 360 # 6x the trigger Lambda timeout
+  message_retention_seconds  = 86400
+  sqs_managed_sse_enabled    = true
+
+  tags = local.common_tags
+}
+
+resource "aws_lambda_event_source_mapping" "pending_drain" {
+  event_source_arn = aws_sqs_queue.pending_drain.arn
+  function_name    = aws_lambda_function.jenkins_trigger.arn
+  batch_size       = 1
+}
+
+# EventBridge rule to fire pending triggers once the Jenkins master is running
+resource "aws_cloudwatch_event_rule" "jenkins_master_running" {
+  name        = "${local.jenkins_name}-master-running"
+  description = "Drain pending Jenkins build triggers when the master reaches running"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ec2"]
+    detail-type = ["EC2 Instance State-change Notification"]
+    detail = {
+      state       = ["running"]
+      instance-id = [aws_instance.jenkins_master.id]
+    }
+  })
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "jenkins_master_running" {
+  rule      = aws_cloudwatch_event_rule.jenkins_master_running.name
+  target_id = "JenkinsPendingTriggerDrain"
+  arn       = aws_lambda_function.jenkins_trigger.arn
+}
+
+resource "aws_lambda_permission" "eventbridge_master_running" {
+  statement_id  = "AllowExecutionFromEventBridgeMasterRunning"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.jenkins_trigger.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.jenkins_master_running.arn
+}
+
 # Application Load Balancer for Jenkins (optional)
 resource "aws_lb" "jenkins" {
   count              = var.enable_jenkins_alb ? 1 : 0
@@ -743,6 +1113,40 @@ resource "aws_lambda_function" "jenkins_cost_optimizer" {
       JENKINS_INSTANCE_ID = aws_instance.jenkins_master.id
       ASG_NAME            = aws_autoscaling_group.jenkins_agents.name
       ENVIRONMENT         = var.environment
+
+      # Queue-aware agent autoscaler
+      JENKINS_URL              = "http://${aws_instance.jenkins_master.private_ip}:8080"
+      JENKINS_USER             = "admin"
+      JENKINS_PASSWORD         = var.jenkins_admin_password
+      S3_BUCKET                = aws_s3_bucket.jenkins_artifacts.bucket
+      MIN_AGENTS               = var.min_jenkins_agents
+      MAX_AGENTS               = var.max_jenkins_agents
+      AGENT_IDLE_GRACE_SECONDS = var.agent_idle_timeout * 60
+      FORECAST_LEAD_MINUTES    = var.agent_prewarm_lead_minutes
+
+      # Graceful scale-in: busy agents finish their builds first
+      AGENT_DRAIN_TIMEOUT_MINUTES = var.agent_drain_timeout_minutes
+
+      # Hot agents kept during work hours
+      WARM_AGENTS      = var.warm_agent_count
+      WARM_AGENT_HOURS = var.warm_agent_hours
+      WARM_AGENT_DAYS  = var.warm_agent_days
+
+      # Activity-based shutdown
+      IDLE_SHUTDOWN_MINUTES = var.idle_shutdown_minutes
+      IDLE_CPU_THRESHOLD    = var.idle_cpu_threshold
+
+      # Cost reporting
+      AGENT_INSTANCE_TYPE = var.jenkins_agent_instance_type
+      SHUTDOWN_SCHEDULE   = var.shutdown_schedule
+      STARTUP_SCHEDULE    = var.startup_schedule
+
+      # Multi-fleet fan-out; empty means this module's own master and ASG
+      FLEET_REGISTRY        = length(var.fleet_registry) > 0 ? jsonencode(var.fleet_registry) : ""
+      FLEET_DISCOVERY       = var.enable_fleet_discovery ? "tags" : ""
+      FLEET_MAX_CONCURRENCY = var.fleet_max_concurrency
+
+      METRICS_MODE = var.metrics_mode
     }
   }
 
@@ -757,8 +1161,68 @@ data "archive_file" "jenkins_cost_optimizer" {
   count            = var.enable_auto_shutdown ? 1 : 0
   type             = "zip"
   output_path      = "${path.module}/jenkins_cost_optimizer.zip"
-  source_file      = "${path.module}/lambda/cost_optimizer.py"
   output_file_mode = "0666"
+
+  source {
+    content  = file("${path.module}/lambda/cost_optimizer.py")
+    filename = "cost_optimizer.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/agent_autoscaler.py")
+    filename = "agent_autoscaler.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/agent_drain.py")
+    filename = "agent_drain.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/agent_warm_pool.py")
+    filename = "agent_warm_pool.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/idle_shutdown.py")
+    filename = "idle_shutdown.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/utilization_report.py")
+    filename = "utilization_report.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/trigger_log_store.py")
+    filename = "trigger_log_store.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/fleet_collector.py")
+    filename = "fleet_collector.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/fleet_registry.py")
+    filename = "fleet_registry.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/pricing.py")
+    filename = "pricing.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/pricing_snapshot.json")
+    filename = "pricing_snapshot.json"
+  }
+  source {
+    content  = file("${path.module}/lambda/jenkins_api.py")
+    filename = "jenkins_api.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/metrics.py")
+    filename = "metrics.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/tracing.py")
+    filename = "tracing.py"
+  }
+  source {
+    content  = file("${path.module}/lambda/aws_clients.py")
+    filename = "aws_clients.py"
+  }
 }
 
 resource "aws_iam_role" "lambda_cost_optimizer" {
@@ -788,7 +1252,7 @@ resource "aws_iam_policy" "lambda_cost_optimizer" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Effect = "Allow"
         Action = [
@@ -798,12 +1262,29 @@ resource "aws_iam_policy" "lambda_cost_optimizer" {
         ]
         Resource = "arn:aws:logs:${var.aws_region}:*:*"
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "cloudwatch:PutMetricData",
+          "cloudwatch:GetMetricStatistics",
+          "cloudwatch:GetMetricData"
+        ]
+        Resource = "*"
+      },
       {
         Effect = "Allow"
         Action = [
           "ec2:DescribeInstances",
           "ec2:StartInstances",
-          "ec2:StopInstances"
+          "ec2:StopInstances",
+          "ec2:DescribeSpotPriceHistory"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "pricing:GetProducts"
         ]
         Resource = "*"
       },
@@ -811,11 +1292,58 @@ resource "aws_iam_policy" "lambda_cost_optimizer" {
         Effect = "Allow"
         Action = [
           "autoscaling:SetDesiredCapacity",
-          "autoscaling:DescribeAutoScalingGroups"
+          "autoscaling:SetInstanceProtection",
+          "autoscaling:TerminateInstanceInAutoScalingGroup",
+          "autoscaling:DetachInstances"
         ]
         Resource = aws_autoscaling_group.jenkins_agents.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "autoscaling:DescribeAutoScalingGroups",
+          "autoscaling:DescribeAutoScalingInstances"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject",
+          "s3:ListBucket"
+        ]
+        Resource = [
+          aws_s3_bucket.jenkins_artifacts.arn,
+          "${aws_s3_bucket.jenkins_artifacts.arn}/*"
+        ]
+      },
+      {
+        # Follow-up invocations while agents drain
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = "arn:aws:lambda:${var.aws_region}:*:function:${local.jenkins_name}-cost-optimizer"
       }
-    ]
+      ], length(var.fleet_registry) > 0 || var.enable_fleet_discovery ? [
+      {
+        # Other fleets' agent ASGs, limited to Jenkins-tagged groups
+        Effect = "Allow"
+        Action = [
+          "autoscaling:SetDesiredCapacity",
+          "autoscaling:TerminateInstanceInAutoScalingGroup",
+          "autoscaling:DetachInstances"
+        ]
+        Resource = "*"
+        Condition = {
+          StringEquals = {
+            "autoscaling:ResourceTag/Component" = "Jenkins"
+          }
+        }
+      }
+    ] : [])
   })
 
   tags = local.common_tags
@@ -859,6 +1387,123 @@ resource "aws_lambda_permission" "eventbridge_shutdown" {
   source_arn    = aws_cloudwatch_event_rule.jenkins_shutdown[0].arn
 }
 
+resource "aws_cloudwatch_event_rule" "jenkins_autoscale" {
+  count               = var.enable_auto_shutdown && var.enable_agent_autoscaler ? 1 : 0
+  name                = "${local.jenkins_name}-agent-autoscale"
+  description         = "Size Jenkins agents to the build queue and forecast demand"
+  schedule_expression = var.agent_autoscale_schedule
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "jenkins_autoscale" {
+  count     = var.enable_auto_shutdown && var.enable_agent_autoscaler ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.jenkins_autoscale[0].name
+  target_id = "JenkinsAutoscaleTarget"
+  arn       = aws_lambda_function.jenkins_cost_optimizer[0].arn
+
+  input = jsonencode({
+    action = "autoscale"
+  })
+}
+
+resource "aws_lambda_permission" "eventbridge_autoscale" {
+  count         = var.enable_auto_shutdown && var.enable_agent_autoscaler ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridgeAutoscale"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.jenkins_cost_optimizer[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.jenkins_autoscale[0].arn
+}
+
+resource "aws_cloudwatch_event_rule" "jenkins_idle_check" {
+  count               = var.enable_auto_shutdown && var.enable_idle_shutdown ? 1 : 0
+  name                = "${local.jenkins_name}-idle-check"
+  description         = "Stop Jenkins once it has been idle for idle_shutdown_minutes"
+  schedule_expression = var.idle_check_schedule
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "jenkins_idle_check" {
+  count     = var.enable_auto_shutdown && var.enable_idle_shutdown ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.jenkins_idle_check[0].name
+  target_id = "JenkinsIdleCheckTarget"
+  arn       = aws_lambda_function.jenkins_cost_optimizer[0].arn
+
+  input = jsonencode({
+    action = "idle_check"
+  })
+}
+
+resource "aws_lambda_permission" "eventbridge_idle_check" {
+  count         = var.enable_auto_shutdown && var.enable_idle_shutdown ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridgeIdleCheck"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.jenkins_cost_optimizer[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.jenkins_idle_check[0].arn
+}
+
+# Spot interruption warnings and rebalance recommendations for agents
+resource "aws_cloudwatch_event_rule" "jenkins_spot_interruption" {
+  count       = var.enable_auto_shutdown && var.enable_spot_interruption_handling ? 1 : 0
+  name        = "${local.jenkins_name}-spot-interruption"
+  description = "Replace Jenkins spot agents before EC2 reclaims them"
+
+  event_pattern = jsonencode({
+    source      = ["aws.ec2"]
+    detail-type = ["EC2 Spot Instance Interruption Warning", "EC2 Instance Rebalance Recommendation"]
+  })
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "jenkins_spot_interruption" {
+  count     = var.enable_auto_shutdown && var.enable_spot_interruption_handling ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.jenkins_spot_interruption[0].name
+  target_id = "JenkinsSpotInterruptionTarget"
+  arn       = aws_lambda_function.jenkins_cost_optimizer[0].arn
+}
+
+resource "aws_lambda_permission" "eventbridge_spot_interruption" {
+  count         = var.enable_auto_shutdown && var.enable_spot_interruption_handling ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridgeSpotInterruption"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.jenkins_cost_optimizer[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.jenkins_spot_interruption[0].arn
+}
+
+resource "aws_cloudwatch_event_rule" "jenkins_trigger_log_compaction" {
+  count               = var.enable_auto_shutdown ? 1 : 0
+  name                = "${local.jenkins_name}-trigger-log-compaction"
+  description         = "Compact build trigger logs into daily and monthly analytics files"
+  schedule_expression = "cron(${var.trigger_log_compaction_schedule})"
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "jenkins_trigger_log_compaction" {
+  count     = var.enable_auto_shutdown ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.jenkins_trigger_log_compaction[0].name
+  target_id = "JenkinsTriggerLogCompactionTarget"
+  arn       = aws_lambda_function.jenkins_cost_optimizer[0].arn
+
+  input = jsonencode({
+    action = "compact_trigger_logs"
+  })
+}
+
+resource "aws_lambda_permission" "eventbridge_trigger_log_compaction" {
+  count         = var.enable_auto_shutdown ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridgeTriggerLogCompaction"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.jenkins_cost_optimizer[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.jenkins_trigger_log_compaction[0].arn
+}
+
 resource "aws_lambda_permission" "eventbridge_startup" {
   count         = var.enable_auto_shutdown ? 1 : 0
   statement_id  = "AllowExecutionFromEventBridgeStartup"
@@ -0,0 +1,121 @@
+import base64
+import json
+import os
+import sys
+import time
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+# Module-level settings are read at import, so the environment comes first
+os.environ.update({
+    "JENKINS_URL": "http://jenkins.test:8080",
+    "JENKINS_USER": "admin",
+    "JENKINS_PASSWORD": "test",
+    "S3_BUCKET": "test-jenkins-artifacts",
+    "IDEMPOTENCY_BACKEND": "memory",
+    "METRICS_MODE": "off",
+    "AWS_DEFAULT_REGION": "eu-west-1"
+})
+
+BUCKET = os.environ["S3_BUCKET"]
+
+class FakeS3:
+    """The S3 calls the trigger Lambda makes, kept in memory"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": f'"{len(self.objects)}"'}
+
+    def logged_triggers(self):
+        """Every build trigger logged by log_build_triggers"""
+
+        lines = []
+        for (bucket, key), body in self.objects.items():
+            if bucket == BUCKET and key.startswith("build-triggers/"):
+                lines.extend(json.loads(line) for line in body.decode("utf-8").splitlines())
+        return lines
+
+class FakeJenkins:
+    """Records the builds posted to Jenkins; jobs named in failing are answered 500"""
+
+    def __init__(self):
+        self.builds = []
+        self.failing = set()
+        self.next_queue_id = 1
+
+    def trigger_build(self, jenkins_url, username, password, build_params):
+        job_name = build_params.get("job_name", "github-pipeline")
+        if job_name in self.failing:
+            raise Exception("Failed to trigger build: 500")
+        self.builds.append(dict(build_params))
+        queue_id, self.next_queue_id = self.next_queue_id, self.next_queue_id + 1
+        return {
+            "success": True,
+            "queue_location": f"{jenkins_url}/queue/item/{queue_id}/",
+            "build_url": f"{jenkins_url}/job/{job_name}/buildWithParameters"
+        }
+
+    def built_jobs(self):
+        return sorted(build.get("job_name", "github-pipeline") for build in self.builds)
+
+class LambdaContext:
+    """Lambda context stand-in"""
+
+    function_name = "test-jenkins-trigger"
+
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+def kafka_batch_event(bodies, topic="builds", partition=0):
+    """Self-managed Kafka batch carrying one JSON body per record"""
+
+    now_ms = int(time.time() * 1000)
+    records = [{
+        "topic": topic,
+        "partition": partition,
+        "offset": offset,
+        "timestamp": now_ms,
+        "timestampType": "CREATE_TIME",
+        "value": base64.b64encode(json.dumps(body).encode("utf-8")).decode("ascii")
+    } for offset, body in enumerate(bodies)]
+    return {"eventSource": "SelfManagedKafka", "records": {f"{topic}-{partition}": records}}
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+@pytest.fixture
+def jenkins():
+    return FakeJenkins()
+
+@pytest.fixture
+def jt(monkeypatch, s3, jenkins):
+    """jenkins_trigger with a running master, a ready Jenkins and a fresh idempotency store
+
+    Only the S3 client is used on this path; the EC2 and Auto Scaling calls
+    are answered by the patched master and agent helpers.
+    """
+
+    import idempotency
+    import jenkins_trigger
+
+    monkeypatch.setattr(idempotency, "_store", None)
+    monkeypatch.setattr(jenkins_trigger, "get_client", lambda service: s3 if service == "s3" else None)
+    monkeypatch.setattr(jenkins_trigger, "start_jenkins_master",
+                        lambda ec2_client, use_cache=True: ("i-0123456789abcdef0", "running"))
+    monkeypatch.setattr(jenkins_trigger, "scale_jenkins_agents", lambda autoscaling_client, count: None)
+    monkeypatch.setattr(jenkins_trigger, "wait_for_jenkins_ready",
+                        lambda url, user, password, deadline=None: {"status": jenkins_trigger.READY})
+    monkeypatch.setattr(jenkins_trigger, "get_crumb_headers", lambda url, user, password: {})
+    monkeypatch.setattr(jenkins_trigger, "trigger_jenkins_build", jenkins.trigger_build)
+    del jenkins_trigger._claims[:]
+    return jenkins_trigger
@@ -0,0 +1,168 @@
+"""process_trigger_batch driven through InMemoryTriggerQueue
+
+Batches go through the trigger handler as the SQS event source mapping
+would deliver them, against the fakes in conftest.py.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import LambdaContext, kafka_batch_event
+
+def received(seconds_ago):
+    return (datetime.utcnow() - timedelta(seconds=seconds_ago)).isoformat()
+
+def queued_trigger(jt, job_name, commit_sha=None, seconds_ago=0):
+    build_params = {"job_name": job_name, "branch": "main", "repository": "app", "agent_count": 1}
+    if commit_sha:
+        build_params["commit_sha"] = commit_sha
+    return jt.make_trigger("manual", build_params, received(seconds_ago))
+
+def run_batch(jt, event):
+    return jt.handler(event, LambdaContext("test-request"))
+
+def failed_ids(response):
+    return sorted(failure["itemIdentifier"] for failure in response["batchItemFailures"])
+
+def test_batch_fires_every_job(jt, jenkins):
+    queue = jt.InMemoryTriggerQueue()
+    for job_name in ("api", "web", "worker"):
+        queue.send(queued_trigger(jt, job_name))
+
+    response = run_batch(jt, queue.receive())
+
+    assert response == {"batchItemFailures": []}
+    assert jenkins.built_jobs() == ["api", "web", "worker"]
+    assert queue.messages == []
+
+def test_batch_logs_every_build_once(jt, s3):
+    queue = jt.InMemoryTriggerQueue()
+    for job_name in ("api", "web"):
+        queue.send(queued_trigger(jt, job_name))
+
+    run_batch(jt, queue.receive())
+
+    assert len(s3.objects) == 1
+    assert sorted(t["build_params"]["job_name"] for t in s3.logged_triggers()) == ["api", "web"]
+
+def test_coalesce_builds_newest_commit(jt, jenkins, s3):
+    queue = jt.InMemoryTriggerQueue()
+    queue.send(queued_trigger(jt, "api", "a" * 40, seconds_ago=20))
+    queue.send(queued_trigger(jt, "api", "c" * 40, seconds_ago=5))
+    queue.send(queued_trigger(jt, "api", "b" * 40, seconds_ago=10))
+
+    response = run_batch(jt, queue.receive())
+
+    assert response == {"batchItemFailures": []}
+    assert [build["commit_sha"] for build in jenkins.builds] == ["c" * 40]
+    assert s3.logged_triggers()[0]["coalesced"] == 3
+
+def test_coalesce_keeps_triggers_outside_window(jt, jenkins):
+    queue = jt.InMemoryTriggerQueue()
+    window = jt.TRIGGER_COALESCE_WINDOW_SECONDS
+    queue.send(queued_trigger(jt, "api", "a" * 40, seconds_ago=window + 30))
+    queue.send(queued_trigger(jt, "api", "b" * 40, seconds_ago=0))
+
+    run_batch(jt, queue.receive())
+
+    assert sorted(build["commit_sha"] for build in jenkins.builds) == ["a" * 40, "b" * 40]
+
+def test_coalesce_keeps_distinct_build_parameters(jt, jenkins):
+    queue = jt.InMemoryTriggerQueue()
+    for environment in ("dev", "qa"):
+        trigger = queued_trigger(jt, "api")
+        trigger["build_params"]["build_parameters"] = {"ENVIRONMENT": environment}
+        queue.send(trigger)
+
+    run_batch(jt, queue.receive())
+
+    assert sorted(b["build_parameters"]["ENVIRONMENT"] for b in jenkins.builds) == ["dev", "qa"]
+
+def test_redelivered_event_is_built_once(jt, jenkins):
+    queue = jt.InMemoryTriggerQueue()
+    event = {"id": "evt-redelivered", "job_name": "api", "branch": "main"}
+    queue.send(event)
+
+    assert run_batch(jt, queue.receive()) == {"batchItemFailures": []}
+    # The claim is completed once the invocation succeeds
+    assert jt._claims == []
+    [entry] = jt.get_idempotency_store().entries.values()
+    assert entry["status"] == "completed"
+
+    queue.send(event)
+    assert run_batch(jt, queue.receive()) == {"batchItemFailures": []}
+
+    assert jenkins.built_jobs() == ["api"]
+    assert jt._claims == []
+
+def test_partial_failure_redelivers_only_failed_records(jt, jenkins):
+    jenkins.failing.add("broken")
+    queue = jt.InMemoryTriggerQueue()
+    queue.send({"id": "evt-ok", "job_name": "api", "branch": "main"})
+    broken_id = queue.send({"id": "evt-broken", "job_name": "broken", "branch": "main"})
+
+    response = run_batch(jt, queue.receive())
+
+    assert failed_ids(response) == [broken_id]
+    assert jenkins.built_jobs() == ["api"]
+    # Only the built record keeps its claim, so the redelivery is built
+    assert jt._claims == []
+    assert len(jt.get_idempotency_store().entries) == 1
+
+    jenkins.failing.clear()
+    queue.send({"id": "evt-broken", "job_name": "broken", "branch": "main"})
+    assert run_batch(jt, queue.receive()) == {"batchItemFailures": []}
+    assert jenkins.built_jobs() == ["api", "broken"]
+
+def test_partial_failure_reports_every_collapsed_record(jt, jenkins):
+    jenkins.failing.add("api")
+    queue = jt.InMemoryTriggerQueue()
+    message_ids = [
+        queue.send(queued_trigger(jt, "api", "a" * 40, seconds_ago=10)),
+        queue.send(queued_trigger(jt, "api", "b" * 40, seconds_ago=5))
+    ]
+    queue.send(queued_trigger(jt, "web"))
+
+    response = run_batch(jt, queue.receive())
+
+    assert failed_ids(response) == sorted(message_ids)
+    assert jenkins.built_jobs() == ["web"]
+
+def test_dispatch_error_fails_every_record(jt, monkeypatch):
+    def unreachable(ec2_client, use_cache=True):
+        raise Exception("EC2 unavailable")
+
+    monkeypatch.setattr(jt, "start_jenkins_master", unreachable)
+    queue = jt.InMemoryTriggerQueue()
+    message_ids = [queue.send({"id": f"evt-{job}", "job_name": job}) for job in ("api", "web")]
+
+    response = run_batch(jt, queue.receive())
+
+    assert failed_ids(response) == sorted(message_ids)
+    # Every claim was given up, so the redelivered batch is built
+    assert jt.get_idempotency_store().entries == {}
+
+def test_malformed_record_is_not_retried(jt, jenkins):
+    queue = jt.InMemoryTriggerQueue()
+    queue.send(queued_trigger(jt, "api"))
+    batch = queue.receive()
+    batch["Records"].append(dict(batch["Records"][0], messageId="local-bad", body="not json"))
+
+    response = run_batch(jt, batch)
+
+    assert response == {"batchItemFailures": []}
+    assert jenkins.built_jobs() == ["api"]
+
+def test_kafka_failure_retries_whole_batch(jt, jenkins):
+    jenkins.failing.add("broken")
+    batch = kafka_batch_event([{"job_name": "api"}, {"job_name": "broken"}])
+
+    with pytest.raises(jt.BatchRetryError):
+        run_batch(jt, batch)
+    assert jt._claims == []
+
+    # The retried batch skips the record that was built
+    jenkins.failing.clear()
+    assert run_batch(jt, batch) == {"batchItemFailures": []}
+    assert jenkins.built_jobs() == ["api", "broken"]
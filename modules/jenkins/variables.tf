@@ -71,6 +71,54 @@ variable "max_jenkins_agents" {
   default     = 5
 }
 
+variable "min_jenkins_agents" {
+  description = "Minimum number of Jenkins agents kept by the autoscaler"
+  type        = number
+  default     = 0
+}
+
+variable "enable_agent_autoscaler" {
+  description = "Periodically size Jenkins agents to the build queue (requires enable_auto_shutdown)"
+  type        = bool
+  default     = true
+}
+
+variable "agent_autoscale_schedule" {
+  description = "Schedule expression for the queue-aware agent autoscaler"
+  type        = string
+  default     = "rate(2 minutes)"
+}
+
+variable "agent_prewarm_lead_minutes" {
+  description = "Minutes ahead of a forecast build peak to pre-warm agents"
+  type        = number
+  default     = 15
+}
+
+variable "warm_agent_count" {
+  description = "Agents kept running during the warm agent window so the first builds do not wait for a spot launch"
+  type        = number
+  default     = 0
+}
+
+variable "warm_agent_hours" {
+  description = "Daily warm agent window in UTC, e.g. 08:00-22:00"
+  type        = string
+  default     = "08:00-22:00"
+}
+
+variable "warm_agent_days" {
+  description = "Days the warm agent window applies, e.g. MON-FRI"
+  type        = string
+  default     = "MON-FRI"
+}
+
+variable "enable_spot_interruption_handling" {
+  description = "Launch replacement agents when EC2 warns that a spot agent is about to be reclaimed"
+  type        = bool
+  default     = true
+}
+
 variable "spot_max_price" {
   description = "Maximum price for Spot instances (per hour)"
   type        = string
@@ -98,6 +146,97 @@ variable "enable_jenkins_alb" {
   default     = false
 }
 
+# Build Trigger Settings
+variable "max_pending_drain_attempts" {
+  description = "Maximum re-scheduled attempts to fire build triggers queued while the master boots"
+  type        = number
+  default     = 10
+}
+
+variable "pending_drain_base_delay_seconds" {
+  description = "Delay before the first re-check of triggers parked while the master boots; doubles per attempt up to 900"
+  type        = number
+  default     = 15
+}
+
+variable "enable_trigger_batching" {
+  description = "Buffer build triggers in SQS and dispatch them to Jenkins in coalesced batches"
+  type        = bool
+  default     = false
+}
+
+variable "trigger_coalesce_window_seconds" {
+  description = "Window in which duplicate triggers for the same job, repository and branch are collapsed (max 300)"
+  type        = number
+  default     = 60
+}
+
+variable "trigger_kinesis_stream_arn" {
+  description = "Kinesis stream of build requests consumed by the trigger Lambda (empty to disable)"
+  type        = string
+  default     = ""
+}
+
+variable "trigger_msk_cluster_arn" {
+  description = "MSK cluster whose trigger_kafka_topic carries build requests (empty to disable)"
+  type        = string
+  default     = ""
+}
+
+variable "trigger_kafka_bootstrap_servers" {
+  description = "Comma-separated bootstrap servers of a self-managed Kafka, e.g. the one from modules/kafka (empty to disable)"
+  type        = string
+  default     = ""
+}
+
+variable "trigger_kafka_topic" {
+  description = "Kafka topic the trigger Lambda consumes build requests from"
+  type        = string
+  default     = "jenkins-build-requests"
+}
+
+variable "trigger_stream_batch_size" {
+  description = "Maximum build requests per Kinesis or Kafka batch"
+  type        = number
+  default     = 100
+}
+
+variable "enable_trigger_idempotency" {
+  description = "Drop duplicate build trigger deliveries using a DynamoDB idempotency table"
+  type        = bool
+  default     = true
+}
+
+variable "trigger_idempotency_ttl_seconds" {
+  description = "How long a triggered commit, S3 object or event is remembered as already built"
+  type        = number
+  default     = 3600
+}
+
+variable "build_follow_mode" {
+  description = "Follow triggered builds past the Jenkins queue: off, build_number, completion or async"
+  type        = string
+  default     = "off"
+}
+
+variable "build_follow_timeout_seconds" {
+  description = "Seconds the trigger Lambda polls a queued build before handing it to a follow-up invocation"
+  type        = number
+  default     = 20
+}
+
+variable "build_rules" {
+  description = "Path and branch rules mapping pushes to Jenkins jobs; pushes no rule matches are dropped before the master is started. null builds every push"
+  type        = any
+  default     = null
+}
+
+variable "build_rules_s3_uri" {
+  description = "s3:// URI of a build rules JSON document in the artifacts bucket, used when build_rules is null"
+  type        = string
+  default     = ""
+}
+
 # Cost Optimization Settings
 variable "enable_auto_shutdown" {
   description = "Enable automatic shutdown of Jenkins master during off-hours"
@@ -117,12 +256,70 @@ variable "startup_schedule" {
   default     = "0 8 * * MON-FRI" # 8 AM UTC, Monday to Friday
 }
 
+variable "enable_idle_shutdown" {
+  description = "Stop the Jenkins master and agents once Jenkins has been idle for idle_shutdown_minutes"
+  type        = bool
+  default     = false
+}
+
+variable "idle_check_schedule" {
+  description = "Schedule expression for the idle shutdown check"
+  type        = string
+  default     = "rate(10 minutes)"
+}
+
+variable "idle_shutdown_minutes" {
+  description = "Minutes without queued or running builds before Jenkins is stopped"
+  type        = number
+  default     = 60
+}
+
+variable "idle_cpu_threshold" {
+  description = "CPU utilization (percent) above which the master or an agent counts as busy"
+  type        = number
+  default     = 10
+}
+
+variable "trigger_log_compaction_schedule" {
+  description = "Cron expression for compacting build trigger logs (UTC)"
+  type        = string
+  default     = "15 0 * * ? *" # 00:15 UTC daily
+}
+
+variable "fleet_registry" {
+  description = "Jenkins fleets the cost optimizer manages in addition to this module's own master and agents"
+  type = list(object({
+    name                = string
+    jenkins_instance_id = string
+    asg_name            = string
+  }))
+  default = []
+}
+
+variable "enable_fleet_discovery" {
+  description = "Discover Jenkins fleets by their Type=jenkins-master tags instead of a fixed registry"
+  type        = bool
+  default     = false
+}
+
+variable "fleet_max_concurrency" {
+  description = "Maximum fleets the cost optimizer acts on concurrently"
+  type        = number
+  default     = 8
+}
+
 variable "agent_idle_timeout" {
   description = "Time in minutes before idle agents are terminated"
   type        = number
   default     = 30
 }
 
+variable "agent_drain_timeout_minutes" {
+  description = "Minutes scale-in and shutdown wait for builds on draining agents before terminating them anyway"
+  type        = number
+  default     = 30
+}
+
 # Build Configuration
 variable "default_build_timeout" {
   description = "Default build timeout in minutes"
@@ -136,6 +333,19 @@ variable "concurrent_builds" {
   default     = 3
 }
 
+# Monitoring
+variable "metrics_mode" {
+  description = "How the Lambdas publish metrics: emf (log lines, no API calls), api (batched PutMetricData) or off"
+  type        = string
+  default     = "emf"
+}
+
+variable "trigger_trace_profiler" {
+  description = "Sampling profiler for the build trigger Lambda: off, cold (first invocation per container) or always"
+  type        = string
+  default     = "off"
+}
+
 # Notification Settings
 variable "slack_webhook_url" {
   description = "Slack webhook URL for build notifications"